@@ -21,9 +21,11 @@
 #####################################################################
 
 import pygame
+import numpy
 import Log
 import time
 import sys
+import threading
 from Task import Task
 
 # Yeah, py2exe is weird...
@@ -34,11 +36,10 @@ if hasattr(sys, "frozen"):
 # Pyglet-based audio is still experimental at the moment
 #import pyglet
 
-# OGG support disabled due to incompatibility with Python 2.5
-#try:
-#  import ogg.vorbis
-#except ImportError:
-#  Log.warn("PyOGG not found. OGG files will be fully decoded prior to playing; expect absurd memory usage.")
+try:
+  import ogg.vorbis
+except ImportError:
+  Log.warn("PyOGG not found. OGG files will be fully decoded prior to playing; expect absurd memory usage.")
 
 if "pyglet" in sys.modules:
   class AudioPyglet(Task):
@@ -278,17 +279,183 @@ else: # pygame
     def fadeout(self, time):
       self.sound.fadeout(time)
 
-if "ogg.vorbis" in sys.modules:
-  import struct
-  import numpy
+class PcmRing(object):
+  """
+  Preallocated ring of stereo 16-bit PCM blocks.
+
+  One thread produces: it fills the block returned by L{getWriteBlock} and
+  hands it over with L{commit}. Another consumes: it takes the oldest finished
+  block with L{peek} and gives it back with L{release}. Each side only advances
+  its own counter, so no locking is needed.
+
+  C{minFill} is the fewest blocks the consumer had left when the producer
+  committed a new one, counted once the ring has been full after a reset. A
+  producer that keeps up commits into a ring that is one short of full, so a
+  low value shows how close playback came to running dry. It is kept across
+  resets together with the C{underruns} counter, so the ring can be sized
+  from a whole session of play.
+  """
+  def __init__(self, blockCount = 8, blockSize = 1024 * 64):
+    self.blockSize  = blockSize
+    self.blocks     = numpy.zeros((blockCount, blockSize, 2), dtype = numpy.int16)
+    self.lengths    = [0] * blockCount
+    self.underruns  = 0
+    self.minFill    = blockCount
+    self.reset()
+
+  def reset(self):
+    """Discard all blocks. Neither side may be using the ring meanwhile."""
+    self.writeCount = 0
+    self.readCount  = 0
+    self.primed     = False
+
+  def __len__(self):
+    return self.writeCount - self.readCount
+
+  def isFull(self):
+    return len(self) >= len(self.blocks)
+
+  def getWriteBlock(self):
+    """
+    @return:    The next free block as a (blockSize, 2) array, or None if the ring is full
+    """
+    if self.isFull():
+      self.primed = True
+      return None
+    return self.blocks[self.writeCount % len(self.blocks)]
+
+  def commit(self, length):
+    """
+    Hand the block from L{getWriteBlock} over to the consumer.
+
+    @param length:  Number of valid samples in the block
+    """
+    if self.primed:
+      self.minFill = min(self.minFill, len(self))
+    self.lengths[self.writeCount % len(self.blocks)] = length
+    self.writeCount += 1
+
+  def peek(self):
+    """
+    @return:    The oldest finished block trimmed to its length, or None if the ring is empty
+    """
+    if not len(self):
+      return None
+    i = self.readCount % len(self.blocks)
+    return self.blocks[i, :self.lengths[i]]
+
+  def release(self):
+    """Give the block from L{peek} back to the producer."""
+    self.readCount += 1
+
+class PcmDecoder(threading.Thread):
+  """
+  Decodes streams into L{PcmRing}s until they end.
+
+  A stream only needs a C{read()} method that returns interleaved 16-bit
+  stereo PCM as a bytes-like object, and an empty one at the end. Several
+  streams are decoded in lockstep, one block each, so the nth block of every
+  ring covers the same stretch of time.
+
+  The thread only references the streams and the rings, so a sound that is
+  dropped without being stopped can still be collected and stop its decoder.
+  """
+  def __init__(self, streams, rings):
+    threading.Thread.__init__(self, name = "PcmDecoder")
+    self.daemon    = True
+    self.streams   = streams
+    self.rings     = rings
+    self.pending   = [numpy.zeros((0, 2), dtype = numpy.int16) for stream in streams]
+    self.finished  = [False] * len(streams)
+    self.done      = False
+    self.quit      = False
+    self.wakeup    = threading.Event()
+    self.produced  = threading.Event()
+
+  def isReady(self, i):
+    """
+    @return:    True if ring C{i} has a block for the consumer or never will again
+    """
+    return len(self.rings[i]) > 0 or self.finished[i]
+
+  def run(self):
+    while not self.quit and not self.done:
+      self.wakeup.clear()
+      if any([ring.getWriteBlock() is None for ring, finished in zip(self.rings, self.finished) if not finished]):
+        # Decoding is ahead of playback; wait for the consumer to free a block
+        self.wakeup.wait()
+        continue
+      for i in range(len(self.streams)):
+        if not self.finished[i]:
+          self._decodeBlock(i)
+      self.done = all(self.finished)
+      self.produced.set()
+
+  def stop(self):
+    self.quit = True
+    self.wakeup.set()
+    self.join()
+
+  def _decodeBlock(self, i):
+    # Decoded data is viewed in place as interleaved stereo frames and copied
+    # straight into the block. Whatever does not fit is kept for the next one.
+    ring  = self.rings[i]
+    block = ring.getWriteBlock()
+    pos   = 0
+    eof   = False
+    while pos < len(block):
+      if not len(self.pending[i]):
+        data = self.streams[i].read()
+        if not data:
+          eof = True
+          break
+        self.pending[i] = numpy.frombuffer(data, dtype = numpy.int16).reshape(-1, 2)
+      n = min(len(self.pending[i]), len(block) - pos)
+      block[pos:pos + n] = self.pending[i][:n]
+      self.pending[i] = self.pending[i][n:]
+      pos += n
+
+    if pos:
+      ring.commit(pos)
+
+    # Only flag the end once the last block is visible to the consumer
+    self.finished[i] = eof
+
+class SoundStream(object):
+  """
+  Stream over a sound file that pygame decodes fully when it is opened.
+  Used for stems when OGG files cannot be streamed.
+
+  This includes song.ogg, which the mixer plays along with the other stems.
+  A three minute stem takes about 32 MB and half a second to decode, on the
+  song loader thread, so a song preview starts that much later per stem.
+  """
+  def __init__(self, fileName):
+    self.data = memoryview(pygame.mixer.Sound(fileName).get_raw())
+    self.pos  = 0
+
+  def read(self, bytes = 4096 * 4):
+    data = self.data[self.pos:self.pos + bytes]
+    self.pos += len(data)
+    return data
+
+  def seek(self, frame):
+    self.pos = min(frame * 4, len(self.data))
 
+if "ogg.vorbis" in sys.modules:
   class OggStream(object):
     def __init__(self, inputFileName):
-      self.file = ogg.vorbis.VorbisFile(inputFileName)
+      self.fileName = inputFileName
+      self.file     = ogg.vorbis.VorbisFile(inputFileName)
 
     def read(self, bytes = 4096):
       (data, bytes, bit) = self.file.read(bytes)
-      return data[:bytes]
+      return memoryview(data)[:bytes]
+
+    def seek(self, frame):
+      # libvorbisfile bisects the pages for the granule position, so this does
+      # not depend on how far into the file the frame is
+      self.file.pcm_seek(frame)
 
   class StreamingOggSound(Sound, Task):
     def __init__(self, engine, channel, fileName):
@@ -300,38 +467,42 @@ if "ogg.vorbis" in sys.modules:
       self.bufferSize   = 1024 * 64
       self.bufferCount  = 8
       self.volume       = 1.0
-      self.buffer       = numpy.zeros((2 * self.bufferSize, 2), dtype = numpy.int16)
-      self.decodingRate = 4
+      self.ring         = PcmRing(self.bufferCount, self.bufferSize)
+      self.decoder      = None
+      # One buffer playing, one queued and one spare to copy the next block into
+      self.soundBuffers = [pygame.sndarray.make_sound(numpy.zeros((self.bufferSize, 2), dtype = numpy.int16)) for i in range(3)]
       self._reset()
 
     def _reset(self):
-      self.stream        = OggStream(self.fileName)
-      self.buffersIn     = [pygame.sndarray.make_sound(numpy.zeros((self.bufferSize, 2), dtype = numpy.int16)) for i in range(self.bufferCount + 1)]
-      self.buffersOut    = []
-      self.buffersBusy   = []
-      self.bufferPos     = 0
-      self.done          = False
+      if self.decoder:
+        self.decoder.stop()
+      self.ring.reset()
+      self.soundPos      = 0
+      self.starved       = False
       self.lastQueueTime = time.time()
-
-      while len(self.buffersOut) < self.bufferCount and not self.done:
-        self._produceSoundBuffers()
+      self.decoder       = PcmDecoder([OggStream(self.fileName)], [self.ring])
+      self.decoder.start()
 
     def __del__(self):
+      if self.decoder:
+        self.decoder.stop()
       self.engine.removeTask(self)
 
     def play(self):
       if self.playing:
         return
 
+      # Let the decoder fill the ring before starting
+      while not self.ring.isFull() and not self.decoder.done:
+        self.decoder.produced.wait(0.1)
+        self.decoder.produced.clear()
+
       self.engine.addTask(self, synchronized = False)
       self.playing = True
-
-      while len(self.buffersOut) < self.bufferCount and not self.done:
-        self._produceSoundBuffers()
-
-      self.channel.play(self.buffersOut.pop())
+      self._queueBlock()
 
     def stop(self):
+      Log.debug("%s: %d underruns, lowest fill %d of %d blocks." % (self.fileName, self.ring.underruns, self.ring.minFill, len(self.ring.blocks)))
       self.playing = False
       self.channel.stop()
       self.engine.removeTask(self)
@@ -343,48 +514,26 @@ if "ogg.vorbis" in sys.modules:
     def fadeout(self, time):
       self.stop()
 
-    def _decodeStream(self):
-      # No available buffers to fill?
-      if not self.buffersIn or self.done:
-        return
+    def _queueBlock(self):
+      block = self.ring.peek()
+      if block is None:
+        return False
 
-      data = self.stream.read()
+      # Copy the block to a sound buffer that is not in use and free the block
+      soundBuffer = self.soundBuffers[self.soundPos % len(self.soundBuffers)]
+      self.soundPos += 1
+      samples = pygame.sndarray.samples(soundBuffer)
+      samples[:len(block)] = block
+      samples[len(block):] = 0
+      self.ring.release()
+      self.decoder.wakeup.set()
 
-      if not data:
-        self.done = True
+      self.lastQueueTime = time.time()
+      if self.channel.get_busy():
+        self.channel.queue(soundBuffer)
       else:
-        data = struct.unpack("%dh" % (len(data) / 2), data)
-        samples = len(data) / 2
-        self.buffer[self.bufferPos:self.bufferPos + samples, 0] = data[0::2]
-        self.buffer[self.bufferPos:self.bufferPos + samples, 1] = data[1::2]
-        self.bufferPos += samples
-
-      # If we have at least one full buffer decode, claim a buffer and copy the
-      # data over to it.
-      if self.bufferPos >= self.bufferSize or (self.done and self.bufferPos):
-        # Claim the sound buffer and copy the data
-        if self.bufferPos < self.bufferSize:
-          self.buffer[self.bufferPos:]  = 0
-        soundBuffer = self.buffersIn.pop()
-        pygame.sndarray.samples(soundBuffer)[:] = self.buffer[0:self.bufferSize]
-
-        # Discard the copied sound data
-        n = max(0, self.bufferPos - self.bufferSize)
-        self.buffer[0:n] = self.buffer[self.bufferSize:self.bufferSize+n]
-        self.bufferPos   = n
-
-        return soundBuffer
-
-    def _produceSoundBuffers(self):
-      # Decode enough that we have at least one full sound buffer
-      # ready in the queue if possible
-      while not self.done:
-        for i in xrange(self.decodingRate):
-          soundBuffer = self._decodeStream()
-          if soundBuffer:
-            self.buffersOut.insert(0, soundBuffer)
-        if self.buffersOut:
-          break
+        self.channel.play(soundBuffer)
+      return True
 
     def run(self, ticks):
       if not self.playing:
@@ -392,19 +541,15 @@ if "ogg.vorbis" in sys.modules:
 
       self.channel.set_volume(self.volume)
 
-      if len(self.buffersOut) < self.bufferCount:
-        self._produceSoundBuffers()
-
-      if not self.channel.get_queue() and self.buffersOut:
-        # Queue one decoded sound buffer and mark the previously played buffer as free
-        soundBuffer = self.buffersOut.pop()
-        self.buffersBusy.insert(0, soundBuffer)
-        self.lastQueueTime = time.time()
-        self.channel.queue(soundBuffer)
-        if len(self.buffersBusy) > 2:
-          self.buffersIn.insert(0, self.buffersBusy.pop())
+      if not self.channel.get_queue():
+        if self._queueBlock():
+          self.starved = False
+        elif not self.decoder.done and not self.channel.get_busy() and not self.starved:
+          # The channel ran dry before the decoder produced the next block
+          self.ring.underruns += 1
+          self.starved = True
 
-      if not self.buffersOut and self.done and time.time() - self.lastQueueTime > 4:
+      if self.decoder.done and not len(self.ring) and time.time() - self.lastQueueTime > 4:
         self.stop()
 
   class StreamingSound(Sound, Task):
@@ -442,3 +587,359 @@ else: # pyglet & pygame
     def __init__(self, engine, channel, fileName):
       Sound.__init__(self, fileName)
 
+class Clock(object):
+  """
+  Playback position of a stream that is fed to the audio output in blocks.
+
+  The owner reports the samples it hands to the output with L{submit} and the
+  samples the output is seen to have played with L{consume}. Those sightings
+  only come at block boundaries, and only as often as the owner polls, so in
+  between the position is extrapolated from the high resolution wall clock and
+  each sighting only nudges the extrapolation towards it. The reported position
+  never goes backwards and never runs ahead of the submitted samples.
+  """
+  def __init__(self, frequency, smoothing = 0.1, resyncTime = 100.0, timer = time.perf_counter):
+    """
+    @param frequency:   Sample rate of the stream
+    @param smoothing:   Fraction of the error to correct on each sighting
+    @param resyncTime:  Error in milliseconds after which the clock jumps instead
+    @param timer:       Wall clock in seconds
+    """
+    self.frequency  = frequency
+    self.smoothing  = smoothing
+    self.resyncTime = resyncTime
+    self.timer      = timer
+    self.reset()
+
+  def reset(self, frames = 0):
+    """
+    Stop the clock at the given sample.
+
+    @param frames:  Sample the next submitted block starts at
+    """
+    self.submitted    = frames
+    self.consumed     = frames
+    self.anchorFrames = float(frames)
+    self.anchorTime   = None
+    self.paused       = False
+    self.lastPosition = frames * 1000.0 / self.frequency
+
+  def _extrapolate(self, t):
+    if self.anchorTime is None:
+      return self.anchorFrames
+    return self.anchorFrames + (t - self.anchorTime) * self.frequency
+
+  def submit(self, frames):
+    """Samples were queued for output."""
+    self.submitted += frames
+
+  def start(self, t = None):
+    """The output started playing the first unconsumed sample at time C{t}."""
+    if t is None:
+      t = self.timer()
+    self.anchorFrames = float(self.consumed)
+    self.anchorTime   = None if self.paused else t
+
+  def consume(self, frames, t = None):
+    """The output was seen to finish playing C{frames} more samples at time C{t}."""
+    self.consumed += frames
+    if self.anchorTime is None:
+      return
+    if t is None:
+      t = self.timer()
+    predicted = self._extrapolate(t)
+    error = self.consumed - predicted
+    if abs(error) * 1000.0 / self.frequency > self.resyncTime:
+      self.anchorFrames = float(self.consumed)
+    else:
+      self.anchorFrames = predicted + error * self.smoothing
+    self.anchorTime = t
+
+  def pause(self, t = None):
+    if t is None:
+      t = self.timer()
+    if self.anchorTime is not None:
+      self.anchorFrames = self._extrapolate(t)
+      self.anchorTime   = None
+      self.paused       = True
+
+  def unpause(self, t = None):
+    if t is None:
+      t = self.timer()
+    if self.paused:
+      self.anchorTime = t
+      self.paused     = False
+
+  def getPosition(self, t = None):
+    """
+    @return:    Monotonic playback position in milliseconds
+    """
+    if t is None:
+      t = self.timer()
+    frames = min(self._extrapolate(t), self.submitted)
+    self.lastPosition = max(self.lastPosition, frames * 1000.0 / self.frequency)
+    return self.lastPosition
+
+def openPcmStream(fileName):
+  """
+  Open a sound file for a L{PcmDecoder}, streaming it if possible. OGG files
+  are only streamed with pyvorbis; otherwise see L{SoundStream} for the cost.
+
+  @param fileName:  Sound file name
+  @return:          Stream with C{read()} and C{seek(frame)} methods
+  """
+  if "ogg.vorbis" in sys.modules and fileName.lower().endswith(".ogg") and pygame.mixer.get_init()[0] == 44100:
+    return OggStream(fileName)
+  return SoundStream(fileName)
+
+class StemMixer(object):
+  """
+  Plays the stems of a song as a single stream on one channel.
+
+  All stems are decoded by one L{PcmDecoder} and mixed block by block into the
+  sound buffers queued on the channel, so they cannot drift apart. The channel
+  only holds one queued buffer, so the mixing and queueing run on a feeder
+  thread that polls the channel several times per block; a slow frame in the
+  game does not starve the output. Another sound played on the channel, such
+  as the next song taking over from a fading one, ends the mixer's playback.
+  Gain changes are ramped over a block to
+  avoid clicks, and L{getPosition} reports the position of the mixed stream.
+  """
+  def __init__(self, channel, stems, blockSize = 2048, blockCount = 32):
+    """
+    @param channel:     L{Channel} to play on
+    @param stems:       Dictionary of stem names to streams from L{openPcmStream}
+    @param blockSize:   Samples per mixed block. Gain changes are heard within two blocks.
+    @param blockCount:  Number of blocks decoded ahead for each stem
+    """
+    self.channel      = channel.channel
+    self.names        = list(stems.keys())
+    self.streams      = [stems[name] for name in self.names]
+    self.rings        = [PcmRing(blockCount, blockSize) for name in self.names]
+    self.gains        = [1.0] * len(self.names)
+    self.levels       = [1.0] * len(self.names)
+    self.frequency    = pygame.mixer.get_init()[0]
+    self.mix          = numpy.zeros((blockSize, 2), dtype = numpy.float32)
+    self.scratch      = numpy.zeros((blockSize, 2), dtype = numpy.float32)
+    # One buffer playing, one queued and one spare to mix the next block into
+    self.soundBuffers = [pygame.sndarray.make_sound(numpy.zeros((blockSize, 2), dtype = numpy.int16)) for i in range(3)]
+    self.pollInterval = blockSize / float(self.frequency) / 8
+    self.clock        = Clock(self.frequency)
+    self.lock         = threading.Lock()
+    self.playing      = False
+    self.underruns    = 0
+    self.decoder      = None
+    self.feeder       = None
+    self._reset()
+
+  @staticmethod
+  def isSupported():
+    """
+    @return:    True if the audio output is in the 16-bit stereo format the mixer produces
+    """
+    init = pygame.mixer.get_init()
+    return init is not None and init[1] == -16 and init[2] == 2
+
+  def _reset(self, frame = 0):
+    if self.decoder:
+      self.decoder.stop()
+    for stream in self.streams:
+      stream.seek(frame)
+    for ring in self.rings:
+      ring.reset()
+    self.startFrame    = frame
+    self.soundPos      = 0
+    self.starved       = False
+    self.queued        = []
+    self.currentFrames = 0
+    self.fadeFrames    = 0
+    self.fadeLeft      = 0
+    self.lastPoll      = self.clock.timer()
+    self.clock.reset(frame)
+    self.decoder       = PcmDecoder(self.streams, self.rings)
+    self.decoder.start()
+
+  def __del__(self):
+    # The feeder thread keeps the mixer alive while it plays, so only the
+    # decoder can still be running here
+    if self.decoder:
+      self.decoder.stop()
+
+  def hasStem(self, name):
+    return name in self.names
+
+  def setGain(self, name, gain):
+    """
+    Set the gain of a stem. The change is ramped in over the next mixed block.
+
+    @param name:  Stem name
+    @param gain:  Gain from 0.0 to 1.0
+    """
+    if name in self.names:
+      self.gains[self.names.index(name)] = gain
+
+  def play(self, start = 0.0):
+    """
+    Start playing.
+
+    @param start:  Position to start at in milliseconds
+    """
+    if self.playing:
+      return
+    self._stopFeeder()
+
+    # Stopping rewinds and refills the rings, so only seek for other positions
+    # or after the stream has played to the end
+    frame = int(start * self.frequency / 1000.0)
+    if frame != self.startFrame or self.soundPos:
+      self._reset(frame)
+
+    # Let the decoder fill the rings before starting
+    while not self.decoder.done and not all(ring.isFull() or finished for ring, finished in zip(self.rings, self.decoder.finished)):
+      self.decoder.produced.wait(0.1)
+      self.decoder.produced.clear()
+
+    # Nothing is audible yet, so start at the requested gains without a ramp
+    self.levels = list(self.gains)
+    self.playing = True
+    self._queueBlock()
+    self.feeder = threading.Thread(target = self._feed, name = "StemMixer")
+    self.feeder.daemon = True
+    self.feeder.start()
+
+  def _stopFeeder(self):
+    self.playing = False
+    if self.feeder:
+      self.feeder.join()
+      self.feeder = None
+
+  def stop(self):
+    self._stopFeeder()
+    Log.debug("Stem mixer: %d underruns, lowest fill %d of %d blocks." % (self.underruns, min([ring.minFill for ring in self.rings]), len(self.rings[0].blocks)))
+    self.channel.stop()
+    self._reset()
+
+  def fadeout(self, time):
+    """
+    Fade out and stop. Blocks keep being mixed until the fade is over.
+
+    @param time:  Length of the fade in milliseconds
+    """
+    with self.lock:
+      if self.playing and not self.fadeFrames:
+        self.fadeFrames = self.fadeLeft = max(1, int(time * self.frequency / 1000.0))
+
+  def pause(self):
+    with self.lock:
+      self.clock.pause()
+
+  def unpause(self):
+    with self.lock:
+      self.clock.unpause()
+
+  def isPlaying(self):
+    return self.playing
+
+  def getPosition(self):
+    """
+    @return:    Playback position of the mixed stream in milliseconds, see L{Clock}
+    """
+    with self.lock:
+      if self.playing:
+        self._advance()
+      return self.clock.getPosition()
+
+  def _isOwnSound(self, sound):
+    return any([sound is soundBuffer for soundBuffer in self.soundBuffers])
+
+  def _advance(self):
+    # Tell the clock about the buffers the channel has finished since the last
+    # poll. The switch happened somewhere in between, so split the difference.
+    now  = self.clock.timer()
+    seen = (self.lastPoll + now) / 2
+    self.lastPoll = now
+    if self.queued and not self.channel.get_queue():
+      self.clock.consume(self.currentFrames, seen)
+      self.currentFrames = self.queued.pop(0)
+    if self.currentFrames and not self.channel.get_busy():
+      self.clock.consume(self.currentFrames, seen)
+      self.currentFrames = 0
+
+  def _queueBlock(self):
+    if self.fadeFrames and not self.fadeLeft:
+      return False
+    if not all([self.decoder.isReady(i) for i in range(len(self.rings))]):
+      return False
+    blocks = [ring.peek() for ring in self.rings]
+    length = max([len(block) for block in blocks if block is not None] or [0])
+    if not length:
+      return False
+
+    mix = self.mix[:length]
+    mix[:] = 0
+    for i, block in enumerate(blocks):
+      level, gain = self.levels[i], self.gains[i]
+      self.levels[i] = gain
+      if block is None:
+        continue
+      if level or gain:
+        scratch = self.scratch[:len(block)]
+        if level == gain:
+          numpy.multiply(block, gain, out = scratch)
+        else:
+          ramp = numpy.linspace(level, gain, len(block), dtype = numpy.float32)
+          numpy.multiply(block, ramp[:, numpy.newaxis], out = scratch)
+        mix[:len(block)] += scratch
+      self.rings[i].release()
+    self.decoder.wakeup.set()
+
+    if self.fadeFrames:
+      fadeEnd = max(self.fadeLeft - length, 0)
+      ramp = numpy.linspace(self.fadeLeft, fadeEnd, length, dtype = numpy.float32) / self.fadeFrames
+      mix *= ramp[:, numpy.newaxis]
+      self.fadeLeft = fadeEnd
+
+    # Mix into a sound buffer that is not in use
+    soundBuffer = self.soundBuffers[self.soundPos % len(self.soundBuffers)]
+    self.soundPos += 1
+    samples = pygame.sndarray.samples(soundBuffer)
+    numpy.clip(mix, -32768, 32767, out = mix)
+    samples[:length] = mix
+    samples[length:] = 0
+
+    # Queue behind our own buffer; anything else on the channel is cut off
+    self.clock.submit(len(samples))
+    if self._isOwnSound(self.channel.get_sound()):
+      self.channel.queue(soundBuffer)
+      self.queued.append(len(samples))
+    else:
+      self.channel.play(soundBuffer)
+      self.currentFrames = len(samples)
+      self.lastPoll      = self.clock.timer()
+      self.clock.start(self.lastPoll)
+    return True
+
+  def _feed(self):
+    while self.playing:
+      with self.lock:
+        sound = self.channel.get_sound()
+        if sound is not None and not self._isOwnSound(sound):
+          # Something else took over the channel
+          self.playing = False
+          break
+
+        self._advance()
+
+        if not self.channel.get_queue():
+          if self._queueBlock():
+            self.starved = False
+          elif not self.decoder.done and not self.fadeFrames and not self.channel.get_busy() and not self.starved:
+            # The channel ran dry before the decoder produced the next block
+            self.underruns += 1
+            self.starved = True
+
+        ended = self.decoder.done and not any([len(ring) for ring in self.rings])
+        if (ended or (self.fadeFrames and not self.fadeLeft)) and not self.channel.get_busy():
+          self.playing = False
+          break
+      time.sleep(self.pollInterval)
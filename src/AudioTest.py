@@ -21,7 +21,69 @@
 #####################################################################
 
 import unittest
-from Audio import Audio
+import threading
+import time
+import numpy
+import pygame
+from Audio import Audio, PcmRing, PcmDecoder, StemMixer, Clock
+
+class ChunkedStream(object):
+  """Hands out PCM data in chunks that do not line up with the ring blocks."""
+  def __init__(self, data, chunkSize = 4000):
+    self.data      = memoryview(data.tobytes())
+    self.pos       = 0
+    self.chunkSize = chunkSize
+
+  def read(self):
+    chunk = self.data[self.pos:self.pos + self.chunkSize]
+    self.pos += len(chunk)
+    return chunk
+
+  def seek(self, frame):
+    self.pos = frame * 4
+
+class FakeChannel(object):
+  """Records the blocks played on it. A block only ends when the test finishes it."""
+  def __init__(self):
+    self.channel = self
+    self.blocks  = []
+    self.current = None
+    self.queued  = None
+    self.polls   = 0
+
+  def play(self, sound):
+    self.blocks.append(pygame.sndarray.array(sound))
+    self.current = sound
+    self.queued  = None
+
+  def queue(self, sound):
+    self.blocks.append(pygame.sndarray.array(sound))
+    self.queued = sound
+
+  def get_sound(self):
+    return self.current
+
+  def get_busy(self):
+    return self.current is not None
+
+  def get_queue(self):
+    self.polls += 1
+    return self.queued
+
+  def stop(self):
+    self.current = self.queued = None
+
+  def wait(self, mixer):
+    """Wait for the mixer to go through its feeding loop once more."""
+    polls = self.polls + 2
+    end   = time.time() + 2.0
+    while self.polls < polls and mixer.isPlaying() and time.time() < end:
+      time.sleep(0.001)
+
+  def finish(self, mixer):
+    """End the playing block and let the mixer react."""
+    self.current, self.queued = self.queued, None
+    self.wait(mixer)
 
 class AudioTest(unittest.TestCase):
   def testOpen(self):
@@ -29,5 +91,225 @@ class AudioTest(unittest.TestCase):
     assert a.open()
     a.close()
 
+  def testPcmRing(self):
+    ring = PcmRing(blockCount = 3, blockSize = 16)
+    blocks = 20
+
+    def produce():
+      for i in range(blocks):
+        block = ring.getWriteBlock()
+        while block is None:
+          block = ring.getWriteBlock()
+        block[:] = i
+        ring.commit(i % 16 + 1)
+
+    producer = threading.Thread(target = produce)
+    producer.start()
+
+    received = []
+    while len(received) < blocks:
+      block = ring.peek()
+      if block is None:
+        continue
+      received.append((len(block), int(block.min()), int(block.max())))
+      ring.release()
+    producer.join()
+
+    assert received == [(i % 16 + 1, i, i) for i in range(blocks)]
+    assert len(ring) == 0
+    assert ring.getWriteBlock() is not None
+
+  def testPcmRingFill(self):
+    ring = PcmRing(blockCount = 3, blockSize = 16)
+
+    # Filling up the ring after a reset is not counted
+    while ring.getWriteBlock() is not None:
+      ring.commit(16)
+    assert ring.minFill == 3
+
+    # A producer that keeps up commits with one block missing
+    ring.release()
+    ring.getWriteBlock()
+    ring.commit(16)
+    assert ring.minFill == 2
+
+    ring.release()
+    ring.release()
+    ring.getWriteBlock()
+    ring.commit(16)
+    assert ring.minFill == 1
+
+    ring.reset()
+    ring.getWriteBlock()
+    ring.commit(16)
+    assert ring.minFill == 1
+
+  def testPcmDecoder(self):
+    samples = numpy.arange(2 * 5000, dtype = numpy.int16).reshape(-1, 2)
+    ring = PcmRing(blockCount = 2, blockSize = 1024)
+    decoder = PcmDecoder([ChunkedStream(samples)], [ring])
+    decoder.start()
+
+    received = []
+    while not decoder.done or len(ring):
+      block = ring.peek()
+      if block is None:
+        decoder.produced.wait(0.1)
+        decoder.produced.clear()
+        continue
+      received.append(block.copy())
+      ring.release()
+      decoder.wakeup.set()
+    decoder.join()
+
+    assert [len(block) for block in received] == [1024] * 4 + [904]
+    assert (numpy.concatenate(received) == samples).all()
+
+  def testStemMixer(self):
+    a = Audio()
+    a.open(44100, 16, True, 1024)
+    try:
+      song    = numpy.full((8192, 2), 1000, dtype = numpy.int16)
+      guitar  = numpy.full((6000, 2), 2000, dtype = numpy.int16)
+      channel = FakeChannel()
+      mixer   = StemMixer(channel, {"song": ChunkedStream(song), "guitar": ChunkedStream(guitar)},
+                          blockSize = 2048, blockCount = 4)
+      mixer.play()
+      channel.wait(mixer)
+
+      # Muting the guitar ramps its gain down over the next block
+      mixer.setGain("guitar", 0.0)
+      while mixer.isPlaying():
+        channel.finish(mixer)
+      mixer.stop()
+
+      mixed = channel.blocks
+      assert len(mixed) == 4
+      assert (mixed[0] == 3000).all() and (mixed[1] == 3000).all()
+      ramp = mixed[2][:, 0]
+      assert ramp[0] == 3000 and ramp[-1] == 1000 and (numpy.diff(ramp) <= 0).all()
+      assert (mixed[3] == 1000).all()
+    finally:
+      a.close()
+
+  def testStemMixerFadeout(self):
+    a = Audio()
+    a.open(44100, 16, True, 1024)
+    try:
+      song    = numpy.full((8 * 2048, 2), 1000, dtype = numpy.int16)
+      channel = FakeChannel()
+      mixer   = StemMixer(channel, {"song": ChunkedStream(song)}, blockSize = 2048, blockCount = 4)
+      mixer.play()
+      channel.wait(mixer)
+
+      # The fade goes on over the following blocks, then the mixer stops
+      mixer.fadeout(2 * 2048 * 1000.0 / 44100)
+      while mixer.isPlaying():
+        channel.finish(mixer)
+
+      assert len(channel.blocks) == 4
+      fade = numpy.concatenate(channel.blocks[2:])[:, 0]
+      assert fade[0] == 1000 and fade[2047] == 500 and fade[-1] == 0
+      assert (numpy.diff(fade) <= 0).all()
+      mixer.stop()
+    finally:
+      a.close()
+
+  def testStemMixerTakeOver(self):
+    a = Audio()
+    a.open(44100, 16, True, 1024)
+    try:
+      channel = FakeChannel()
+      first   = StemMixer(channel, {"song": ChunkedStream(numpy.full((16 * 2048, 2), 1000, dtype = numpy.int16))},
+                          blockSize = 2048, blockCount = 4)
+      second  = StemMixer(channel, {"song": ChunkedStream(numpy.full((16 * 2048, 2), 2000, dtype = numpy.int16))},
+                          blockSize = 2048, blockCount = 4)
+      first.play()
+      channel.wait(first)
+
+      # The next song starts right away and the fading one stops feeding
+      first.fadeout(1000)
+      count = len(channel.blocks)
+      second.play()
+      assert channel.current in second.soundBuffers
+      assert second.clock.anchorTime is not None
+      for i in range(3):
+        channel.finish(second)
+      channel.wait(first)
+      assert not first.isPlaying() and second.isPlaying()
+      assert all([(block == 2000).all() for block in channel.blocks[count:]])
+      assert len(channel.blocks) == count + 5
+
+      second.stop()
+      first.stop()
+    finally:
+      a.close()
+
+  def testStemMixerSeek(self):
+    a = Audio()
+    a.open(44100, 16, True, 1024)
+    try:
+      song    = numpy.arange(2 * 44100, dtype = numpy.int16).reshape(-1, 2)
+      guitar  = -song
+      channel = FakeChannel()
+      mixer   = StemMixer(channel, {"song": ChunkedStream(song), "guitar": ChunkedStream(guitar)},
+                          blockSize = 2048, blockCount = 4)
+      mixer.setGain("guitar", 0.0)
+      mixer.play(start = 500.0)
+      assert mixer.getPosition() >= 500.0
+
+      # Both stems pick up at the same sample, and the muted guitar stays silent
+      assert (channel.blocks[0] == song[22050:22050 + 2048]).all()
+      mixer.stop()
+      assert mixer.getPosition() == 0.0
+    finally:
+      a.close()
+
+  def testStemMixerReplay(self):
+    a = Audio()
+    a.open(44100, 16, True, 1024)
+    try:
+      song    = numpy.full((4096, 2), 1000, dtype = numpy.int16)
+      channel = FakeChannel()
+      mixer   = StemMixer(channel, {"song": ChunkedStream(song)}, blockSize = 2048, blockCount = 4)
+
+      # Play to the end, then again from the same position
+      mixer.play()
+      while mixer.isPlaying():
+        channel.finish(mixer)
+      count = len(channel.blocks)
+      mixer.play()
+      assert (channel.blocks[count] == 1000).all()
+      mixer.stop()
+    finally:
+      a.close()
+
+  def testClock(self):
+    clock = Clock(1000, timer = lambda: 0.0)
+    clock.submit(300)
+    assert clock.getPosition(1.0) == 0.0
+
+    # Extrapolated from the wall clock, but never past the submitted samples
+    clock.start(1.0)
+    assert clock.getPosition(1.0625) == 62.5
+    assert clock.getPosition(1.5) == 300.0
+
+    # Late sightings pull the clock back gradually without reporting an earlier position
+    clock.reset()
+    clock.submit(1000)
+    clock.start(1.0)
+    assert clock.getPosition(1.25) == 250.0
+    clock.consume(200, 1.25)
+    assert clock.anchorFrames < 250.0
+    assert clock.getPosition(1.25) == 250.0
+    assert 250.0 < clock.getPosition(1.375) < 375.0
+
+    # Pausing freezes the position
+    clock.pause(1.375)
+    position = clock.getPosition(1.375)
+    assert clock.getPosition(5.0) == position
+    clock.unpause(5.0)
+    assert abs(clock.getPosition(5.0625) - (position + 62.5)) < 1e-6
+
 if __name__ == "__main__":
   unittest.main()
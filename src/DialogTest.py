@@ -22,7 +22,7 @@
 
 import unittest
 from GameEngine import GameEngine
-from Dialogs import getText
+from Dialogs import getText, GetText
 from View import Layer
 
 class TestLayer(Layer):
@@ -35,6 +35,13 @@ class TestLayer(Layer):
       self.text = "tmp"
       self.text = getText(self.engine, "Enter name:", "Wario")
 
+class GetTextTest(unittest.TestCase):
+  def testRun(self):
+    layer = GetText(None, "Enter name:", "Wario")
+    layer.run(50)
+    assert layer.time == 1.0
+    assert layer.text == "Wario"
+
 class DialogTestInteractive(unittest.TestCase):
   def testGetTest(self):
     text = getText(self.e, "Please enter your name:", "Wario")
@@ -28,6 +28,7 @@ from OpenGL.GLU import *
 import math
 import os
 import fnmatch
+from queue import Queue, Empty
 
 from View import Layer, BackgroundLayer
 from Input import KeyListener
@@ -346,6 +347,11 @@ class SongChooser(Layer, KeyListener):
     self.library        = selectedLibrary
     self.searchText     = ""
     self.playSongName   = ""
+    self.items          = []
+    self.songs          = []
+    self.songQueue      = Queue()
+    self.scanCount      = 0
+    self.initialItemPending = False
 
     self.cassetteShow   = not self.engine.config.get("game", "compactlist")
     self.autoPreview    = self.engine.config.get("game", "autopreview")
@@ -364,34 +370,89 @@ class SongChooser(Layer, KeyListener):
 
   def loadCollection(self):
     self.loaded = False
+    self.scanCount += 1
     self.engine.resource.load(self, "libraries", lambda: Song.getAvailableLibraries(self.engine, self.library), onLoad = self.libraryListLoaded)
-    showLoadingScreen(self.engine, lambda: self.loaded, text = _("Browsing Collection..."))
+    showLoadingScreen(self.engine, self.updateSongList, text = _("Browsing Collection..."))
 
   def libraryListLoaded(self, libraries):
-    self.engine.resource.load(self, "songs",     lambda: Song.getAvailableSongs(self.engine, self.library), onLoad = self.songListLoaded)
+    # Songs are streamed through the queue while the library is scanned
+    scan    = self.scanCount
+    library = self.library
+    workers = self.engine.config.get("game", "scanworkers")
+    self.songs = []
+    self.engine.resource.load(self, None, lambda: Song.scanLibrary(self.engine, library, workers = workers,
+                                                                   callback = lambda songs: self.songQueue.put((scan, songs))),
+                              onLoad = lambda songs: self.songListLoaded(songs, scan))
+
+  def updateSongList(self):
+    """Add the songs found so far by the library scan. Returns True once there is something to show."""
+    found = []
+    while True:
+      try:
+        scan, songs = self.songQueue.get_nowait()
+      except Empty:
+        break
+      if scan == self.scanCount:
+        found += songs
+    if found:
+      self.setSongs(self.songs + found)
+    return self.loaded
+
+  def songListLoaded(self, songs, scan):
+    if scan != self.scanCount:
+      return
+    # The queue only holds batches that are already part of the final list
+    while not self.songQueue.empty():
+      self.songQueue.get_nowait()
+    self.setSongs(songs)
+
+  def setSongs(self, songs):
+    if not self.loaded:
+      self.showSongs(songs)
+      return
+    # Keep the selection and the loaded labels while the list fills up
+    labels   = dict(zip([id(item) for item in self.items], self.itemLabels))
+    angles   = dict(zip([id(item) for item in self.items], self.itemAngles))
+    selected = self.selectedItem
+    self.songs      = sorted(songs, key = lambda s: s.name)
+    self.items      = self.libraries + self.songs
+    self.itemLabels = [labels.get(id(item)) for item in self.items]
+    self.itemAngles = [angles.get(id(item), 0.0) for item in self.items]
+    if self.initialItemPending and self.selectInitialItem():
+      self.updateSelection()
+    elif selected in self.items:
+      self.selectedIndex = self.items.index(selected)
+
+  def selectInitialItem(self):
+    if self.initialItem is None:
+      return False
+    for i, item in enumerate(self.items):
+      if isinstance(item, Song.SongInfo) and self.initialItem == item.songName:
+        self.selectedIndex =  i
+        return True
+      elif isinstance(item, Song.LibraryInfo) and self.initialItem == item.libraryName:
+        self.selectedIndex =  i
+        return True
+    return False
 
-  def songListLoaded(self, songs):
+  def showSongs(self, songs):
     if self.songLoader:
       self.songLoader.cancel()
+    self.songs         = sorted(songs, key = lambda s: s.name)
     self.selectedIndex = 0
     self.items         = self.libraries + self.songs
     self.itemAngles    = [0.0] * len(self.items)
     self.itemLabels    = [None] * len(self.items)
     self.loaded        = True
     self.searchText    = ""
-    if self.initialItem is not None:
-      for i, item in enumerate(self.items):
-        if isinstance(item, Song.SongInfo) and self.initialItem == item.songName:
-          self.selectedIndex =  i
-          break
-        elif isinstance(item, Song.LibraryInfo) and self.initialItem == item.libraryName:
-          self.selectedIndex =  i
-          break
+    found = self.selectInitialItem()
     # Load labels for libraries right away
     for i, item in enumerate(self.items):
       if isinstance(item, Song.LibraryInfo):
         self.loadItemLabel(i)
     self.updateSelection()
+    # The initial song may still be on its way from the library scan
+    self.initialItemPending = not found
     
   def shown(self):
     self.engine.input.addKeyListener(self, priority = True)
@@ -426,6 +487,7 @@ class SongChooser(Layer, KeyListener):
         self.itemLabels[i] = Texture(label)
 
   def updateSelection(self):
+    self.initialItemPending = False
     self.selectedItem  = self.items[self.selectedIndex]
     self.songCountdown = 1024
     self.loadItemLabel(self.selectedIndex)
@@ -572,6 +634,9 @@ class SongChooser(Layer, KeyListener):
   def run(self, ticks):
     self.time += ticks / 50.0
 
+    # Pick up songs the library scan found since the last frame
+    self.updateSongList()
+
     if self.songCountdown > 0:
       self.songCountdown -= ticks
       if self.songCountdown <= 0:
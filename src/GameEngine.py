@@ -16,7 +16,7 @@ from Video import Video
 from Audio import Audio
 from View import View
 from Input import Input, KeyListener, SystemEventListener
-from Resource import Resource
+from Resource import Resource, getWritableResourcePath
 from Data import Data
 from Server import Server
 from Session import ClientSession
@@ -30,11 +30,14 @@ import Dialogs
 import Theme
 import Version
 import Mod
+import Trace
 
 # define configuration keys
 Config.define("opengl", "svgshaders", bool, False)
+Config.define("opengl", "batchnotes", bool, True)
 Config.define("engine", "tickrate", float, 1.0)
 Config.define("engine", "highpriority", bool, True)
+Config.define("engine", "trace", bool, False)
 Config.define(
     "game",
     "uploadscores",
@@ -44,6 +47,9 @@ Config.define(
     options={False: _("No"), True: _("Yes")},
 )
 Config.define("game", "uploadurl", str, "http://fretsonfire.sourceforge.net/play")
+Config.define("game", "scanworkers", int, 4)
+Config.define("game", "simrate", int, 1000)
+Config.define("game", "replays", bool, True)
 Config.define(
     "game",
     "leftymode",
@@ -308,7 +314,12 @@ class GameEngine(Engine):
             int(viewport[0]), int(viewport[1]), int(viewport[2]), int(viewport[3])
         )
 
+        if self.config.get("engine", "trace"):
+            Trace.enable(os.path.join(getWritableResourcePath(), "trace.log"))
+
         self.input = Input()
+        self.timer.idleCallback = self.input.pollEvents
+        self.timer.frameCallback = self.input.dispatchEvents
         self.view = View(self, geometry)
         self.resizeScreen(w, h)
 
@@ -391,6 +402,7 @@ class GameEngine(Engine):
             Engine.quit(self)
 
     def quit(self):
+        Trace.disable()
         self.audio.close()
         Engine.quit(self)
 
@@ -23,15 +23,27 @@
 #####################################################################
 
 import Player
-from Song import Note, Tempo
+from Song import Note, NoteCursor, EVENT_NOTE
 from Mesh import Mesh
+from VertexBuffer import VertexBuffer
 import Theme
+import Log
 
 from OpenGL.GL import *
 import math
 import numpy
 
 KEYS = [Player.KEY1, Player.KEY2, Player.KEY3, Player.KEY4, Player.KEY5]
+KEY_MASK = Player.KEY1 | Player.KEY2 | Player.KEY3 | Player.KEY4 | Player.KEY5
+
+# Fret bitmask (bit n for fret n) for every combination of held KEYS flags
+FRET_MASKS = [
+    sum(1 << n for n, k in enumerate(KEYS) if flags & k)
+    for flags in range(KEY_MASK + 1)
+]
+
+# Frets that may be held with a chord: the chord itself and everything below
+ALLOWED_FRETS = [(1 << mask.bit_length()) - 1 for mask in range(1 << len(KEYS))]
 
 
 class Guitar:
@@ -56,8 +68,13 @@ class Guitar:
         self.lastBpmChange = -1.0
         self.baseBeat = 0.0
         self.setBPM(self.currentBpm)
-        self.vertexCache = numpy.empty((8 * 4096, 3), numpy.float32)
-        self.colorCache = numpy.empty((8 * 4096, 4), numpy.float32)
+        self.vertexCache = numpy.empty((4096, 3), numpy.float32)
+        self.waveSteps = numpy.arange(len(self.vertexCache) // 8, dtype=numpy.float64)
+        self.waveColors = {}
+        self.batchNotes = engine.config.get("opengl", "batchnotes")
+        self.boardKey = None
+        self.noteParts = None
+        self.cursor = None
 
         engine.resource.load(
             self, "noteMesh", lambda: Mesh(engine.resource.fileName("note.dae"))
@@ -87,16 +104,120 @@ class Guitar:
         self.bpm = bpm
         self.baseBeat = 0.0
 
-    def renderNeck(self, visibility, song, pos):
-        if not song:
-            return
+    def getCursor(self, song):
+        """@return: L{NoteCursor} over the notes of the song"""
+        if self.cursor is None or self.cursor.track is not song.track:
+            self.cursor = NoteCursor(song.track)
+        return self.cursor
 
-        def project(beat):
-            return 0.5 * beat / beatsPerUnit
+    def resetCursor(self):
+        """Forget the play cursor windows after the song position jumps."""
+        if self.cursor:
+            self.cursor.reset()
+
+    def getBoardGeometry(self, visibility):
+        """
+        Return the static geometry of the board for the given visibility.
+
+        The neck, strings and beat bars only depend on the board dimensions,
+        so their vertex buffers are rebuilt only when these change. During
+        fades the neck colors are updated in place and the strings and bars
+        are moved with the modelview matrix.
+
+        @return: (neck, strings, bars) L{VertexBuffer} objects
+        """
+        key = (
+            self.boardWidth,
+            self.boardLength,
+            self.beatsPerBoard,
+            self.strings,
+            self.editorMode,
+        )
+        if key != self.boardKey:
+            self.boardKey = key
+            self.neckBuffer = self.buildNeck()
+            self.stringBuffer = self.buildStrings()
+            self.barBuffer = self.buildBars()
+            self.boardVisibility = 1.0
+        if visibility != self.boardVisibility:
+            self.boardVisibility = visibility
+            self.neckBuffer.setColors(self.getNeckColors(visibility))
+        return self.neckBuffer, self.stringBuffer, self.barBuffer
+
+    def buildNeck(self):
+        """
+        Build the neck as a triangle strip faded out at both ends.
 
-        v = visibility
+        The texture coordinates are for a neck at beat zero; L{renderNeck}
+        scrolls them with the texture matrix.
+        """
         w = self.boardWidth
         l = self.boardLength
+        vertices = []
+        texcoords = []
+        for z in [-2, -1, l * 0.7, l]:
+            for x, s in [(-w / 2, 0.0), (w / 2, 1.0)]:
+                vertices.append((x, 0, z))
+                texcoords.append((s, 0.5 * z))
+        return VertexBuffer(vertices, texcoords, self.getNeckColors(1.0))
+
+    def getNeckColors(self, visibility):
+        """@return: the neck vertex colors for the given visibility"""
+        colors = numpy.ones((8, 4), numpy.float32)
+        colors[:, 3] = [0, 0, visibility, visibility, visibility, visibility, 0, 0]
+        return colors
+
+    def buildStrings(self):
+        """
+        Build the strings as quads on the board, from the last string to
+        the first.
+        """
+        w = self.boardWidth / self.strings
+        l = self.boardLength
+        sw = 0.035
+        vertices = []
+        texcoords = []
+        for n in range(self.strings - 1, -1, -1):
+            x = (n - self.strings / 2) * w
+            vertices += [
+                (x - sw, 0, -2),
+                (x + sw, 0, -2),
+                (x + sw, 0, l),
+                (x - sw, 0, l),
+            ]
+            texcoords += [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)]
+        return VertexBuffer(vertices, texcoords)
+
+    def buildBars(self):
+        """
+        Build quads for the beat bars, one every C{barStep} beats from z=0.
+
+        There are enough bars to cover the board from any scroll position;
+        the first one doubles as the bar at the current position.
+        """
+        w = self.boardWidth
+        sw = 0.04
+        beatsPerUnit = self.beatsPerBoard / self.boardLength
+        self.barStep = 1.0 / 4.0 if self.editorMode else 1.0
+        count = int((self.beatsPerBoard + 1) / self.barStep) + 2
+        vertices = []
+        texcoords = []
+        for i in range(count):
+            z = i * self.barStep / beatsPerUnit
+            vertices += [
+                (-w / 2, 0, z + sw),
+                (-w / 2, 0, z - sw),
+                (w / 2, 0, z - sw),
+                (w / 2, 0, z + sw),
+            ]
+            texcoords += [(0.0, 0.0), (0.0, 1.0), (1.0, 1.0), (1.0, 0.0)]
+        return VertexBuffer(vertices, texcoords)
+
+    def renderNeck(self, visibility, song, pos):
+        if not song:
+            return
+
+        neck, strings, bars = self.getBoardGeometry(visibility)
         beatsPerUnit = self.beatsPerBoard / self.boardLength
         offset = (pos - self.lastBpmChange) / self.currentPeriod + self.baseBeat
 
@@ -105,30 +226,14 @@ class Guitar:
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
 
-        glBegin(GL_TRIANGLE_STRIP)
-        glColor4f(1, 1, 1, 0)
-        glTexCoord2f(0.0, project(offset - 2 * beatsPerUnit))
-        glVertex3f(-w / 2, 0, -2)
-        glTexCoord2f(1.0, project(offset - 2 * beatsPerUnit))
-        glVertex3f(w / 2, 0, -2)
-
-        glColor4f(1, 1, 1, v)
-        glTexCoord2f(0.0, project(offset - 1 * beatsPerUnit))
-        glVertex3f(-w / 2, 0, -1)
-        glTexCoord2f(1.0, project(offset - 1 * beatsPerUnit))
-        glVertex3f(w / 2, 0, -1)
-
-        glTexCoord2f(0.0, project(offset + l * beatsPerUnit * 0.7))
-        glVertex3f(-w / 2, 0, l * 0.7)
-        glTexCoord2f(1.0, project(offset + l * beatsPerUnit * 0.7))
-        glVertex3f(w / 2, 0, l * 0.7)
-
-        glColor4f(1, 1, 1, 0)
-        glTexCoord2f(0.0, project(offset + l * beatsPerUnit))
-        glVertex3f(-w / 2, 0, l)
-        glTexCoord2f(1.0, project(offset + l * beatsPerUnit))
-        glVertex3f(w / 2, 0, l)
-        glEnd()
+        # The texture repeats, so only the fractional part of the scroll
+        # matters
+        glMatrixMode(GL_TEXTURE)
+        glPushMatrix()
+        glTranslatef(0, (0.5 * offset / beatsPerUnit) % 1.0, 0)
+        neck.render(GL_TRIANGLE_STRIP)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
 
         glDisable(GL_TEXTURE_2D)
 
@@ -151,90 +256,77 @@ class Guitar:
             glVertex3f(x + s, 0, z2)
             glEnd()
 
-        sw = 0.035
+        neck, strings, bars = self.getBoardGeometry(visibility)
+
         glEnable(GL_TEXTURE_2D)
         glEnable(GL_BLEND)
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
         Theme.setBaseColor(1 - v)
         self.stringDrawing.texture.bind()
-        for n in range(self.strings - 1, -1, -1):
-            glBegin(GL_TRIANGLE_STRIP)
-            glTexCoord2f(0.0, 0.0)
-            glVertex3f((n - self.strings / 2) * w - sw, -v, -2)
-            glTexCoord2f(1.0, 0.0)
-            glVertex3f((n - self.strings / 2) * w + sw, -v, -2)
-            glTexCoord2f(0.0, 1.0)
-            glVertex3f((n - self.strings / 2) * w - sw, -v, self.boardLength)
-            glTexCoord2f(1.0, 1.0)
-            glVertex3f((n - self.strings / 2) * w + sw, -v, self.boardLength)
-            glEnd()
-            v *= 2
+        strings.bind()
+        if v:
+            # While fading each string drops twice as low as the one before
+            for i in range(strings.count // 4):
+                glPushMatrix()
+                glTranslatef(0, -v * 2**i, 0)
+                strings.draw(GL_QUADS, 4 * i, 4)
+                glPopMatrix()
+        else:
+            strings.draw(GL_QUADS)
+        strings.unbind()
         glDisable(GL_TEXTURE_2D)
 
     def renderBars(self, visibility, song, pos):
         if not song:
             return
 
-        w = self.boardWidth
+        neck, strings, bars = self.getBoardGeometry(visibility)
         v = 1.0 - visibility
-        sw = 0.04
         beatsPerUnit = self.beatsPerBoard / self.boardLength
         pos -= self.lastBpmChange
-        offset = pos / self.currentPeriod * beatsPerUnit
         currentBeat = pos / self.currentPeriod
         beat = int(currentBeat)
 
+        # Bars from the current beat to the end of the board
+        beats = beat + numpy.arange(bars.count // 4) * self.barStep
+        beats = beats[beats < currentBeat + self.beatsPerBoard]
+        z = (beats - currentBeat) / beatsPerUnit
+        c = numpy.where(
+            z > self.boardLength * 0.8,
+            (self.boardLength - z) / (self.boardLength * 0.2),
+            numpy.where(z < 0, numpy.maximum(0, 1 + z), 1.0),
+        )
+        colors = numpy.empty((len(beats), 4), numpy.float32)
+        colors[:, :3] = Theme.baseColor[:3]
+        colors[:, 3] = visibility * c * numpy.where(beats % 1.0 < 0.001, 0.75, 0.5)
+        colors = numpy.repeat(colors, 4, axis=0)
+
         glEnable(GL_BLEND)
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
         glEnable(GL_TEXTURE_2D)
         self.barDrawing.texture.bind()
 
+        bars.bind()
+        glEnableClientState(GL_COLOR_ARRAY)
+        glColorPointer(4, GL_FLOAT, 0, colors)
         glPushMatrix()
-        while beat < currentBeat + self.beatsPerBoard:
-            z = (beat - currentBeat) / beatsPerUnit
-
-            if z > self.boardLength * 0.8:
-                c = (self.boardLength - z) / (self.boardLength * 0.2)
-            elif z < 0:
-                c = max(0, 1 + z)
-            else:
-                c = 1.0
-
-            glRotate(v * 90, 0, 0, 1)
-
-            if (beat % 1.0) < 0.001:
-                Theme.setBaseColor(visibility * c * 0.75)
-            else:
-                Theme.setBaseColor(visibility * c * 0.5)
-
-            glBegin(GL_TRIANGLE_STRIP)
-            glTexCoord2f(0.0, 0.0)
-            glVertex3f(-(w / 2), -v, z + sw)
-            glTexCoord2f(0.0, 1.0)
-            glVertex3f(-(w / 2), -v, z - sw)
-            glTexCoord2f(1.0, 0.0)
-            glVertex3f(w / 2, -v, z + sw)
-            glTexCoord2f(1.0, 1.0)
-            glVertex3f(w / 2, -v, z - sw)
-            glEnd()
-
-            if self.editorMode:
-                beat += 1.0 / 4.0
-            else:
-                beat += 1
+        glTranslatef(0, 0, (beat - currentBeat) / beatsPerUnit)
+        if v:
+            # While fading the bars fan out around the neck
+            for i in range(len(beats)):
+                glRotate(v * 90, 0, 0, 1)
+                glPushMatrix()
+                glTranslatef(0, -v, 0)
+                bars.draw(GL_QUADS, 4 * i, 4)
+                glPopMatrix()
+        else:
+            bars.draw(GL_QUADS, 0, 4 * len(beats))
         glPopMatrix()
+        glDisableClientState(GL_COLOR_ARRAY)
 
         Theme.setSelectedColor(visibility * 0.5)
-        glBegin(GL_TRIANGLE_STRIP)
-        glTexCoord2f(0.0, 0.0)
-        glVertex3f(-w / 2, 0, sw)
-        glTexCoord2f(0.0, 1.0)
-        glVertex3f(-w / 2, 0, -sw)
-        glTexCoord2f(1.0, 0.0)
-        glVertex3f(w / 2, 0, sw)
-        glTexCoord2f(1.0, 1.0)
-        glVertex3f(w / 2, 0, -sw)
-        glEnd()
+        bars.draw(GL_QUADS, 0, 4)
+        bars.unbind()
 
         glDisable(GL_TEXTURE_2D)
 
@@ -282,6 +374,183 @@ class Guitar:
         glPopMatrix()
         glEnable(GL_BLEND)
 
+    def getNoteParts(self):
+        """
+        Fetch the note mesh parts as triangle arrays for L{renderNoteBatch}.
+
+        @return: List of (vertices, normals, color factor, tappable only)
+                 tuples in drawing order, or None if the mesh isn't loaded
+        """
+        if self.noteParts is None and self.noteMesh:
+            try:
+                self.noteParts = [
+                    self.noteMesh.getTriangles(name) + (factor, tappableOnly)
+                    for name, factor, tappableOnly in [
+                        ("Mesh_001", 1.0, False),
+                        ("Mesh_003", 1.0, True),
+                        ("Mesh", 0.75, False),
+                        ("Mesh_002", 0.25, False),
+                    ]
+                ]
+            except Exception as e:
+                Log.warn("Unable to batch note meshes, drawing them one by one: %s" % e)
+                self.batchNotes = False
+        return self.noteParts
+
+    def renderTailBatch(self, offsets, lengths, colors):
+        """Draw textured note tails at the given offsets as one quad array."""
+        n = len(offsets)
+        quads = numpy.zeros((n, 4, 3), numpy.float32)
+        quads[:, (0, 3), 0] = -0.1
+        quads[:, (1, 2), 0] = 0.1
+        quads[:, (2, 3), 2] = (lengths + 0.00001)[:, None]
+        quads += offsets[:, None, :]
+        texcoords = numpy.tile(
+            numpy.array([(0, 0), (1, 0), (1, 1), (0, 1)], numpy.float32), (n, 1)
+        )
+
+        glEnable(GL_TEXTURE_2D)
+        self.noteDrawing.texture.bind()
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glTexCoordPointer(2, GL_FLOAT, 0, texcoords)
+        glVertexPointer(3, GL_FLOAT, 0, quads.reshape(-1, 3))
+        glColorPointer(4, GL_FLOAT, 0, numpy.repeat(colors, 4, axis=0))
+        glDrawArrays(GL_QUADS, 0, 4 * n)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisable(GL_TEXTURE_2D)
+
+    def renderNoteBatch(self, visibility, song, pos, startTime, endTime):
+        """
+        Draw the visible notes with vertex arrays.
+
+        Gives the same picture as calling L{renderNote} for each note, but
+        the note parameters are computed over the track columns. Notes go out
+        in the same order: each run of notes without fading gems is drawn as
+        one tail batch followed by one gem batch per mesh part, which looks the
+        same because a tail never lies in front of an earlier gem. Fading gems
+        are blended, so their notes are drawn one at a time.
+        """
+        track = song.track
+        indices = self.getCursor(song).getEventRange(startTime, endTime)
+        indices = indices[(track.flags[indices] & EVENT_NOTE) != 0]
+        if not len(indices):
+            return
+
+        beatsPerUnit = self.beatsPerBoard / self.boardLength
+        w = self.boardWidth / self.strings
+        n = len(indices)
+        events = [track.allEvents[i][1] for i in indices]
+        played = numpy.fromiter((e.played for e in events), bool, n)
+        tappable = numpy.fromiter((e.tappable for e in events), bool, n)
+        numbers = track.numbers[indices].astype(numpy.intp)
+        times = track.times[indices]
+        lengths = track.lengths[indices]
+
+        x = (self.strings / 2 - numbers) * w
+        z = ((times - pos) / self.currentPeriod) / beatsPerUnit
+        z2 = ((times + lengths - pos) / self.currentPeriod) / beatsPerUnit
+        f = numpy.where(
+            z > self.boardLength * 0.8,
+            (self.boardLength - z) / (self.boardLength * 0.2),
+            numpy.where(z < 0, numpy.clip(1 + z2, 0, 1), 1.0),
+        )
+        length = lengths / self.currentPeriod / beatsPerUnit
+
+        # Clip the played notes to the origin
+        tailOnly = (z < 0) & played
+        flat = (z < 0) & ~played
+        length[tailOnly] += z[tailOnly]
+        z[tailOnly] = 0
+        keep = ~tailOnly | (length > 0)
+
+        fretColors = numpy.array([c[:3] for c in self.fretColors], numpy.float64)
+        colors = numpy.empty((n, 4), numpy.float32)
+        colors[:, :3] = 0.1 + 0.8 * fretColors[numbers]
+        colors[:, 3] = visibility * f
+        colors[flat, :3] = 0.2 + 0.4
+        colors[flat, 3] *= 0.5
+
+        offsets = numpy.empty((n, 3), numpy.float32)
+        offsets[:, 0] = x
+        offsets[:, 1] = (1.0 - visibility) ** (numbers + 1)
+        offsets[:, 2] = z
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+
+        # renderNote() leaves depth testing on after the first gem, so the
+        # tails drawn before that are the only ones that aren't depth tested
+        depthTest = glIsEnabled(GL_DEPTH_TEST)
+        gems = ~tailOnly
+        fading = gems & (colors[:, 3] <= 0.9)
+        start = 0
+        for end in list(numpy.flatnonzero(fading)) + [n]:
+            for run in (numpy.arange(start, end), numpy.arange(end, min(end + 1, n))):
+                if not len(run):
+                    continue
+                tails = run[keep[run]]
+                withGems = run[gems[run]]
+                if len(withGems) and not depthTest:
+                    first = tails[tails <= withGems[0]]
+                    if len(first):
+                        self.renderTailBatch(offsets[first], length[first], colors[first])
+                    tails = tails[tails > withGems[0]]
+                    glEnable(GL_DEPTH_TEST)
+                    depthTest = True
+                if len(tails):
+                    self.renderTailBatch(offsets[tails], length[tails], colors[tails])
+                if len(withGems):
+                    self.renderGemBatch(
+                        offsets[withGems],
+                        colors[withGems],
+                        tappable[withGems],
+                        opaque=not fading[withGems[0]],
+                        flat=bool(flat[withGems[0]]),
+                    )
+            start = end + 1
+
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_COLOR_ARRAY)
+
+    def renderGemBatch(self, offsets, colors, tappable, opaque, flat):
+        """
+        Draw note gems at the given offsets, one glDrawArrays call per mesh
+        part, lit and blended as L{renderNote} does.
+        """
+        scale = numpy.array([1.0, 0.1 if flat else 1.0, 1.0], numpy.float32)
+
+        glEnable(GL_DEPTH_TEST)
+        glDepthMask(1)
+        if opaque:
+            glDisable(GL_BLEND)
+        glShadeModel(GL_SMOOTH)
+        glEnableClientState(GL_NORMAL_ARRAY)
+
+        # The mesh sets up its lights under the note transform, and the
+        # flattening of passed notes tilts their direction as well
+        glPushMatrix()
+        glScalef(*scale)
+        self.noteMesh.setupLights()
+        glPopMatrix()
+
+        for vertices, normals, factor, tappableOnly in self.noteParts:
+            g = numpy.flatnonzero(tappable) if tappableOnly else numpy.arange(len(offsets))
+            if not len(g) or not len(vertices):
+                continue
+            v = vertices[None, :, :] * scale + offsets[g, None, :]
+            nv = numpy.broadcast_to(normals / scale, (len(g),) + normals.shape)
+            c = colors[g].copy()
+            c[:, :3] *= factor
+            glVertexPointer(3, GL_FLOAT, 0, v.reshape(-1, 3))
+            glNormalPointer(GL_FLOAT, 0, numpy.ascontiguousarray(nv).reshape(-1, 3))
+            glColorPointer(4, GL_FLOAT, 0, numpy.repeat(c, len(vertices), axis=0))
+            glDrawArrays(GL_TRIANGLES, 0, len(g) * len(vertices))
+
+        self.noteMesh.resetLights()
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDepthMask(0)
+        glEnable(GL_BLEND)
+
     def renderNotes(self, visibility, song, pos):
         if not song:
             return
@@ -290,22 +559,34 @@ class Guitar:
         self.currentPeriod = 60000.0 / self.currentBpm
         self.targetPeriod = 60000.0 / self.targetBpm
 
-        beatsPerUnit = self.beatsPerBoard / self.boardLength
-        w = self.boardWidth / self.strings
         track = song.track
 
-        for time, event in track.getEvents(
-            pos - self.currentPeriod * 2, pos + self.currentPeriod * self.beatsPerBoard
-        ):
-            if isinstance(event, Tempo):
-                if (
-                    pos - time > self.currentPeriod or self.lastBpmChange < 0
-                ) and time > self.lastBpmChange:
-                    self.baseBeat += (time - self.lastBpmChange) / self.currentPeriod
-                    self.targetBpm = event.bpm
-                    self.lastBpmChange = time
-                continue
+        startTime = pos - self.currentPeriod * 2
+        endTime = pos + self.currentPeriod * self.beatsPerBoard
+
+        for time, bpm in song.tempoMap.getChanges(startTime, endTime):
+            if (
+                pos - time > self.currentPeriod or self.lastBpmChange < 0
+            ) and time > self.lastBpmChange:
+                self.baseBeat += (time - self.lastBpmChange) / self.currentPeriod
+                self.targetBpm = bpm
+                self.lastBpmChange = time
+
+        if self.batchNotes and self.getNoteParts():
+            self.renderNoteBatch(visibility, song, pos, startTime, endTime)
+        else:
+            self.renderNoteList(visibility, song, pos, startTime, endTime)
+
+        self.renderWaveForms(pos)
 
+    def renderNoteList(self, visibility, song, pos, startTime, endTime):
+        """Draw the visible notes one by one with L{renderNote}."""
+        beatsPerUnit = self.beatsPerBoard / self.boardLength
+        w = self.boardWidth / self.strings
+        allEvents = song.track.allEvents
+
+        for i in self.getCursor(song).getEventRange(startTime, endTime):
+            time, event = allEvents[i]
             if not isinstance(event, Note):
                 continue
 
@@ -352,20 +633,35 @@ class Guitar:
             )
             glPopMatrix()
 
-        # Draw a waveform shape over the currently playing notes
-        vertices = self.vertexCache
-        colors = self.colorCache
+    def getWaveColors(self, number):
+        """
+        @return: Colors for a waveform of the given fret, filled on first use
+                 for the longest strip L{renderWaveForms} draws
+        """
+        colors = self.waveColors.get(number)
+        if colors is None:
+            c = self.fretColors[number]
+            colors = numpy.empty((len(self.vertexCache) // 8, 8, 4), numpy.float32)
+            colors[:] = (c[0], c[1], c[2], 0.5)
+            colors[:, 2:4] = (1, 1, 1, 0.75)
+            colors = self.waveColors[number] = colors.reshape(-1, 4)
+        return colors
+
+    def renderWaveForms(self, pos):
+        """Draw a waveform shape over the currently playing notes."""
+        beatsPerUnit = self.beatsPerBoard / self.boardLength
+        w = self.boardWidth / self.strings
+        proj = 1.0 / self.currentPeriod / beatsPerUnit
+        steps = self.waveSteps
 
         glBlendFunc(GL_SRC_ALPHA, GL_ONE)
         glEnableClientState(GL_VERTEX_ARRAY)
         glEnableClientState(GL_COLOR_ARRAY)
-        glVertexPointer(3, GL_FLOAT, 0, vertices)
-        glColorPointer(4, GL_FLOAT, 0, colors)
+        glVertexPointer(3, GL_FLOAT, 0, self.vertexCache)
 
         for time, event in self.playedNotes:
-            t = time + event.length
-            dt = t - pos
-            proj = 1.0 / self.currentPeriod / beatsPerUnit
+            s = time + event.length
+            dt = s - pos
 
             # Increase these values to improve performance
             step1 = dt * proj * 25
@@ -374,58 +670,57 @@ class Guitar:
             if dt < 1e-3:
                 continue
 
+            # The strip runs back from the end of the note with the step
+            # growing linearly from step1 to step2 along the way, so the
+            # distance covered after k steps is a geometric series.
             dStep = (step2 - step1) / dt
-            x = (self.strings / 2 - event.number) * w
-            c = self.fretColors[event.number]
-            s = t
-            step = step1
-
-            vertexCount = 0
-
-            def waveForm(t):
-                u = ((t - time) * -0.1 + pos - time) / 64.0 + 0.0001
-                return (
-                    (
-                        math.sin(event.number + self.time * -0.01 + t * 0.03)
-                        + math.cos(event.number + self.time * 0.01 + t * 0.02)
-                    )
-                    * 0.1
-                    + 0.1
-                    + math.sin(u) / (5 * u)
-                )
-
-            i = 0
-            a1 = 0.0
+            d = numpy.empty(len(steps) + 1)
+            d[0] = 0.0
+            with numpy.errstate(over="ignore", invalid="ignore"):
+                # Very short tails overflow past the end; those steps fail the
+                # checks below
+                numpy.cumsum((1.0 + dStep) ** steps, out=d[1:])
+                d *= step1
+                t = s - d[:-1]
+                step = step1 + dStep * d[:-1]
+                valid = (t > time) & (t - step > pos)
+            n = len(valid) if valid.all() else int(numpy.argmin(valid))
+            if not n:
+                continue
+            t = t[:n]
+            step = step[:n]
+            z = (t - pos) * proj
             zStep = step * proj
 
-            while t > time and t - step > pos and i < len(vertices) / 8:
-                z = (t - pos) * proj
-                a2 = waveForm(t - step)
-
-                colors[i] = colors[i + 1] = (c[0], c[1], c[2], 0.5)
-                colors[i + 2] = colors[i + 3] = (1, 1, 1, 0.75)
-                colors[i + 4] = colors[i + 5] = colors[i + 6] = colors[i + 7] = (
-                    c[0],
-                    c[1],
-                    c[2],
-                    0.5,
+            # waveForm(t - step) of the old per-segment loop
+            t2 = t - step
+            u = ((t2 - time) * -0.1 + pos - time) / 64.0 + 0.0001
+            a2 = (
+                (
+                    numpy.sin(event.number + self.time * -0.01 + t2 * 0.03)
+                    + numpy.cos(event.number + self.time * 0.01 + t2 * 0.02)
                 )
-                vertices[i] = (x - a1, 0, z)
-                vertices[i + 1] = (x - a2, 0, z - zStep)
-                vertices[i + 2] = (x, 0, z)
-                vertices[i + 3] = (x, 0, z - zStep)
-                vertices[i + 4] = (x + a1, 0, z)
-                vertices[i + 5] = (x + a2, 0, z - zStep)
-                vertices[i + 6] = (x + a2, 0, z - zStep)
-                vertices[i + 7] = (x - a2, 0, z - zStep)
-
-                i += 8
-                t -= step
-                a1 = a2
-                step = step1 + dStep * (s - t)
-                zStep = step * proj
-
-            glDrawArrays(GL_TRIANGLE_STRIP, 0, i)
+                * 0.1
+                + 0.1
+                + numpy.sin(u) / (5 * u)
+            )
+            a1 = numpy.empty(n)
+            a1[0] = 0.0
+            a1[1:] = a2[:-1]
+
+            x = (self.strings / 2 - event.number) * w
+            vertices = self.vertexCache[: 8 * n].reshape(n, 8, 3)
+            vertices[:, :, 0] = x
+            vertices[:, 0, 0] -= a1
+            vertices[:, (1, 7), 0] -= a2[:, None]
+            vertices[:, 4, 0] += a1
+            vertices[:, (5, 6), 0] += a2[:, None]
+            vertices[:, :, 1] = 0
+            vertices[:, (0, 2, 4), 2] = z[:, None]
+            vertices[:, (1, 3, 5, 6, 7), 2] = (z - zStep)[:, None]
+
+            glColorPointer(4, GL_FLOAT, 0, self.getWaveColors(event.number))
+            glDrawArrays(GL_TRIANGLE_STRIP, 0, 8 * n)
         glDisableClientState(GL_VERTEX_ARRAY)
         glDisableClientState(GL_COLOR_ARRAY)
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
@@ -540,42 +835,51 @@ class Guitar:
 
         m1 = self.lateMargin
         m2 = self.lateMargin * 2
-        track = song.track
-        notes = [
-            (time, event)
-            for time, event in track.getEvents(pos - m1, pos - m2)
-            if isinstance(event, Note)
-        ]
-        notes = [
-            (time, event)
-            for time, event in notes
-            if (time >= (pos - m2)) and (time <= (pos - m1))
-        ]
-        notes = [(time, event) for time, event in notes if not event.played]
-
-        return notes
+        cursor = self.getCursor(song)
+        chords, lo, hi = cursor.getNoteRange("missed", pos - m2, pos - m1)
+        return [(time, event) for time, event in chords.notes[lo:hi] if not event.played]
 
     def getRequiredNotes(self, song, pos):
-        track = song.track
-        notes = [
-            (time, event)
-            for time, event in track.getEvents(
-                pos - self.lateMargin, pos + self.earlyMargin
-            )
-            if isinstance(event, Note)
-        ]
-        notes = [(time, event) for time, event in notes if not event.played]
-        notes = [
-            (time, event)
-            for time, event in notes
-            if (time >= (pos - self.lateMargin)) and (time <= (pos + self.earlyMargin))
-        ]
+        chords, lo, hi = self.getCursor(song).getNoteRange(
+            "required", pos - self.lateMargin, pos + self.earlyMargin
+        )
+        notes = [(time, event) for time, event in chords.notes[lo:hi] if not event.played]
         if notes:
-            t = min([time for time, event in notes])
+            t = notes[0][0]
             notes = [(time, event) for time, event in notes if time - t < 1e-3]
         return notes
 
     def controlsMatchNotes(self, controls, notes):
+        """
+        Check whether the held frets match the given notes.
+
+        Each chord has to be held exactly, except that frets below its
+        highest note may be held down as well.
+
+        @param controls:  L{Player.Controls} or anything with a C{flags} field
+                          or C{getState()} method
+        @param notes:     List of (time, L{Note}) tuples
+        @return:          True if every chord matches
+        """
+        if not notes:
+            return False
+
+        flags = getattr(controls, "flags", None)
+        if flags is None:
+            return self.controlsMatchNotesLegacy(controls, notes)
+        held = FRET_MASKS[flags & KEY_MASK]
+
+        chords = {}
+        for time, note in notes:
+            chords[time] = chords.get(time, 0) | note.mask
+
+        for chord in chords.values():
+            if held & chord != chord or held & ~ALLOWED_FRETS[chord]:
+                return False
+        return True
+
+    def controlsMatchNotesLegacy(self, controls, notes):
+        """Key by key version of L{controlsMatchNotes}."""
         result = True
 
         # no notes?
@@ -14,7 +14,7 @@
 from Scene import SceneServer, SceneClient
 from Song import Note, TextEvent, PictureEvent, loadSong
 from Menu import Menu
-from Guitar import Guitar, KEYS
+from Guitar import Guitar, KEYS, KEY_MASK, FRET_MASKS
 from Language import _
 import Player
 import Dialogs
@@ -24,8 +24,12 @@ import View
 import Audio
 import Stage
 import Settings
+import Replay
+import Resource
+import Trace
 
 import math
+import time
 import pygame
 import random
 import os
@@ -33,6 +37,14 @@ import Log
 from OpenGL.GL import *
 
 
+def noteMask(notes):
+    """@return: Fret bitmask of a list of (time, L{Note}) tuples"""
+    mask = 0
+    for time, note in notes:
+        mask |= note.mask
+    return mask
+
+
 class GuitarScene:
     pass
 
@@ -43,31 +55,15 @@ class GuitarSceneServer(GuitarScene, SceneServer):
 
 class GuitarSceneClient(GuitarScene, SceneClient):
     def createClient(self, libraryName, songName):
-        self.songStarted = False
-        self.paused = False
         self.guitar = Guitar(self.engine)
         self.visibility = 0.0
         self.libraryName = libraryName
         self.songName = songName
-        self.done = False
         self.sfxChannel = self.engine.audio.getChannel(
             self.engine.audio.getChannelCount() - 1
         )
-        self.lastMultTime = None
-        self.cheatCodes = [
-            (
-                [117, 112, 116, 111, 109, 121, 116, 101, 109, 112, 111],
-                self.toggleAutoPlay,
-            ),
-            ([102, 97, 115, 116, 102, 111, 114, 119, 97, 114, 100], self.goToResults),
-        ]
-        self.enteredCode = []
         self.song = None
-        self.autoPlay = False
-        self.lastPickPos = None
-        self.lastSongPos = 0.0
-        self.keyBurstTimeout = None
-        self.keyBurstPeriod = 30
+        self.createGameState()
         self.camera.target = (0, 0, 4)
         self.camera.origin = (0, 3, -3)
 
@@ -136,6 +132,32 @@ class GuitarSceneClient(GuitarScene, SceneClient):
         Log.warn("=" * 60)
         # ========================================================================
 
+    def createGameState(self):
+        """Set up the play and judgement state that doesn't need a display."""
+        self.songStarted = False
+        self.paused = False
+        self.done = False
+        self.lastMultTime = None
+        self.cheatCodes = [
+            (
+                [117, 112, 116, 111, 109, 121, 116, 101, 109, 112, 111],
+                self.toggleAutoPlay,
+            ),
+            ([102, 97, 115, 116, 102, 111, 114, 119, 97, 114, 100], self.goToResults),
+        ]
+        self.enteredCode = []
+        self.autoPlay = False
+        self.lastPickPos = None
+        self.lastSongPos = 0.0
+        self.keyBurstTimeout = None
+        self.keyBurstPeriod = 30
+        self.simulationPos = None
+        self.maxSimulationLag = 250.0
+        self.lastMissTime = float("-inf")
+        self._controls_snapshot = None
+        self.countdown = 0.0
+        self.replay = Replay.Replay()
+
     # --------------------
     # Pause / Resume
     # --------------------
@@ -171,6 +193,7 @@ class GuitarSceneClient(GuitarScene, SceneClient):
     def loadSettings(self):
         self.delay = self.engine.config.get("audio", "delay")
         self.screwUpVolume = self.engine.config.get("audio", "screwupvol")
+        self.simulationStep = 1000.0 / max(1, self.engine.config.get("game", "simrate"))
         self.guitarVolume = self.engine.config.get("audio", "guitarvol")
         self.songVolume = self.engine.config.get("audio", "songvol")
         self.rhythmVolume = self.engine.config.get("audio", "rhythmvol")
@@ -224,7 +247,11 @@ class GuitarSceneClient(GuitarScene, SceneClient):
             return
 
         self.countdown = 8.0
+        self.simulationPos = None
+        self.lastMissTime = float("-inf")
         self.guitar.endPick(0)
+        self.guitar.resetCursor()
+        self.replay = Replay.Replay()
         self.song.stop()
 
     # --------------------
@@ -253,24 +280,6 @@ class GuitarSceneClient(GuitarScene, SceneClient):
                 self.goToResults()
                 return
 
-            if self.autoPlay:
-                notes = self.guitar.getRequiredNotes(self.song, pos)
-                notes = [note.number for time, note in notes]
-
-                changed = False
-                held = 0
-                for n, k in enumerate(KEYS):
-                    if n in notes and not self.controls.getState(k):
-                        changed = True
-                        self.controls.toggle(k, True)
-                    elif n not in notes and self.controls.getState(k):
-                        changed = True
-                        self.controls.toggle(k, False)
-                    if self.controls.getState(k):
-                        held += 1
-                if changed and held:
-                    self.doPick()
-
             self.song.update(ticks)
             if self.countdown > 0:
                 self.guitar.setBPM(self.song.bpm)
@@ -284,147 +293,129 @@ class GuitarSceneClient(GuitarScene, SceneClient):
                         self.song.play()
                         self.songStarted = True
 
-        # update board
+        self.runGuitar(ticks, pos)
+
+    def runGuitar(self, ticks, pos):
+        """Update the board and judge the notes up to the given position."""
+        self.replay.addFrame(pos)
         if not self.guitar.run(ticks, pos, self.controls):
             # done playing the current notes
-            self.endPick()
-
-        # missed some notes?
+            self.endPick(pos)
+
+        self.simulate(pos)
+
+    def simulate(self, pos):
+        """
+        Run the note judgement up to the given song position.
+
+        Judgement runs in fixed steps of C{simulationStep} milliseconds of
+        song time, so that its accuracy doesn't depend on the frame rate.
+        Steps that fell behind by more than C{maxSimulationLag} (e.g. after a
+        restart or a long stall) are skipped. A position before the last
+        judged step, such as that of an input event that arrived after the
+        frame had been simulated, doesn't rewind the judgement.
+
+        @param pos:  Song position in milliseconds
+        @return:     The position to judge an event at, i.e. C{pos} clamped
+                     to the last judged step
+        """
+        step = self.simulationStep
         if (
-            self.song
-            and self.guitar.getMissedNotes(self.song, pos)
-            and not self.guitar.playedNotes
+            self.simulationPos is None
+            or pos < self.simulationPos - self.maxSimulationLag
+            or pos - self.simulationPos > self.maxSimulationLag
         ):
-            try:
-                # --- SANITY: dump no momento do miss ---
-                required = self.guitar.getRequiredNotes(self.song, pos)
-                required_nums = [note.number for time, note in required]
-                required_times = [float(time) for time, note in required]
-                last_strum = getattr(self, "_last_strum", None)
-
-                # KEYS = lista dos frets do gameplay
-                held_keys = []
-                pressed_frets = []
-                for n, k in enumerate(KEYS):
-                    if self.controls.getState(k):
-                        held_keys.append((n, k))
-                        pressed_frets.append(n)
-
-                lowest = min(pressed_frets) if pressed_frets else None
-                highest = max(pressed_frets) if pressed_frets else None
-
-                # --- detectar "strum/pick" (ajuste aqui conforme teu projeto) ---
-                # Tenta algumas convenções comuns sem quebrar se não existir.
-                strum_states = {}
-                for name in ("PICK", "STRUM_UP", "STRUM_DOWN", "ACTION1", "ACTION2"):
-                    key = globals().get(name, None)
-                    if key is not None:
-                        try:
-                            strum_states[name] = bool(self.controls.getState(key))
-                        except Exception:
-                            strum_states[name] = "ERR"
-                    else:
-                        strum_states[name] = None
+            self.simulationPos = pos - step
 
-                # --- nota mais próxima (mesmo quando req=[]) ---
-                # Heurística: varre um pequeno range ao redor e pega o evento mais próximo.
-                nearest = None  # (dt, note_num, note_time)
-                try:
-                    window = 200.0  # ms (ajustável)
-                    # varremos em passos pequenos para não depender de internals
-                    # (se você tiver um método "getNotesInRange", melhor ainda)
-                    candidates = []
-                    for t in (
-                        pos - window,
-                        pos - 100.0,
-                        pos - 50.0,
-                        pos,
-                        pos + 50.0,
-                        pos + 100.0,
-                        pos + window,
-                    ):
-                        cand = self.guitar.getRequiredNotes(self.song, t)
-                        for note_time, note in cand:
-                            candidates.append((float(note_time), int(note.number)))
-
-                    # remove duplicatas
-                    uniq = {}
-                    for nt, nn in candidates:
-                        uniq[(nt, nn)] = True
-
-                    for nt, nn in uniq.keys():
-                        dt = float(pos) - float(nt)
-                        if (nearest is None) or (abs(dt) < abs(nearest[0])):
-                            nearest = (dt, nn, nt)
-                except Exception:
-                    nearest = "ERR"
-
-                # --- Debug key snapshot: F1/F3 + frets ---
-                debug_keycodes = [pygame.K_F1, pygame.K_F3, pygame.K_RETURN]
-                for _, k in held_keys:
-                    if isinstance(k, int) and k < 0x10000:
-                        debug_keycodes.append(k)
-                debug_keycodes = sorted(set(debug_keycodes))
-
-                snap = None
-                if hasattr(self.engine, "input") and hasattr(
-                    self.engine.input, "getKeyDebugSnapshot"
-                ):
-                    snap = self.engine.input.getKeyDebugSnapshot(debug_keycodes)
+        while self.simulationPos + step <= pos:
+            self.simulationPos += step
+            self.runSimulationStep(self.simulationPos)
+        return max(pos, self.simulationPos)
 
-                # Render amigável dos frets
-                held_pretty = []
-                if hasattr(self.engine, "input"):
-                    for n, k in held_keys:
-                        try:
-                            held_pretty.append((n, self.engine.input.getKeyName(k)))
-                        except Exception:
-                            held_pretty.append((n, k))
-                else:
-                    held_pretty = held_keys
-
-                recent_tail = None
-                if snap and isinstance(snap, dict) and snap.get("recent"):
-                    try:
-                        recent_tail = snap["recent"][-14:]
-                    except Exception:
-                        recent_tail = snap.get("recent")
-
-                Log.warn(
-                    "[SANITY][MISS] pos=%.3f req=%s req_t=%s pressed=%s lowest=%s highest=%s strum=%s mods=%s keys=%s recent_tail=%s nearest=%s"
-                    % (
-                        float(pos),
-                        required_nums,
-                        required_times,
-                        pressed_frets,
-                        lowest,
-                        highest,
-                        strum_states,
-                        snap.get("mods") if snap else None,
-                        (snap.get("keys") if snap else None),
-                        recent_tail,
-                        nearest,
-                    )
-                )
-            except Exception as e:
-                Log.warn("[SANITY][MISS] debug failed: %s" % e)
+    def runSimulationStep(self, pos):
+        """Judge autoplay picks, missed notes and late picks at C{pos}."""
+        if not self.song:
+            return
+
+        if self.autoPlay:
+            notes = self.guitar.getRequiredNotes(self.song, pos)
+            wanted = 0
+            for time, note in notes:
+                wanted |= KEYS[note.number]
+
+            if self.controls.flags & KEY_MASK != wanted:
+                self.controls.toggle(KEY_MASK & ~wanted, False)
+                self.controls.toggle(wanted, True)
+                if wanted:
+                    self.doPick(pos)
+
+        # missed some notes?
+        missedNotes = self.guitar.getMissedNotes(self.song, pos)
+        if missedNotes and not self.guitar.playedNotes:
+            # The miss holds for as long as the notes stay in the window;
+            # only log it once
+            if missedNotes[-1][0] > self.lastMissTime:
+                self.lastMissTime = missedNotes[-1][0]
+                if Trace.enabled:
+                    self.traceMiss(pos)
 
             self.song.setGuitarVolume(0.0)
             self.player.streak = 0
 
         # late pick
-        if (
-            self.keyBurstTimeout is not None
-            and self.engine.timer.time > self.keyBurstTimeout
-        ):
+        if self.keyBurstTimeout is not None and pos > self.keyBurstTimeout:
             self.keyBurstTimeout = None
             notes = self.guitar.getRequiredNotes(self.song, pos)
             if self.guitar.controlsMatchNotes(self.controls, notes):
-                self.doPick()
+                self.doPick(pos)
+
+    def getNearestChord(self, pos):
+        """@return: (time, fret bitmask) of the chord closest to C{pos}"""
+        chords = self.song.track.getChordTable()
+        chord = chords.getNearestChord(pos)
+        if chord is None:
+            return Trace.NAN, 0
+        return float(chords.times[chord]), noteMask(chords.getNotes(chord))
+
+    def traceMiss(self, pos):
+        """Trace the required notes and the held frets at a miss."""
+        required = self.guitar.getRequiredNotes(self.song, pos)
+        nearestTime, nearestMask = self.getNearestChord(pos)
+        flags = self.controls.flags
+        Trace.trace(
+            Trace.MISS,
+            pos,
+            required[0][0] if required else Trace.NAN,
+            nearestTime,
+            noteMask(required),
+            FRET_MASKS[flags & KEY_MASK],
+            flags,
+            nearestMask,
+        )
+
+    def tracePick(self, pos, controls, hit):
+        """Trace the notes a pick was judged against and the frets it used."""
+        if hit:
+            notes = self.guitar.playedNotes
+        else:
+            notes = self.guitar.getRequiredNotes(self.song, pos)
+        nearestTime, nearestMask = self.getNearestChord(pos)
+        Trace.trace(
+            Trace.PICK,
+            pos,
+            notes[0][0] if notes else Trace.NAN,
+            nearestTime,
+            noteMask(notes),
+            FRET_MASKS[controls.flags & KEY_MASK],
+            hit,
+            self.player.streak,
+        )
 
-    def endPick(self):
-        score = self.getExtraScoreForCurrentlyPlayedNotes()
-        if not self.guitar.endPick(self.song.getPosition()):
+    def endPick(self, pos=None):
+        if pos is None:
+            pos = self.getSongPosition()
+        score = self.getExtraScoreForCurrentlyPlayedNotes(pos)
+        if not self.guitar.endPick(pos):
             self.song.setGuitarVolume(0.0)
         self.player.addScore(score)
 
@@ -454,41 +445,12 @@ class GuitarSceneClient(GuitarScene, SceneClient):
                 )
         return 0.0
 
-    def doPick(self):
+    def doPick(self, pos=None):
         if not self.song:
             return
 
-        pos = self.getSongPosition()
-
-        # ====================================================================
-        # 🔍 DIAGNÓSTICO DE TIMING
-        # ====================================================================
-        import Log
-
-        notes = self.guitar.getRequiredNotes(self.song, pos)
-
-        if notes:
-            note_times = [time for time, event in notes]
-            note_numbers = [event.number for time, event in notes]
-            Log.warn(
-                f"[TIMING] pos={pos:.3f} | notas={note_numbers} em times={note_times}"
-            )
-        else:
-            # Buscar nota mais próxima
-            track = self.song.track
-            all_notes = [
-                (time, event)
-                for time, event in track.getEvents(pos - 1000, pos + 1000)
-                if isinstance(event, Note)
-            ]
-
-            if all_notes:
-                closest = min(all_notes, key=lambda x: abs(x[0] - pos))
-                diff = pos - closest[0]
-                Log.error(
-                    f"[TIMING] MISS! pos={pos:.3f} | nota_proxima={closest[1].number} em {closest[0]:.3f} | diff={diff:.3f}ms | lateMargin={self.guitar.lateMargin:.3f} earlyMargin={self.guitar.earlyMargin:.3f}"
-                )
-        # ====================================================================
+        if pos is None:
+            pos = self.getSongPosition()
 
         if self.guitar.playedNotes:
             if (
@@ -498,15 +460,13 @@ class GuitarSceneClient(GuitarScene, SceneClient):
                 and pos - self.lastPickPos <= self.song.period / 2
             ):
                 return
-            self.endPick()
+            self.endPick(pos)
 
         self.lastPickPos = pos
 
         # ====================================================================
         # ✅ CORREÇÃO: Implementação SIMPLIFICADA do snapshot
         # ====================================================================
-        import Log
-
         # Usar snapshot se disponível, caso contrário usar controls diretamente
         use_snapshot = (
             hasattr(self, "_controls_snapshot") and self._controls_snapshot is not None
@@ -517,21 +477,22 @@ class GuitarSceneClient(GuitarScene, SceneClient):
             class SnapshotControls:
                 def __init__(self, snapshot):
                     self._snapshot = snapshot
+                    self.flags = 0
+                    for key, state in snapshot.items():
+                        if state:
+                            self.flags |= key
 
                 def getState(self, key):
                     return self._snapshot.get(key, False)
 
             controls_to_use = SnapshotControls(self._controls_snapshot)
-            Log.debug(
-                f"[DOPICK] Usando SNAPSHOT: {[n for n in range(5) if self._controls_snapshot.get(KEYS[n])]}"
-            )
         else:
             controls_to_use = self.controls
-            Log.debug(f"[DOPICK] Usando controles DIRETOS")
 
         # ====================================================================
 
-        if self.guitar.startPick(self.song, pos, controls_to_use):
+        hit = self.guitar.startPick(self.song, pos, controls_to_use)
+        if hit:
             # Limpar snapshot APÓS uso bem-sucedido
             if use_snapshot:
                 self._controls_snapshot = None
@@ -554,8 +515,39 @@ class GuitarSceneClient(GuitarScene, SceneClient):
             self.sfxChannel.play(self.engine.data.screwUpSound)
             self.sfxChannel.setVolume(self.screwUpVolume)
 
+        if Trace.enabled:
+            self.tracePick(pos, controls_to_use, hit)
+
+    def saveReplay(self):
+        """Write the replay of the finished play into the replays directory."""
+        if not self.engine.config.get("game", "replays") or not len(self.replay):
+            return
+
+        replay = self.replay
+        replay.difficulty = self.song.difficulty.id
+        replay.simulationStep = self.simulationStep
+        replay.tapping = self.engine.config.get("game", "tapping")
+        try:
+            replay.songHash = self.song.getHash()
+            path = os.path.join(Resource.getWritableResourcePath(), "replays")
+            os.makedirs(path, exist_ok=True)
+            fileName = "%s-%d-%s.replay" % (
+                self.songName,
+                replay.difficulty,
+                time.strftime("%Y%m%d-%H%M%S"),
+            )
+            replay.save(os.path.join(path, fileName))
+        except Exception as e:
+            Log.warn("Unable to save replay: %s" % e)
+
+    def setAutoPlay(self, enabled):
+        """Turn autoplay on or off, logging the change in the replay."""
+        if enabled != self.autoPlay and self.song:
+            self.replay.addAutoPlay(self.getSongPosition(), enabled)
+        self.autoPlay = enabled
+
     def toggleAutoPlay(self):
-        self.autoPlay = not self.autoPlay
+        self.setAutoPlay(not self.autoPlay)
         if self.autoPlay:
             Dialogs.showMessage(self.engine, _("Jurgen will show you how it is done."))
         else:
@@ -564,6 +556,7 @@ class GuitarSceneClient(GuitarScene, SceneClient):
 
     def goToResults(self):
         if self.song:
+            self.saveReplay()
             self.song.stop()
             self.song = None
             self.done = True
@@ -592,27 +585,20 @@ class GuitarSceneClient(GuitarScene, SceneClient):
         self.pauseGame()
         self.engine.view.pushLayer(self.menu)
 
-    def keyPressed(self, key, unicode=""):
-        # ========================================================================
-        # 🔍 DEBUG (remover depois)
-        # ========================================================================
-        import Log
-
-        key_name = pygame.key.name(key) if isinstance(key, int) else str(key)
-        controls_id = id(self.controls)
-        player_controls_id = (
-            id(self.player.controls) if hasattr(self, "player") else None
-        )
-
-        state_before = {}
-        for n, k in enumerate(KEYS):
-            state_before[n] = self.controls.getState(k)
+    def getEventPosition(self, time=None):
+        """
+        Return the song position at the moment of an input event.
 
-        Log.debug(
-            f"[SCENE] KEYDOWN {key_name} | controls_id={controls_id} player_id={player_controls_id} same={controls_id == player_controls_id}"
-        )
-        # ========================================================================
+        @param time:  Event time in C{pygame.time.get_ticks()} milliseconds,
+                      or None for the current position
+        """
+        pos = self.getSongPosition()
+        if time is not None and not self.paused:
+            lag = pygame.time.get_ticks() - time
+            pos -= min(max(lag, 0), self.maxSimulationLag)
+        return pos
 
+    def keyPressed(self, key, unicode="", time=None):
         control = self.controls.keyPressed(key)
 
         # ========================================================================
@@ -630,42 +616,28 @@ class GuitarSceneClient(GuitarScene, SceneClient):
             self._controls_snapshot = {}
             for n, k in enumerate(KEYS):
                 self._controls_snapshot[k] = self.controls.getState(k)
-
-            Log.debug(
-                f"[SNAPSHOT] Capturado no STRUM: {[n for n in range(5) if self._controls_snapshot.get(KEYS[n])]}"
-            )
         # ========================================================================
 
-        # ========================================================================
-        # 🔍 DEBUG (remover depois)
-        # ========================================================================
-        state_after = {}
-        for n, k in enumerate(KEYS):
-            state_after[n] = self.controls.getState(k)
-
-        changed = {
-            n: (state_before[n], state_after[n])
-            for n in range(5)
-            if state_before[n] != state_after[n]
-        }
-        if changed:
-            Log.debug(f"[SCENE] KEYDOWN {key_name} changed controls: {changed}")
-        # ========================================================================
+        # Judge the key at the time it was pressed; catch the simulation up
+        # to that point first so that everything before it is settled
+        pos = self.getEventPosition(time)
+        if self.song and (
+            control in KEYS or control in (Player.ACTION1, Player.ACTION2)
+        ):
+            pos = self.simulate(pos)
+            self.replay.addControl(pos, control, True)
 
         if control in (Player.ACTION1, Player.ACTION2):
-            for k in KEYS:
-                if self.controls.getState(k):
-                    self.keyBurstTimeout = None
-                    break
+            if self.controls.flags & KEY_MASK:
+                self.keyBurstTimeout = None
             else:
-                self.keyBurstTimeout = self.engine.timer.time + self.keyBurstPeriod
+                self.keyBurstTimeout = pos + self.keyBurstPeriod
                 return True
 
         if control in (Player.ACTION1, Player.ACTION2) and self.song:
-            self.doPick()
+            self.doPick(pos)
         elif control in KEYS and self.song:
             # Check whether we can tap the currently required notes
-            pos = self.getSongPosition()
             notes = self.guitar.getRequiredNotes(self.song, pos)
 
             if (
@@ -673,7 +645,7 @@ class GuitarSceneClient(GuitarScene, SceneClient):
                 and self.guitar.areNotesTappable(notes)
                 and self.guitar.controlsMatchNotes(self.controls, notes)
             ):
-                self.doPick()
+                self.doPick(pos)
         elif control == Player.CANCEL:
             # --- ESC fix: debounce + não sair da cena por "spam" de cancel ---
             now_ms = pygame.time.get_ticks()
@@ -703,66 +675,40 @@ class GuitarSceneClient(GuitarScene, SceneClient):
             else:
                 self.enteredCode = []
 
-    def getExtraScoreForCurrentlyPlayedNotes(self):
+    def getExtraScoreForCurrentlyPlayedNotes(self, pos=None):
         if not self.song:
             return 0
 
+        if pos is None:
+            pos = self.getSongPosition()
         noteCount = len(self.guitar.playedNotes)
-        pickLength = self.guitar.getPickLength(self.getSongPosition())
+        pickLength = self.guitar.getPickLength(pos)
         if pickLength > 1.1 * self.song.period / 4:
             return int(0.1 * pickLength * noteCount)
         return 0
 
-    def keyReleased(self, key):
-        # ========================================================================
-        # 🔍 DEBUG: Verificar estado ANTES e DEPOIS
-        # ========================================================================
-        import Log
-
-        key_name = pygame.key.name(key) if isinstance(key, int) else str(key)
-
-        # Estado ANTES
-        state_before = {}
-        for n, k in enumerate(KEYS):
-            state_before[n] = self.controls.getState(k)
-
-        # ========================================================================
-
+    def keyReleased(self, key, time=None):
         result = self.controls.keyReleased(key)
 
-        # ========================================================================
-        # 🔍 DEBUG: Estado DEPOIS
-        # ========================================================================
-        state_after = {}
-        for n, k in enumerate(KEYS):
-            state_after[n] = self.controls.getState(k)
-
-        # Ver o que mudou
-        changed = {
-            n: (state_before[n], state_after[n])
-            for n in range(5)
-            if state_before[n] != state_after[n]
-        }
-        if changed:
-            Log.debug(f"[SCENE] KEYUP {key_name} changed controls: {changed}")
-        # ========================================================================
+        if self.song and (result in KEYS or result in (Player.ACTION1, Player.ACTION2)):
+            pos = self.simulate(self.getEventPosition(time))
+            self.replay.addControl(pos, result, False)
 
         if result in KEYS and self.song:
             # Check whether we can tap the currently required notes
-            pos = self.getSongPosition()
             notes = self.guitar.getRequiredNotes(self.song, pos)
             if (
                 self.player.streak > 0
                 and self.guitar.areNotesTappable(notes)
                 and self.guitar.controlsMatchNotes(self.controls, notes)
             ):
-                self.doPick()
+                self.doPick(pos)
             # Otherwise we end the pick if the notes have been playing long enough
             elif (
                 self.lastPickPos is not None
                 and pos - self.lastPickPos > self.song.period / 2
             ):
-                self.endPick()
+                self.endPick(pos)
 
     # --------------------
     # Render
@@ -0,0 +1,84 @@
+#####################################################################
+# -*- coding: iso-8859-1 -*-                                        #
+#                                                                   #
+# Frets on Fire                                                     #
+# Copyright (C) 2006 Sami Kystil                                  #
+#                                                                   #
+# This program is free software; you can redistribute it and/or     #
+# modify it under the terms of the GNU General Public License       #
+# as published by the Free Software Foundation; either version 2    #
+# of the License, or (at your option) any later version.            #
+#                                                                   #
+# This program is distributed in the hope that it will be useful,   #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of    #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the     #
+# GNU General Public License for more details.                      #
+#                                                                   #
+# You should have received a copy of the GNU General Public License #
+# along with this program; if not, write to the Free Software       #
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,        #
+# MA  02110-1301, USA.                                              #
+#####################################################################
+
+
+import unittest
+import itertools
+
+import Player
+from Guitar import Guitar, KEYS
+from Song import Note
+
+class GuitarTest(unittest.TestCase):
+  class Engine:
+    class resource:
+      @staticmethod
+      def load(*args, **kwargs):
+        pass
+
+    class config:
+      @staticmethod
+      def get(section, option):
+        return True
+
+    def loadSvgDrawing(self, *args, **kwargs):
+      pass
+
+  class KeyControls:
+    """Controls that only answer getState(), for the key by key path."""
+    def __init__(self, flags):
+      self.state = flags
+
+    def getState(self, control):
+      return self.state & control
+
+  def testControlsMatchNotes(self):
+    guitar = Guitar(self.Engine())
+    frets = range(len(KEYS))
+    chords = [c for n in range(1, 4) for c in itertools.combinations(frets, n)]
+
+    for chord in chords:
+      for other in [None] + chords[:8]:
+        notes = [(100.0, Note(n, 0)) for n in chord]
+        if other:
+          notes += [(200.0, Note(n, 0)) for n in other]
+
+        for held in range(1 << len(KEYS)):
+          controls = Player.Controls()
+          for n in frets:
+            if held & (1 << n):
+              controls.toggle(KEYS[n], True)
+          controls.toggle(Player.ACTION1, True)
+
+          expected = guitar.controlsMatchNotesLegacy(controls, notes)
+          assert guitar.controlsMatchNotes(controls, notes) == expected, (chord, other, held)
+          assert guitar.controlsMatchNotes(self.KeyControls(controls.flags), notes) == expected
+
+    controls = Player.Controls()
+    controls.toggle(KEYS[0], True)
+    controls.toggle(KEYS[2], True)
+    assert guitar.controlsMatchNotes(controls, [(0.0, Note(2, 0))])
+    assert not guitar.controlsMatchNotes(controls, [(0.0, Note(1, 0))])
+    assert not guitar.controlsMatchNotes(controls, [])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -8,19 +8,29 @@
 #                                                                   #
 #####################################################################
 
+import inspect
 import pygame
 import Log
 import Audio
+import Trace
 
 from Task import Task
 from Player import Controls
 
 
 class KeyListener:
-    def keyPressed(self, key, unicode):
+    """
+    Receives key presses and releases.
+
+    Listeners that take a C{time} argument also get the time of the event in
+    C{pygame.time.get_ticks()} milliseconds, which can be earlier than the
+    moment it is dispatched.
+    """
+
+    def keyPressed(self, key, unicode, time=None):
         pass
 
-    def keyReleased(self, key):
+    def keyReleased(self, key, time=None):
         pass
 
 
@@ -66,6 +76,10 @@ class Input(Task):
         # Track keyboard state to heal missed KEYDOWN/KEYUP
         self._kb_down = {}  # keycode(int) -> bool
 
+        # Events polled ahead of dispatch, with their times
+        self.pendingEvents = []
+        self._timeArgs = {}
+
         # Initialize joysticks
         pygame.joystick.init()
         self.joystickAxes = {}
@@ -87,11 +101,6 @@ class Input(Task):
         self.getSystemKeyName = pygame.key.name
         pygame.key.name = self.getKeyName
 
-        # Debug: ring buffer de eventos de teclado
-        self.debugKeyTrace = True
-        self._key_event_ring = []
-        self._key_event_ring_max = 80
-
     def reloadControls(self):
         self.controls = Controls()
 
@@ -131,19 +140,37 @@ class Input(Task):
         if listener in self.systemListeners:
             self.systemListeners.remove(listener)
 
-    def broadcastEvent(self, listeners, function, *args):
+    def _takesTime(self, handler):
+        function = getattr(handler, "__func__", handler)
+        takesTime = self._timeArgs.get(function)
+        if takesTime is None:
+            try:
+                parameters = inspect.signature(handler).parameters
+            except (TypeError, ValueError):
+                parameters = {}
+            takesTime = "time" in parameters or any(
+                p.kind == p.VAR_KEYWORD for p in parameters.values()
+            )
+            self._timeArgs[function] = takesTime
+        return takesTime
+
+    def broadcastEvent(self, listeners, function, *args, time=None):
         """
         IMPORTANTE:
         - Itera do topo para baixo (último listener adicionado primeiro)
         - Para na primeira camada que "consumir" o evento (retornar True)
         - Usa list() para evitar problemas se a lista for modificada durante o dispatch
+        - C{time} só é repassado aos handlers que aceitam esse argumento
         """
         for l in reversed(list(listeners)):
             handler = getattr(l, function, None)
             if not handler:
                 continue
             try:
-                if handler(*args):
+                if time is not None and self._takesTime(handler):
+                    if handler(*args, time=time):
+                        return True
+                elif handler(*args):
                     return True
             except TypeError:
                 try:
@@ -210,15 +237,27 @@ class Input(Task):
             return "Joy #%d, %s" % (joy + 1, chr(ord("A") + but))
         return self.getSystemKeyName(id)
 
-    def _dispatch_keydown(self, keycode, uni="\x00"):
+    def _dispatch_keydown(self, keycode, uni="\x00", time=None):
+        if time is None:
+            time = pygame.time.get_ticks()
+        if Trace.enabled:
+            Trace.trace(Trace.KEY, v0=time, a0=keycode, a1=1, a2=pygame.key.get_mods())
         if not self.broadcastEvent(
-            self.priorityKeyListeners, "keyPressed", keycode, uni
+            self.priorityKeyListeners, "keyPressed", keycode, uni, time=time
         ):
-            self.broadcastEvent(self.keyListeners, "keyPressed", keycode, uni)
+            self.broadcastEvent(
+                self.keyListeners, "keyPressed", keycode, uni, time=time
+            )
 
-    def _dispatch_keyup(self, keycode):
-        if not self.broadcastEvent(self.priorityKeyListeners, "keyReleased", keycode):
-            self.broadcastEvent(self.keyListeners, "keyReleased", keycode)
+    def _dispatch_keyup(self, keycode, time=None):
+        if time is None:
+            time = pygame.time.get_ticks()
+        if Trace.enabled:
+            Trace.trace(Trace.KEY, v0=time, a0=keycode, a1=0, a2=pygame.key.get_mods())
+        if not self.broadcastEvent(
+            self.priorityKeyListeners, "keyReleased", keycode, time=time
+        ):
+            self.broadcastEvent(self.keyListeners, "keyReleased", keycode, time=time)
 
     def _reconcile_keyboard_state(self):
         """
@@ -279,37 +318,31 @@ class Input(Task):
                 )
                 self._dispatch_keyup(keycode)
 
-    def getKeyDebugSnapshot(self, keycodes):
+    def pollEvents(self):
         """
-        Retorna um snapshot para debug:
-        - estado SDL (get_pressed)
-        - último histórico de KEYDOWN/KEYUP
+        Move waiting events off the SDL queue and stamp them with the time.
+
+        Called between frames while the engine is idle, so that key events
+        get a time closer to when they happened than the next frame. The
+        engine dispatches them with L{dispatchEvents} once the wait is over,
+        before the frame is simulated.
         """
-        snap = {}
-        try:
-            pressed = pygame.key.get_pressed()
-        except Exception:
-            pressed = None
-
-        for kc in keycodes:
-            sdl_down = None
-            if pressed is not None and 0 <= kc < len(pressed):
-                sdl_down = bool(pressed[kc])
-            snap[kc] = {
-                "sdl": sdl_down,
-            }
-
-        return {
-            "mods": pygame.key.get_mods(),
-            "tick": pygame.time.get_ticks(),
-            "keys": snap,
-            "recent": list(self._key_event_ring),
-        }
+        pygame.event.pump()
+        events = pygame.event.get()
+        if events:
+            now = pygame.time.get_ticks()
+            for event in events:
+                self.pendingEvents.append((getattr(event, "timestamp", now), event))
 
     def run(self, ticks):
-        pygame.event.pump()
+        self.dispatchEvents()
+
+    def dispatchEvents(self):
+        """Poll the event queue and dispatch all pending events with their times."""
+        self.pollEvents()
+        pendingEvents, self.pendingEvents = self.pendingEvents, []
 
-        for event in pygame.event.get():
+        for time, event in pendingEvents:
             if event.type == pygame.KEYDOWN:
                 uni = getattr(event, "unicode", "\x00")
 
@@ -317,46 +350,14 @@ class Input(Task):
                 if isinstance(event.key, int):
                     self._kb_down[event.key] = True
 
-                # DEBUG: estado no instante do strum (mantido para diagnóstico)
-                if event.key == pygame.K_RETURN:
-                    try:
-                        Log.debug(
-                            "[STRUM] ticks=%d kb[F1]=%s kb[F2]=%s kb[F3]=%s mods=%s"
-                            % (
-                                pygame.time.get_ticks(),
-                                self._kb_down.get(pygame.K_F1),
-                                self._kb_down.get(pygame.K_F2),
-                                self._kb_down.get(pygame.K_F3),
-                                pygame.key.get_mods(),
-                            )
-                        )
-                    except Exception:
-                        pass
-
-                if self.debugKeyTrace:
-                    mod = pygame.key.get_mods()
-                    self._key_event_ring.append(
-                        ("KD", event.key, uni, mod, pygame.time.get_ticks())
-                    )
-                    if len(self._key_event_ring) > self._key_event_ring_max:
-                        self._key_event_ring.pop(0)
-
-                self._dispatch_keydown(event.key, uni)
+                self._dispatch_keydown(event.key, uni, time)
 
             elif event.type == pygame.KEYUP:
                 # Track keyboard state (ALL keyboard keys, including function keys)
                 if isinstance(event.key, int):
                     self._kb_down[event.key] = False
 
-                if self.debugKeyTrace:
-                    mod = pygame.key.get_mods()
-                    self._key_event_ring.append(
-                        ("KU", event.key, "\x00", mod, pygame.time.get_ticks())
-                    )
-                    if len(self._key_event_ring) > self._key_event_ring_max:
-                        self._key_event_ring.pop(0)
-
-                self._dispatch_keyup(event.key)
+                self._dispatch_keyup(event.key, time)
 
             elif event.type == pygame.MOUSEMOTION:
                 self.broadcastEvent(
@@ -407,11 +408,11 @@ class Input(Task):
 
             elif event.type == pygame.JOYBUTTONDOWN:
                 jid = self.encodeJoystickButton(event.joy, event.button)
-                self._dispatch_keydown(jid, "\x00")
+                self._dispatch_keydown(jid, "\x00", time)
 
             elif event.type == pygame.JOYBUTTONUP:
                 jid = self.encodeJoystickButton(event.joy, event.button)
-                self._dispatch_keyup(jid)
+                self._dispatch_keyup(jid, time)
 
             elif event.type == pygame.JOYAXISMOTION:
                 try:
@@ -446,9 +447,9 @@ class Input(Task):
                     if keyEvent and args is not None:
                         self.joystickAxes[event.joy][event.axis] = state
                         if keyEvent == "down":
-                            self._dispatch_keydown(*args)
+                            self._dispatch_keydown(*args, time=time)
                         else:
-                            self._dispatch_keyup(*args)
+                            self._dispatch_keyup(*args, time=time)
 
                 except KeyError:
                     pass
@@ -461,10 +462,11 @@ class Input(Task):
                         self._dispatch_keydown(
                             self.encodeJoystickHat(event.joy, event.hat, event.value),
                             "\x00",
+                            time,
                         )
                     else:
                         self._dispatch_keyup(
-                            self.encodeJoystickHat(event.joy, event.hat, state)
+                            self.encodeJoystickHat(event.joy, event.hat, state), time
                         )
                         self.joystickHats[event.joy][event.hat] = (0, 0)
                 except KeyError:
@@ -0,0 +1,66 @@
+#####################################################################
+# -*- coding: iso-8859-1 -*-                                        #
+#                                                                   #
+# Frets on Fire                                                     #
+# Copyright (C) 2006 Sami Kystil                                  #
+#                                                                   #
+# This program is free software; you can redistribute it and/or     #
+# modify it under the terms of the GNU General Public License       #
+# as published by the Free Software Foundation; either version 2    #
+# of the License, or (at your option) any later version.            #
+#                                                                   #
+# This program is distributed in the hope that it will be useful,   #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of    #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the     #
+# GNU General Public License for more details.                      #
+#                                                                   #
+# You should have received a copy of the GNU General Public License #
+# along with this program; if not, write to the Free Software       #
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,        #
+# MA  02110-1301, USA.                                              #
+#####################################################################
+
+
+import unittest
+import pygame
+from Input import Input, KeyListener
+
+class InputTest(unittest.TestCase):
+  def setUp(self):
+    pygame.init()
+
+  def tearDown(self):
+    pygame.quit()
+
+  def testEventTime(self):
+    class OldListener(KeyListener):
+      def __init__(self):
+        self.pressed = []
+
+      def keyPressed(self, key, unicode):
+        self.pressed.append((key, unicode))
+
+    class TimedListener(KeyListener):
+      def __init__(self):
+        self.pressed = []
+        self.released = []
+
+      def keyPressed(self, key, unicode, time = None):
+        self.pressed.append((key, unicode, time))
+
+      def keyReleased(self, key, time = None):
+        self.released.append((key, time))
+
+    input = Input()
+    old, timed = OldListener(), TimedListener()
+    input.addKeyListener(old)
+    input.addKeyListener(timed)
+
+    input._dispatch_keydown(pygame.K_a, "a", 1234)
+    input._dispatch_keyup(pygame.K_a, 1250)
+    assert timed.pressed == [(pygame.K_a, "a", 1234)]
+    assert timed.released == [(pygame.K_a, 1250)]
+    assert old.pressed == [(pygame.K_a, "a")]
+
+if __name__ == "__main__":
+  unittest.main()
@@ -7,6 +7,7 @@
 #####################################################################
 
 from OpenGL.GL import *
+import numpy
 
 import Collada
 
@@ -17,6 +18,7 @@ class Mesh:
         self.doc.LoadDocumentFromFile(fileName)
         self.geoms = {}
         self.fullGeoms = {}
+        self.triangles = {}
 
     def _unflatten(self, array, stride):
         """
@@ -29,6 +31,54 @@ class Mesh:
         count = len(array) // stride
         return [tuple(array[i * stride : (i + 1) * stride]) for i in range(count)]
 
+    def _readPrimitive(self, geom, prim):
+        """
+        Resolve as fontes de um primitivo.
+
+        @return: (maxOffset, (offset, vértices), (offset, normais),
+                 (offset, texcoords)); o offset é None se a fonte não existir
+        """
+        maxOffset = 0
+        vertexOffset = None
+        normalOffset = None
+        texcoordOffset = None
+        vertices = None
+        normals = None
+        texcoords = None
+
+        for input in prim.inputs:
+            maxOffset = max(maxOffset, input.offset)
+            if input.semantic == "VERTEX":
+                vertexOffset = input.offset
+                vertices = geom.data.FindSource(
+                    geom.data.vertices.FindInput("POSITION")
+                )
+                assert vertices.techniqueCommon.accessor.stride == 3
+                vertices = self._unflatten(
+                    vertices.source.data,
+                    vertices.techniqueCommon.accessor.stride,
+                )
+            elif input.semantic == "NORMAL":
+                normalOffset = input.offset
+                normals = geom.data.FindSource(input)
+                normals = self._unflatten(normals.source.data, 3)
+            elif input.semantic == "TEXCOORD":
+                texcoordOffset = input.offset
+                texcoords = geom.data.FindSource(input)
+                texcoords = self._unflatten(texcoords.source.data, 2)
+
+        if normalOffset is None:
+            normals = geom.data.FindSource(geom.data.vertices.FindInput("NORMAL"))
+            normals = self._unflatten(normals.source.data, 3)
+            normalOffset = vertexOffset
+
+        return (
+            maxOffset,
+            (vertexOffset, vertices),
+            (normalOffset, normals),
+            (texcoordOffset, texcoords),
+        )
+
     def setupLight(self, light, n, pos):
         l = light.techniqueCommon
         glEnable(GL_LIGHTING)
@@ -37,6 +87,125 @@ class Mesh:
         glLightfv(GL_LIGHT0 + n, GL_DIFFUSE, (l.color[0], l.color[1], l.color[2], 0.0))
         glLightfv(GL_LIGHT0 + n, GL_AMBIENT, (0.0, 0.0, 0.0, 0.0))
 
+    def setupLights(self):
+        """Liga as luzes da cena (com a matriz corrente)."""
+        for scene in self.doc.visualScenesLibrary.items:
+            for node in scene.nodes:
+                for n, light in enumerate(node.iLights):
+                    if light.object:
+                        pos = [0.0, 0.0, 0.0, 1.0]
+                        for t in node.transforms:
+                            if t[0] == "translate":
+                                pos = t[1]
+                        self.setupLight(light.object, n, pos)
+
+    def resetLights(self):
+        glDisable(GL_LIGHTING)
+        for n in range(8):
+            glDisable(GL_LIGHT0 + n)
+
+    def _nodeMatrix(self, node):
+        """Matriz 4x4 equivalente às chamadas glTranslatef/glRotatef/glScalef."""
+        m = numpy.identity(4)
+        for t in node.transforms:
+            if t[0] == "translate":
+                tm = numpy.identity(4)
+                tm[:3, 3] = t[1][:3]
+            elif t[0] == "rotate":
+                axis = numpy.array(t[1][:3], numpy.float64)
+                norm = numpy.sqrt(numpy.dot(axis, axis))
+                if not norm:
+                    continue
+                x, y, z = axis / norm
+                a = numpy.radians(t[1][3])
+                c, s = numpy.cos(a), numpy.sin(a)
+                tm = numpy.identity(4)
+                d = 1 - c
+                tm[:3, :3] = [
+                    [x * x * d + c, x * y * d - z * s, x * z * d + y * s],
+                    [y * x * d + z * s, y * y * d + c, y * z * d - x * s],
+                    [x * z * d - y * s, y * z * d + x * s, z * z * d + c],
+                ]
+            elif t[0] == "scale":
+                tm = numpy.diag(list(t[1][:3]) + [1.0])
+            else:
+                continue
+            m = numpy.dot(m, tm)
+        return m
+
+    def getTriangles(self, geomName=None):
+        """
+        Retorna a geometria de um nó como arrays para glDrawArrays.
+
+        Os polígonos são triangulados em leque e as transformações do nó já
+        vêm aplicadas; as normais são transformadas como o OpenGL faz (inversa
+        transposta, sem normalizar), então o resultado é o mesmo de render().
+
+        @param geomName:  Nome do nó, ou None para todos
+        @return:          (vértices, normais) em arrays float32 (n, 3)
+        """
+        if geomName in self.triangles:
+            return self.triangles[geomName]
+
+        vertexList = []
+        normalList = []
+        for scene in self.doc.visualScenesLibrary.items:
+            for node in scene.nodes:
+                if geomName is not None and node.name != geomName:
+                    continue
+                m = self._nodeMatrix(node)
+                nm = numpy.linalg.inv(m[:3, :3]).T
+                for geom in node.iGeometries:
+                    if not geom.object:
+                        continue
+                    for prim in geom.object.data.primitives:
+                        (
+                            maxOffset,
+                            (vertexOffset, vertices),
+                            (normalOffset, normals),
+                            _texcoords,
+                        ) = self._readPrimitive(geom.object, prim)
+
+                        if hasattr(prim, "polygons"):
+                            polys = prim.polygons
+                        elif hasattr(prim, "triangles"):
+                            polys = [
+                                prim.triangles[i : i + 3 * (maxOffset + 1)]
+                                for i in range(
+                                    0, len(prim.triangles), 3 * (maxOffset + 1)
+                                )
+                            ]
+                        else:
+                            continue
+
+                        v = []
+                        n = []
+                        for poly in polys:
+                            corners = self._unflatten(poly, maxOffset + 1)
+                            for i in range(1, len(corners) - 1):
+                                for indices in (corners[0], corners[i], corners[i + 1]):
+                                    v.append(vertices[indices[vertexOffset]])
+                                    n.append(normals[indices[normalOffset]])
+                        if not v:
+                            continue
+                        v = numpy.array(v, numpy.float64)
+                        n = numpy.array(n, numpy.float64)
+                        vertexList.append(numpy.dot(v, m[:3, :3].T) + m[:3, 3])
+                        normalList.append(numpy.dot(n, nm.T))
+
+        if vertexList:
+            result = (
+                numpy.concatenate(vertexList).astype(numpy.float32),
+                numpy.concatenate(normalList).astype(numpy.float32),
+            )
+        else:
+            result = (
+                numpy.zeros((0, 3), numpy.float32),
+                numpy.zeros((0, 3), numpy.float32),
+            )
+        self.triangles[geomName] = result
+        return result
+
     def setupMaterial(self, material):
         for m in material.techniqueCommon.iMaterials:
             if m.object:
@@ -77,41 +246,12 @@ class Mesh:
                 glNewList(self.geoms[geom.name], GL_COMPILE)
 
                 for prim in geom.data.primitives:
-                    maxOffset = 0
-                    vertexOffset = None
-                    normalOffset = None
-                    texcoordOffset = None
-                    vertices = None
-                    normals = None
-                    texcoords = None
-
-                    for input in prim.inputs:
-                        maxOffset = max(maxOffset, input.offset)
-                        if input.semantic == "VERTEX":
-                            vertexOffset = input.offset
-                            vertices = geom.data.FindSource(
-                                geom.data.vertices.FindInput("POSITION")
-                            )
-                            assert vertices.techniqueCommon.accessor.stride == 3
-                            vertices = self._unflatten(
-                                vertices.source.data,
-                                vertices.techniqueCommon.accessor.stride,
-                            )
-                        elif input.semantic == "NORMAL":
-                            normalOffset = input.offset
-                            normals = geom.data.FindSource(input)
-                            normals = self._unflatten(normals.source.data, 3)
-                        elif input.semantic == "TEXCOORD":
-                            texcoordOffset = input.offset
-                            texcoords = geom.data.FindSource(input)
-                            texcoords = self._unflatten(texcoords.source.data, 2)
-
-                    if normalOffset is None:
-                        normals = geom.data.FindSource(
-                            geom.data.vertices.FindInput("NORMAL")
-                        )
-                        normals = self._unflatten(normals.source.data, 3)
-                        normalOffset = vertexOffset
+                    (
+                        maxOffset,
+                        (vertexOffset, vertices),
+                        (normalOffset, normals),
+                        (texcoordOffset, texcoords),
+                    ) = self._readPrimitive(geom, prim)
 
                     def drawElement(indices, offset, array, func):
                         if offset is not None:
@@ -145,16 +285,7 @@ class Mesh:
         glNewList(self.fullGeoms[geomName], GL_COMPILE)
 
         if self.geoms:
-            # Luzes
-            for scene in self.doc.visualScenesLibrary.items:
-                for node in scene.nodes:
-                    for n, light in enumerate(node.iLights):
-                        if light.object:
-                            pos = [0.0, 0.0, 0.0, 1.0]
-                            for t in node.transforms:
-                                if t[0] == "translate":
-                                    pos = t[1]
-                            self.setupLight(light.object, n, pos)
+            self.setupLights()
 
             # Geometria
             for scene in self.doc.visualScenesLibrary.items:
@@ -175,9 +306,7 @@ class Mesh:
                                 glCallList(self.geoms[geom.object.name])
                             glPopMatrix()
 
-            glDisable(GL_LIGHTING)
-            for n in range(8):
-                glDisable(GL_LIGHT0 + n)
+            self.resetLights()
 
         glEndList()
 
@@ -0,0 +1,146 @@
+#####################################################################
+# -*- coding: iso-8859-1 -*-                                        #
+#                                                                   #
+# Frets on Fire                                                     #
+# Copyright (C) 2006 Sami Kystil                                  #
+#                                                                   #
+# This program is free software; you can redistribute it and/or     #
+# modify it under the terms of the GNU General Public License       #
+# as published by the Free Software Foundation; either version 2    #
+# of the License, or (at your option) any later version.            #
+#                                                                   #
+# This program is distributed in the hope that it will be useful,   #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of    #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the     #
+# GNU General Public License for more details.                      #
+#                                                                   #
+# You should have received a copy of the GNU General Public License #
+# along with this program; if not, write to the Free Software       #
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,        #
+# MA  02110-1301, USA.                                              #
+#####################################################################
+
+"""
+Recorded plays.
+
+A replay logs every frame and every change of a gameplay control of a play
+with its song position. Those positions are all the note judgement in
+L{GuitarScene} depends on, so feeding the log to L{Simulator} reproduces the
+score and streak of the original play.
+"""
+
+import os
+import struct
+
+import numpy
+
+import Log
+
+FRAME = 0
+
+# Autoplay being turned on (pressed) or off; not a L{Player} control
+AUTOPLAY = 0xFFFF
+
+
+class Replay(object):
+    """
+    Frames and control events of a play.
+
+    @ivar songHash:        SHA-1 of the notes file the replay was played on
+    @ivar difficulty:      Difficulty id
+    @ivar simulationStep:  Judgement step in milliseconds
+    @ivar tapping:         Whether tappable notes were enabled
+    """
+
+    magic = b"FOFR"
+    version = 1
+    header = struct.Struct("<4sI20sdBBI")
+    record = numpy.dtype([("pos", "<f8"), ("control", "<u2"), ("pressed", "u1")])
+
+    def __init__(self):
+        self.songHash = None
+        self.difficulty = 0
+        self.simulationStep = 1.0
+        self.tapping = True
+        self.events = []
+
+    def addFrame(self, pos):
+        """Log a frame that ran the judgement up to the given position."""
+        self.events.append((pos, FRAME, False))
+
+    def addControl(self, pos, control, pressed):
+        """
+        Log a control changing state.
+
+        @param pos:      Song position of the key event
+        @param control:  L{Player} control flag
+        @param pressed:  True if pressed, False if released
+        """
+        self.events.append((pos, control, pressed))
+
+    def addAutoPlay(self, pos, enabled):
+        """Log autoplay being turned on or off at the given position."""
+        self.events.append((pos, AUTOPLAY, enabled))
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        """
+        Iterate over (position, control, pressed); frames have L{FRAME} and
+        autoplay changes L{AUTOPLAY}.
+        """
+        return iter(self.events)
+
+    def save(self, fileName):
+        rows = numpy.array(self.events, self.record)
+        with open(fileName + ".tmp", "wb") as f:
+            f.write(
+                self.header.pack(
+                    self.magic,
+                    self.version,
+                    bytes.fromhex(self.songHash) if self.songHash else bytes(20),
+                    self.simulationStep,
+                    self.difficulty,
+                    self.tapping,
+                    len(rows),
+                )
+            )
+            f.write(rows.tobytes())
+        os.replace(fileName + ".tmp", fileName)
+
+    @classmethod
+    def load(cls, fileName):
+        """
+        Read a replay file.
+
+        @return: L{Replay}, or None if the file isn't a valid replay
+        """
+        try:
+            with open(fileName, "rb") as f:
+                data = f.read()
+            magic, version, digest, step, difficulty, tapping, count = (
+                cls.header.unpack_from(data)
+            )
+            if magic != cls.magic or version != cls.version:
+                return None
+            rows = numpy.frombuffer(
+                data, cls.record, count=count, offset=cls.header.size
+            )
+        except Exception as e:
+            Log.warn("Unable to read replay %s: %s" % (fileName, e))
+            return None
+
+        replay = cls()
+        replay.songHash = digest.hex() if any(digest) else None
+        replay.simulationStep = step
+        replay.difficulty = difficulty
+        replay.tapping = bool(tapping)
+        replay.events = list(
+            zip(
+                rows["pos"].tolist(),
+                rows["control"].tolist(),
+                [bool(p) for p in rows["pressed"].tolist()],
+            )
+        )
+        return replay
@@ -0,0 +1,112 @@
+#####################################################################
+# -*- coding: iso-8859-1 -*-                                        #
+#                                                                   #
+# Frets on Fire                                                     #
+# Copyright (C) 2006 Sami Kystil                                  #
+#                                                                   #
+# This program is free software; you can redistribute it and/or     #
+# modify it under the terms of the GNU General Public License       #
+# as published by the Free Software Foundation; either version 2    #
+# of the License, or (at your option) any later version.            #
+#                                                                   #
+# This program is distributed in the hope that it will be useful,   #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of    #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the     #
+# GNU General Public License for more details.                      #
+#                                                                   #
+# You should have received a copy of the GNU General Public License #
+# along with this program; if not, write to the Free Software       #
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,        #
+# MA  02110-1301, USA.                                              #
+#####################################################################
+
+import unittest
+import os
+import tempfile
+
+import Player
+from Guitar import KEYS
+from Replay import Replay, FRAME, AUTOPLAY
+from Simulator import Simulator, loadChart
+
+class ReplayTest(unittest.TestCase):
+  def testSaveLoad(self):
+    replay = Replay()
+    replay.songHash = "00" * 19 + "ff"
+    replay.difficulty = 2
+    replay.simulationStep = 2.5
+    replay.tapping = False
+    replay.addFrame(-1000.0)
+    replay.addControl(12.125, Player.KEY3, True)
+    replay.addControl(14.0, Player.ACTION1, True)
+    replay.addFrame(16.5)
+    replay.addControl(20.0, Player.KEY3, False)
+
+    fileName = os.path.join(tempfile.mkdtemp(), "test.replay")
+    replay.save(fileName)
+    loaded = Replay.load(fileName)
+    assert list(loaded) == list(replay)
+    assert loaded.songHash == replay.songHash
+    assert loaded.difficulty == 2 and loaded.simulationStep == 2.5
+    assert not loaded.tapping
+    assert [e[1] for e in loaded].count(FRAME) == 2
+
+    with open(fileName, "wb") as f:
+      f.write(b"garbage")
+    assert Replay.load(fileName) is None
+
+  def testPlayback(self):
+    song = loadChart(os.path.join("..", "data", "songs", "tutorial"))
+    chords = song.track.getChordTable()
+
+    # A sloppy player: late, early and wrong frets
+    events = []
+    for chord in range(len(chords.times)):
+      time = float(chords.times[chord]) + (chord * 37 % 150) - 60
+      frets = [KEYS[note.number] for t, note in chords.getNotes(chord)]
+      if chord % 7 == 3:
+        frets = [KEYS[(KEYS.index(frets[0]) + 1) % len(KEYS)]]
+      events += [(time - 25, k, True) for k in frets]
+      events += [(time, Player.ACTION1, True), (time + 10, Player.ACTION1, False)]
+      events += [(time + 40, k, False) for k in frets]
+    events.sort(key = lambda e: e[0])
+
+    simulator = Simulator(song, frameTime = 1000.0 / 37)
+    played = simulator.run(events)
+    assert 0 < played.notesHit < played.notes
+
+    fileName = os.path.join(tempfile.mkdtemp(), "test.replay")
+    simulator.scene.replay.save(fileName)
+    replay = Replay.load(fileName)
+
+    for i in range(2):
+      replayed = Simulator(song).replay(replay)
+      assert replayed.score == played.score
+      assert replayed.streak == played.streak
+      assert replayed.longestStreak == played.longestStreak
+      assert replayed.notesHit == played.notesHit
+      assert replayed.badPicks == played.badPicks
+
+  def testAutoPlay(self):
+    song = loadChart(os.path.join("..", "data", "songs", "tutorial"))
+    chords = song.track.getChordTable()
+
+    # Strum the first chords with the wrong fret, then let autoplay take over
+    events = []
+    for chord in range(4):
+      time = float(chords.times[chord])
+      events += [(time - 20, Player.KEY5, True), (time, Player.ACTION1, True),
+                 (time + 10, Player.ACTION1, False), (time + 15, Player.KEY5, False)]
+    events.append((float(chords.times[4]) - 100, AUTOPLAY, True))
+
+    simulator = Simulator(song)
+    played = simulator.run(events)
+    assert played.badPicks > 0 and played.notesHit > 0
+    assert (AUTOPLAY in [e[1] for e in simulator.scene.replay])
+
+    replayed = Simulator(song).replay(simulator.scene.replay)
+    assert replayed.score == played.score
+    assert replayed.notesHit == played.notesHit
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,495 @@
+#####################################################################
+# -*- coding: iso-8859-1 -*-                                        #
+#                                                                   #
+# Frets on Fire                                                     #
+# Copyright (C) 2006 Sami Kystil                                  #
+#                                                                   #
+# This program is free software; you can redistribute it and/or     #
+# modify it under the terms of the GNU General Public License       #
+# as published by the Free Software Foundation; either version 2    #
+# of the License, or (at your option) any later version.            #
+#                                                                   #
+# This program is distributed in the hope that it will be useful,   #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of    #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the     #
+# GNU General Public License for more details.                      #
+#                                                                   #
+# You should have received a copy of the GNU General Public License #
+# along with this program; if not, write to the Free Software       #
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,        #
+# MA  02110-1301, USA.                                              #
+#####################################################################
+
+"""
+Headless gameplay simulator.
+
+Runs the note judgement of L{GuitarScene} on a song chart without a window,
+an OpenGL context or an audio mixer. The song clock is advanced
+synthetically frame by frame, and the input comes from a list of control
+events, a recorded L{Replay.Replay} or the autoplay policy of the scene.
+
+Usage::
+
+  python Simulator.py --jobs 4 --step 5 ../data/songs/*
+"""
+
+import getopt
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import Config
+import GameEngine  # for the configuration prototype
+import Player
+import Replay
+import Song
+from Guitar import Guitar
+from GuitarScene import GuitarSceneClient
+
+PROFILED_METHODS = ["getRequiredNotes", "startPick", "getMissedNotes"]
+
+
+class SimulatedSong(object):
+    """
+    A song chart with a synthetic clock in place of the audio tracks.
+
+    Everything besides playback is delegated to the wrapped L{Song.Song}.
+    """
+
+    def __init__(self, song):
+        self.song = song
+        self.position = 0.0
+        self.guitarVolume = 1.0
+        self._playing = False
+
+    def __getattr__(self, name):
+        return getattr(self.song, name)
+
+    @property
+    def track(self):
+        return self.song.track
+
+    def play(self, start=0.0):
+        self.position = start
+        self._playing = True
+
+    def stop(self):
+        for track in self.song.tracks:
+            track.reset()
+        self._playing = False
+
+    def pause(self):
+        pass
+
+    def unpause(self):
+        pass
+
+    def update(self, ticks):
+        pass
+
+    def setGuitarVolume(self, volume):
+        self.guitarVolume = volume
+
+    def setRhythmVolume(self, volume):
+        pass
+
+    def setBackgroundVolume(self, volume):
+        pass
+
+    def getPosition(self):
+        return self.position
+
+    def isPlaying(self):
+        return self._playing
+
+
+class SimulatedEngine(object):
+    """The parts of L{GameEngine} the judgement code touches."""
+
+    class Resource(object):
+        def load(self, target, name, function, **kwargs):
+            pass
+
+        def fileName(self, *name, **kwargs):
+            return os.path.join(*name)
+
+    class Data(object):
+        screwUpSound = None
+
+    def __init__(self, config=None):
+        self.config = config or Config.load(setAsDefault=False)
+        self.resource = self.Resource()
+        self.data = self.Data()
+
+    def loadSvgDrawing(self, target, name, fileName, **kwargs):
+        pass
+
+
+class SimulatedStage(object):
+    """Stage that only counts the picks and misses it is told about."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.picks = 0
+        self.misses = 0
+
+    def run(self, pos, period):
+        pass
+
+    def triggerPick(self, pos, notes):
+        self.picks += 1
+
+    def triggerMiss(self, pos):
+        self.misses += 1
+
+
+class SimulatedChannel(object):
+    def play(self, sound):
+        pass
+
+    def setVolume(self, volume):
+        pass
+
+
+class SimulatedScene(GuitarSceneClient):
+    """
+    L{GuitarSceneClient} wired to a simulated song, stage and engine.
+
+    Only the gameplay state is set up; nothing is loaded or rendered.
+    """
+
+    def __init__(self, engine, song, player=None):
+        self.engine = engine
+        self.player = player or Player.Player(None, "simulator")
+        self.controls = self.player.controls
+        self.guitar = Guitar(engine)
+        self.stage = SimulatedStage()
+        self.sfxChannel = SimulatedChannel()
+        self.song = song
+        self.createGameState()
+        self.loadSettings()
+
+        # Input positions are song positions; the audio delay doesn't apply
+        self.delay = 0.0
+        self.guitar.setBPM(song.bpm)
+
+    def getEventPosition(self, time=None):
+        return self.getSongPosition()
+
+
+class Profile(object):
+    """
+    Wall clock time spent in a set of methods, in total and per frame.
+
+    @ivar calls:     Number of calls per method
+    @ivar total:     Total seconds per method
+    @ivar maxFrame:  Longest time per method spent in a single frame
+    """
+
+    def __init__(self, names=PROFILED_METHODS):
+        self.names = list(names)
+        self.calls = {}
+        self.total = {}
+        self.maxFrame = {}
+        self.frame = {}
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        for name in self.names:
+            self.calls[name] = 0
+            self.total[name] = 0.0
+            self.maxFrame[name] = 0.0
+            self.frame[name] = 0.0
+
+    def attach(self, target):
+        """Replace the profiled methods of an object with timed versions."""
+        for name in self.names:
+            setattr(target, name, self._timed(name, getattr(target, name)))
+
+    def _timed(self, name, method):
+        clock = time.perf_counter
+        calls, frame = self.calls, self.frame
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                frame[name] += clock() - start
+                calls[name] += 1
+
+        return timed
+
+    def endFrame(self):
+        self.frames += 1
+        for name, t in self.frame.items():
+            self.total[name] += t
+            if t > self.maxFrame[name]:
+                self.maxFrame[name] = t
+            self.frame[name] = 0.0
+
+    def getMeanFrameTime(self, name):
+        """@return: Mean seconds per frame spent in the given method"""
+        return self.total[name] / max(1, self.frames)
+
+    def __str__(self):
+        lines = []
+        for name in self.names:
+            lines.append(
+                "%-18s %8d calls %9.3f ms total %7.2f us/frame %7.2f us max"
+                % (
+                    name,
+                    self.calls[name],
+                    self.total[name] * 1e3,
+                    self.getMeanFrameTime(name) * 1e6,
+                    self.maxFrame[name] * 1e6,
+                )
+            )
+        return "\n".join(lines)
+
+
+class SimulationResult(object):
+    """Outcome of a simulated play."""
+
+    def __init__(self, player, song, stage, profile):
+        notes = [
+            event
+            for time, event in song.track.getAllEvents()
+            if isinstance(event, Song.Note)
+        ]
+        self.score = player.score
+        self.streak = player.streak
+        self.longestStreak = player.longestStreak
+        self.notesHit = player.notesHit
+        self.notes = len(notes)
+        self.misses = len([note for note in notes if not note.played])
+        self.badPicks = stage.misses
+        self.profile = profile
+
+    def __str__(self):
+        return (
+            "score %d, streak %d (longest %d), %d/%d notes hit, %d missed, "
+            "%d bad picks"
+        ) % (
+            self.score,
+            self.streak,
+            self.longestStreak,
+            self.notesHit,
+            self.notes,
+            self.misses,
+            self.badPicks,
+        )
+
+
+class Simulator(object):
+    """
+    Plays a song chart headlessly.
+
+    @param song:        L{Song.Song} with the notes loaded
+    @param engine:      L{SimulatedEngine}, or None for the default settings
+    @param frameTime:   Length of a simulated frame in milliseconds
+    @param simulationStep:  Judgement step in milliseconds, or None for the
+                            configured simulation rate
+    """
+
+    def __init__(self, song, engine=None, frameTime=1000.0 / 60, simulationStep=None):
+        self.engine = engine or SimulatedEngine()
+        self.song = SimulatedSong(song)
+        self.frameTime = frameTime
+        self.scene = SimulatedScene(self.engine, self.song)
+        self.simulationStep = simulationStep or self.scene.simulationStep
+        self.profile = Profile()
+        self.profile.attach(self.scene.guitar)
+
+        # The first key mapped to each control
+        self.keys = {}
+        for key, control in self.scene.controls.controlMapping.items():
+            self.keys.setdefault(control, key)
+
+    def feed(self, control, pressed):
+        """
+        Press or release a control at the current song position.
+        L{Replay.AUTOPLAY} turns autoplay on or off instead.
+        """
+        if control == Replay.AUTOPLAY:
+            self.scene.setAutoPlay(pressed)
+            return
+        key = self.keys[control]
+        if pressed:
+            self.scene.keyPressed(key)
+        else:
+            self.scene.keyReleased(key)
+
+    def run(self, events=(), autoPlay=False, endTime=None):
+        """
+        Play the song from the start.
+
+        @param events:    Sorted sequence of (position, control, pressed)
+                          tuples, with the L{Player} control flags or
+                          L{Replay.AUTOPLAY}
+        @param autoPlay:  Let the autoplay policy of the scene pick
+        @param endTime:   Song position to stop at, or None to play past the
+                          last note
+        @return:          L{SimulationResult}
+        """
+        song, scene = self.song, self.scene
+        if endTime is None:
+            events = list(events)
+            times = [time for time, note in song.track.getChordTable().notes[-1:]]
+            times += [event[0] for event in events[-1:]]
+            endTime = max(times + [0.0]) + 4 * song.period
+
+        self.restart()
+        scene.setAutoPlay(autoPlay)
+
+        events = iter(events)
+        event = next(events, None)
+        pos = 0.0
+        while pos < endTime:
+            pos = min(pos + self.frameTime, endTime)
+            while event is not None and event[0] <= pos:
+                song.position = event[0]
+                self.feed(event[1], event[2])
+                event = next(events, None)
+            song.position = pos
+            scene.runGuitar(self.frameTime, pos)
+            self.profile.endFrame()
+
+        return SimulationResult(scene.player, song, scene.stage, self.profile)
+
+    def replay(self, replay):
+        """
+        Play back a recorded play.
+
+        @param replay:  L{Replay.Replay} recorded on the same chart
+        @return:        L{SimulationResult}
+        """
+        song, scene = self.song, self.scene
+        self.restart()
+        scene.simulationStep = replay.simulationStep
+        if not replay.tapping:
+            for time, event in song.track.getAllEvents():
+                if isinstance(event, Song.Note):
+                    event.tappable = False
+
+        lastPos = None
+        for pos, control, pressed in replay:
+            song.position = pos
+            if control == Replay.FRAME:
+                ticks = pos - lastPos if lastPos is not None else 0.0
+                scene.runGuitar(ticks, pos)
+                self.profile.endFrame()
+                lastPos = pos
+            else:
+                self.feed(control, pressed)
+
+        return SimulationResult(scene.player, song, scene.stage, self.profile)
+
+    def restart(self):
+        """Reset the song, the player and the scene for a new play."""
+        song, scene = self.song, self.scene
+        song.stop()
+        self.profile.reset()
+        scene.player.reset()
+        scene.stage.reset()
+        scene.createGameState()
+        scene.delay = 0.0
+        scene.simulationStep = self.simulationStep
+        scene.guitar.endPick(0)
+        scene.guitar.resetCursor()
+        scene.controls.flags = 0
+        scene.controls.heldKeys = {}
+        song.play()
+        scene.songStarted = True
+
+
+def loadChart(path, difficulty=Song.AMAZING_DIFFICULTY):
+    """
+    Load the notes of a song without its audio tracks.
+
+    @param path:        Song directory with C{song.ini} and C{notes.mid}
+    @param difficulty:  Difficulty id
+    @return:            L{Song.Song} set to the given difficulty
+    """
+    song = Song.Song(
+        None,
+        os.path.join(path, "song.ini"),
+        None,
+        None,
+        None,
+        os.path.join(path, "notes.mid"),
+    )
+    song.difficulty = Song.difficulties[difficulty]
+    return song
+
+
+def simulateSong(path, difficulty=Song.AMAZING_DIFFICULTY, autoPlay=True, step=None):
+    """
+    Play a song directory with the autoplay policy.
+
+    @param step:  Judgement step in milliseconds, or None for the configured
+                  simulation rate
+    @return:      (song name, L{SimulationResult})
+    """
+    song = loadChart(path, difficulty)
+    simulator = Simulator(song, simulationStep=step)
+    return song.info.name, simulator.run(autoPlay=autoPlay)
+
+
+usage = """%(prog)s [options] songDirectory...
+Options:
+  --difficulty, -d [n]  Difficulty id (default 0, amazing)
+  --step, -s [ms]       Judgement step in milliseconds
+  --jobs, -j [n]        Number of worker processes
+  --profile             Print the judgement profile of every song
+""" % {"prog": sys.argv[0]}
+
+
+def main(args):
+    try:
+        opts, paths = getopt.getopt(
+            args, "d:s:j:", ["difficulty=", "step=", "jobs=", "profile"]
+        )
+    except getopt.GetoptError:
+        print(usage)
+        return 1
+
+    difficulty = Song.AMAZING_DIFFICULTY
+    step = None
+    jobs = 1
+    profile = False
+    for opt, arg in opts:
+        if opt in ["--difficulty", "-d"]:
+            difficulty = int(arg)
+        elif opt in ["--step", "-s"]:
+            step = float(arg)
+        elif opt in ["--jobs", "-j"]:
+            jobs = int(arg)
+        elif opt == "--profile":
+            profile = True
+
+    paths = [p for p in paths if os.path.isfile(os.path.join(p, "notes.mid"))]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(
+            simulateSong,
+            paths,
+            [difficulty] * len(paths),
+            [True] * len(paths),
+            [step] * len(paths),
+            chunksize=8,
+        )
+        for name, result in results:
+            print("%s: %s" % (name, result))
+            if profile:
+                print(result.profile)
+    print("Simulated %d songs in %.2f s" % (len(paths), time.perf_counter() - start))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,149 @@
+#####################################################################
+# -*- coding: iso-8859-1 -*-                                        #
+#                                                                   #
+# Frets on Fire                                                     #
+# Copyright (C) 2006 Sami Kystil                                  #
+#                                                                   #
+# This program is free software; you can redistribute it and/or     #
+# modify it under the terms of the GNU General Public License       #
+# as published by the Free Software Foundation; either version 2    #
+# of the License, or (at your option) any later version.            #
+#                                                                   #
+# This program is distributed in the hope that it will be useful,   #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of    #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the     #
+# GNU General Public License for more details.                      #
+#                                                                   #
+# You should have received a copy of the GNU General Public License #
+# along with this program; if not, write to the Free Software       #
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,        #
+# MA  02110-1301, USA.                                              #
+#####################################################################
+
+import unittest
+import os
+import pygame
+
+import Player
+import Replay
+from Engine import Engine
+from Guitar import KEYS
+from Input import Input
+from Simulator import Simulator, loadChart
+from GuitarScene import GuitarSceneClient
+from Task import Task
+
+class SimulatorTest(unittest.TestCase):
+  def setUp(self):
+    self.song = loadChart(os.path.join("..", "data", "songs", "tutorial"))
+    self.chords = self.song.track.getChordTable()
+
+  def _perfectInput(self):
+    # Strum every chord; tapping is turned off like with the "tapping" option
+    for time, note in self.chords.notes:
+      note.tappable = False
+
+    # Hold the frets a bit early, strum on time and let go before the next chord
+    events = []
+    for chord in range(len(self.chords.times)):
+      time = float(self.chords.times[chord])
+      frets = [KEYS[note.number] for t, note in self.chords.getNotes(chord)]
+      events += [(time - 20, k, True) for k in frets]
+      events += [(time, Player.ACTION1, True), (time + 10, Player.ACTION1, False)]
+      events += [(time + 15, k, False) for k in frets]
+    return events
+
+  def testAutoPlay(self):
+    result = Simulator(self.song).run(autoPlay = True)
+    assert result.notes == len(self.chords.notes)
+    assert result.notesHit == result.notes
+    assert result.misses == 0 and result.badPicks == 0
+    assert result.longestStreak == len(self.chords.times)
+    assert result.score > 0
+
+    profile = result.profile
+    assert profile.frames > 0
+    assert profile.calls["startPick"] == len(self.chords.times)
+    assert profile.calls["getMissedNotes"] > 0
+
+  def testScriptedInput(self):
+    simulator = Simulator(self.song)
+    perfect = simulator.run(self._perfectInput())
+    assert perfect.notesHit == perfect.notes and perfect.misses == 0
+    assert perfect.badPicks == 0
+
+    # Runs start over and are deterministic
+    assert simulator.run(self._perfectInput()).score == perfect.score
+
+    idle = simulator.run([])
+    assert idle.notesHit == 0 and idle.score == 0
+    assert idle.misses == idle.notes
+
+    # Strumming with the wrong fret breaks the streak
+    events = self._perfectInput()
+    time = float(self.chords.times[0])
+    events += [(time - 300, KEYS[4], True), (time - 290, Player.ACTION1, True),
+               (time - 280, Player.ACTION1, False), (time - 270, KEYS[4], False)]
+    events.sort(key = lambda e: e[0])
+    result = simulator.run(events)
+    assert result.badPicks == 1
+    assert result.notesHit == perfect.notesHit
+
+  def testPastEvents(self):
+    simulator = Simulator(self.song)
+    simulator.run([], endTime = 1000.0)
+    scene = simulator.scene
+    judged = scene.simulationPos
+
+    # An event from before the last judged step is judged at that step
+    steps = []
+    scene.runSimulationStep = steps.append
+    assert scene.simulate(judged - 30) == judged
+    assert steps == [] and scene.simulationPos == judged
+
+  def testEngineEventTime(self):
+    pygame.init()
+    try:
+      simulator = Simulator(self.song)
+      simulator.restart()
+      scene = simulator.scene
+      start = pygame.time.get_ticks()
+
+      # Run the scene off the engine clock, with input timed like in the game
+      simulator.song.getPosition = lambda: float(pygame.time.get_ticks() - start)
+      scene.getEventPosition = lambda time = None: GuitarSceneClient.getEventPosition(scene, time)
+
+      class SceneTask(Task):
+        def run(self, ticks):
+          scene.runGuitar(ticks, scene.getSongPosition())
+
+      engine = Engine(fps = 20)
+      input = Input()
+      input.addKeyListener(scene)
+      engine.addTask(input, synchronized = False)
+      engine.addTask(SceneTask())
+
+      # Strum 20 ms into the wait for the third frame
+      posted = []
+      def idle():
+        if not posted and engine.timer.frame >= 2 and engine.timer.getTime() - engine.timer.ticks >= 20:
+          pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key = simulator.keys[Player.ACTION1], unicode = "", mod = 0))
+          posted.append(pygame.time.get_ticks() - start)
+        input.pollEvents()
+      engine.timer.idleCallback  = idle
+      engine.timer.frameCallback = input.dispatchEvents
+      for i in range(4):
+        engine.run()
+
+      # The strum is judged at its own time, before the frame that follows
+      events = list(scene.replay)
+      controls = [control for pos, control, pressed in events]
+      strum = controls.index(Player.ACTION1)
+      frame = controls.index(Replay.FRAME, strum)
+      assert posted[0] <= events[strum][0] <= posted[0] + 5
+      assert events[strum][0] < events[frame][0] - 10
+    finally:
+      pygame.quit()
+
+if __name__ == "__main__":
+  unittest.main()
@@ -10,16 +10,24 @@ import os
 import re
 import shutil
 import binascii
+import bisect
 import hashlib
+import json
+import sqlite3
+import struct
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import reduce
 from configparser import ConfigParser
 
+import numpy
+
 # urllib (Py3)
 from urllib.parse import urlencode
 from urllib.request import urlopen
 
 import Log
 import Audio
+import Resource
 import Config
 import Version
 import Theme
@@ -68,20 +76,40 @@ difficulties = {
 
 
 class SongInfo(object):
-    def __init__(self, infoFileName):
+    # Fields that can be served from the song index without parsing song.ini
+    indexedFields = ["name", "artist", "cassettecolor", "delay", "tutorial"]
+
+    def __init__(self, infoFileName, fields=None, songDifficulties=None):
+        """
+        @param infoFileName:      Path to song.ini
+        @param fields:            Raw values of L{indexedFields} as stored in the
+                                  song index, None for missing values. When given,
+                                  song.ini is only parsed once something else is
+                                  needed.
+        @param songDifficulties:  Known list of available difficulties
+        """
         self.songName = os.path.basename(os.path.dirname(infoFileName))
         self.fileName = infoFileName
-        self.info = ConfigParser()
-        self._difficulties = None
+        self.fields = fields
+        self._info = None
+        self._highScores = None
+        self._difficulties = songDifficulties
+
+        if fields is None:
+            self._load()
+
+    def _load(self):
+        self._info = ConfigParser()
 
         try:
             # Note: configparser in Py3 handles file reading internally
-            self.info.read(infoFileName, encoding=Config.encoding)
+            self._info.read(self.fileName, encoding=Config.encoding)
         except Exception:
             pass
 
+    def _decodeHighscores(self):
         # Read highscores and verify their hashes.
-        self.highScores = {}
+        self._highScores = {}
 
         scores = self._get("scores", str, "")
         if scores:
@@ -110,6 +138,26 @@ class SongInfo(object):
                 except Exception as e:
                     Log.warn(f"Failed to read highscores from song.ini: {e!r}")
 
+    def getInfo(self):
+        if self._info is None:
+            self._load()
+        return self._info
+
+    def getHighScores(self):
+        # Decoded on first use, most song listings never look at the scores
+        if self._highScores is None:
+            self._decodeHighscores()
+        return self._highScores
+
+    def getField(self, attr):
+        """
+        @return: Raw song.ini value of a field, or None if it is not set
+        """
+        try:
+            return self.info.get("song", attr)
+        except Exception:
+            return None
+
     def _set(self, attr, value):
         if not self.info.has_section("song"):
             self.info.add_section("song")
@@ -142,9 +190,18 @@ class SongInfo(object):
         with open(self.fileName, "w", encoding=Config.encoding, errors="ignore") as f:
             self.info.write(f)
 
+        # Decode again from what was written, the notes may have changed too
+        self._highScores = None
+        self._difficulties = None
+
     def _get(self, attr, type=None, default=""):
         try:
-            v = self.info.get("song", attr)
+            if self._info is None and attr in self.indexedFields:
+                v = self.fields[attr]
+                if v is None:
+                    raise KeyError(attr)
+            else:
+                v = self.info.get("song", attr)
         except Exception:
             v = default
         if v is not None and type:
@@ -166,11 +223,7 @@ class SongInfo(object):
 
             noteFileName = os.path.join(os.path.dirname(self.fileName), "notes.mid")
             info = MidiInfoReader()
-            midiIn = midi.MidiInFile(info, noteFileName)
-            try:
-                midiIn.read()
-            except MidiInfoReader.Done:
-                pass
+            info.read(noteFileName)
 
             # Sort descending by id (was cmp(b.id, a.id))
             info.difficulties.sort(key=lambda d: d.id, reverse=True)
@@ -263,10 +316,12 @@ class SongInfo(object):
     tutorial = property(isTutorial)
     difficulties = property(getDifficulties)
     cassetteColor = property(getCassetteColor, setCassetteColor)
+    info = property(getInfo)
+    highScores = property(getHighScores)
 
 
 class LibraryInfo(object):
-    def __init__(self, libraryName, infoFileName):
+    def __init__(self, libraryName, infoFileName, songCount=None):
         self.libraryName = libraryName
         self.fileName = infoFileName
         self.info = ConfigParser()
@@ -282,6 +337,10 @@ class LibraryInfo(object):
             self.name = os.path.basename(os.path.dirname(self.fileName))
 
         # Count the available songs
+        if songCount is not None:
+            self.songCount = songCount
+            return
+
         libraryRoot = os.path.dirname(self.fileName)
         for name in os.listdir(libraryRoot):
             if not os.path.isdir(os.path.join(libraryRoot, name)) or name.startswith(
@@ -340,6 +399,7 @@ class Note(Event):
     def __init__(self, number, length, special=False, tappable=False):
         super().__init__(length)
         self.number = number
+        self.mask = 1 << number
         self.played = False
         self.special = special
         self.tappable = tappable
@@ -372,76 +432,300 @@ class PictureEvent(Event):
         self.fileName = fileName
 
 
+EVENT_NOTE = 0x1
+EVENT_TEMPO = 0x2
+EVENT_TEXT = 0x4
+EVENT_PICTURE = 0x8
+EVENT_SPECIAL = 0x10
+EVENT_TAPPABLE = 0x20
+
+
+def eventFlags(event):
+    if isinstance(event, Note):
+        return EVENT_NOTE | (EVENT_SPECIAL if event.special else 0)
+    if isinstance(event, Tempo):
+        return EVENT_TEMPO
+    if isinstance(event, TextEvent):
+        return EVENT_TEXT
+    if isinstance(event, PictureEvent):
+        return EVENT_PICTURE
+    return 0
+
+
 class Track:
-    granularity = 50
+    """
+    Time-ordered event store.
+
+    Events live in parallel NumPy columns (start time, length, fret number and
+    type flags) sorted by start time, next to the matching ``(time, event)``
+    tuples in ``allEvents``. Range queries are a pair of binary searches over
+    these columns instead of a walk over fixed-size time buckets.
+
+    Sustained notes longer than C{holdLength} are additionally kept in a small
+    hold index with prefix maximum end times, so that finding the notes that
+    overlap a time range costs O(log n + k) no matter how long they are.
+    """
+
+    holdLength = 1000.0
 
     def __init__(self):
-        self.events = []
         self.allEvents = []
+        self.times = numpy.zeros(0, numpy.float64)
+        self.lengths = numpy.zeros(0, numpy.float64)
+        self.numbers = numpy.zeros(0, numpy.int8)
+        self.flags = numpy.zeros(0, numpy.uint8)
+        self._dirty = False
+        self._reindex()
+
+    def _build(self):
+        """Sort pending events and rebuild the columns if anything was added."""
+        if not self._dirty:
+            return
+        self._dirty = False
+
+        # Stable sort keeps chord notes and simultaneous events in file order
+        self.allEvents.sort(key=lambda e: e[0])
+        n = len(self.allEvents)
+        self.times = numpy.fromiter((t for t, e in self.allEvents), numpy.float64, n)
+        self.lengths = numpy.fromiter(
+            (e.length for t, e in self.allEvents), numpy.float64, n
+        )
+        self.numbers = numpy.fromiter(
+            (getattr(e, "number", -1) for t, e in self.allEvents), numpy.int8, n
+        )
+        self.flags = numpy.fromiter(
+            (eventFlags(e) for t, e in self.allEvents), numpy.uint8, n
+        )
+        self._reindex()
+
+    def loadColumns(self, allEvents, times, lengths, numbers, flags):
+        """
+        Replace the track contents with already sorted events and columns.
+
+        @param allEvents:  List of (time, event) tuples sorted by time
+        @param times:      Start time column
+        @param lengths:    Length column
+        @param numbers:    Fret number column (-1 for non-note events)
+        @param flags:      Event flag column
+        """
+        self.allEvents = allEvents
+        self.times = numpy.asarray(times, numpy.float64)
+        self.lengths = numpy.asarray(lengths, numpy.float64)
+        self.numbers = numpy.asarray(numbers, numpy.int8)
+        self.flags = numpy.asarray(flags, numpy.uint8)
+        self._dirty = False
+        self._reindex()
+
+    def _reindex(self):
+        """Recompute the end time column and the hold index."""
+        self._chords = None
+        self.ends = self.times + self.lengths
+        isHold = self.lengths > self.holdLength
+        self.holds = numpy.flatnonzero(isHold)
+        self.holdMaxEnds = numpy.maximum.accumulate(self.ends[self.holds])
+        shortLengths = self.lengths[~isHold]
+        self.shortLength = float(shortLengths.max()) if len(shortLengths) else 0.0
+
+    def _find(self, time, event):
+        self._build()
+        i = int(numpy.searchsorted(self.times, time, "left"))
+        while i < len(self.allEvents) and self.times[i] <= time:
+            if self.allEvents[i][1] is event:
+                return i
+            i += 1
+        return None
 
     def addEvent(self, time, event):
-        for t in range(
-            int(time / self.granularity),
-            int((time + event.length) / self.granularity) + 1,
-        ):
-            if len(self.events) < t + 1:
-                n = t + 1 - len(self.events)
-                n *= 8
-                self.events = self.events + [[] for _ in range(n)]
-            self.events[t].append((time - (t * self.granularity), event))
-        self.allEvents.append((time, event))
+        # Bulk loads just append and sort once on the first query; edits to an
+        # already sorted track are inserted in place.
+        if self._dirty or not self.allEvents:
+            self.allEvents.append((time, event))
+            self._dirty = True
+            return
+
+        i = int(numpy.searchsorted(self.times, time, "right"))
+        self.allEvents.insert(i, (time, event))
+        self.times = numpy.insert(self.times, i, time)
+        self.lengths = numpy.insert(self.lengths, i, event.length)
+        self.numbers = numpy.insert(self.numbers, i, getattr(event, "number", -1))
+        self.flags = numpy.insert(self.flags, i, eventFlags(event))
+        self._reindex()
+
+    def addEvents(self, events):
+        """
+        Add many events at once; they are sorted in on the next query.
+
+        @param events:  Iterable of (time, event) tuples
+        """
+        self.allEvents.extend(events)
+        self._dirty = True
 
     def removeEvent(self, time, event):
-        for t in range(
-            int(time / self.granularity),
-            int((time + event.length) / self.granularity) + 1,
-        ):
-            e = (time - (t * self.granularity), event)
-            if t < len(self.events) and e in self.events[t]:
-                self.events[t].remove(e)
-        if (time, event) in self.allEvents:
-            self.allEvents.remove((time, event))
+        i = self._find(time, event)
+        if i is None:
+            return
 
-    def getEvents(self, startTime, endTime):
-        t1, t2 = [
-            int(x) for x in [startTime / self.granularity, endTime / self.granularity]
-        ]
-        if t1 > t2:
-            t1, t2 = t2, t1
+        del self.allEvents[i]
+        self.times = numpy.delete(self.times, i)
+        self.lengths = numpy.delete(self.lengths, i)
+        self.numbers = numpy.delete(self.numbers, i)
+        self.flags = numpy.delete(self.flags, i)
+        self._reindex()
+
+    def getEventRange(self, startTime, endTime):
+        """
+        Return the indices of the events overlapping the given time range.
+
+        @param startTime:  Range start in milliseconds
+        @param endTime:    Range end in milliseconds (exclusive)
+        @return:           Index array into the sorted event columns
+        """
+        self._build()
+        if startTime > endTime:
+            startTime, endTime = endTime, startTime
+
+        # No short event starting before startTime - shortLength can reach
+        # the range, so only that much needs to be looked back at.
+        lo = int(numpy.searchsorted(self.times, startTime - self.shortLength, "left"))
+        hi = int(numpy.searchsorted(self.times, endTime, "left"))
+        if lo < hi:
+            found = numpy.flatnonzero(self.ends[lo:hi] >= startTime) + lo
+        else:
+            found = numpy.arange(0)
+
+        # Holds starting before that are found through their running maximum
+        # end time; everything before h0 is over by startTime.
+        nh = int(numpy.searchsorted(self.holds, lo, "left"))
+        h0 = int(numpy.searchsorted(self.holdMaxEnds[:nh], startTime, "left"))
+        if h0 < nh:
+            holds = self.holds[h0:nh]
+            holds = holds[self.ends[holds] >= startTime]
+            if len(holds):
+                found = numpy.concatenate((holds, found))
+        return found
 
-        events = set()
-        for t in range(max(t1, 0), min(len(self.events), t2)):
-            for diff, event in self.events[t]:
-                time = (self.granularity * t) + diff
-                events.add((time, event))
-        return events
+    def getEvents(self, startTime, endTime):
+        allEvents = self.allEvents
+        return [allEvents[i] for i in self.getEventRange(startTime, endTime)]
 
     def getAllEvents(self):
+        self._build()
         return self.allEvents
 
+    def getChordTable(self):
+        """
+        @return: L{ChordTable} of the notes in this track, built on first use
+                 and kept until the notes or their tappable flags change
+        """
+        self._build()
+        if self._chords is None:
+            self._chords = ChordTable(self)
+        return self._chords
+
     def reset(self):
-        for eventList in self.events:
-            for _time, event in eventList:
-                if isinstance(event, Note):
-                    event.played = False
+        for _time, event in self.allEvents:
+            if isinstance(event, Note):
+                event.played = False
+
+    # Tappable (HOPO) note classification parameters
+    ticksPerBeat = 480
+    tickThreshold = 161
+    chordEpsilon = 1e-3
 
     def update(self):
+        """
+        Classify the tappable notes of the whole track.
+
+        A chord is tappable when the previous chord is a single note of a
+        different fret that ends at most C{tickThreshold} ticks before it.
+        This vectorized pass gives the same result as L{updateReference};
+        tracks it can't handle exactly (notes before the first tempo event or
+        tempo changes reordering the chords) go through the reference loop.
+        """
+        self._chords = None
+        if not self._updateVectorized():
+            self.updateReference()
+
+    def _updateVectorized(self):
+        self._build()
+        noteIndices = numpy.flatnonzero(self.flags & EVENT_NOTE)
+        if not len(noteIndices):
+            return True
+        tempoIndices = numpy.flatnonzero(self.flags & EVENT_TEMPO)
+        k = numpy.searchsorted(tempoIndices, noteIndices, "right") - 1
+        if k[0] < 0:
+            return False
+
+        # Tick positions as the reference loop computes them, using the tempo
+        # in effect when each note is reached
+        bpms = numpy.array([self.allEvents[i][1].bpm for i in tempoIndices])
+        noteBpms = bpms[k]
+        ticks = self.times[noteIndices] * noteBpms * self.ticksPerBeat / 60000.0
+        eps = self.chordEpsilon
+
+        newChord = numpy.empty(len(ticks), bool)
+        newChord[0] = True
+        newChord[1:] = ticks[1:] >= ticks[:-1] + eps
+        chordStarts = numpy.flatnonzero(newChord)
+        chordIds = numpy.cumsum(newChord) - 1
+        chordTicks = ticks[chordStarts]
+        if chordTicks[0] < eps:
+            chordTicks[0] = 0.0
+
+        # Grouping against the previous note only matches the reference
+        # (grouping against the first note of the chord) when the ticks are
+        # monotonic and every chord fits within epsilon.
+        if numpy.any(ticks[1:] < ticks[:-1]) or numpy.any(
+            ticks - chordTicks[chordIds] >= eps
+        ):
+            return False
+
+        numbers = self.numbers[noteIndices].astype(numpy.int64)
+        chordSizes = numpy.bincount(chordIds)
+        chordMasks = numpy.bitwise_or.reduceat(1 << numbers, chordStarts)
+        firstNumbers = numpy.take(numbers, chordStarts)
+        firstLengths = self.lengths[noteIndices][chordStarts]
+        startBpms = noteBpms[chordStarts]
+
+        # The first and the last chord are never tappable; chord c is judged
+        # against chord c - 1 with the tempo in effect at chord c + 1.
+        chordTappable = numpy.zeros(len(chordStarts), bool)
+        if len(chordStarts) > 2:
+            prevEndTicks = (
+                chordTicks[:-2]
+                + (firstLengths[:-2] * startBpms[2:] * self.ticksPerBeat) / 60000.0
+            )
+            chordTappable[1:-1] = (
+                (chordSizes[:-2] == 1)
+                & (chordTicks[1:-1] - prevEndTicks <= self.tickThreshold)
+                & ((chordMasks[1:-1] & (1 << firstNumbers[:-2])) == 0)
+            )
+
+        allEvents = self.allEvents
+        for i, tappable in zip(noteIndices, chordTappable[chordIds]):
+            allEvents[i][1].tappable = bool(tappable)
+        return True
+
+    def updateReference(self):
+        """Classify the tappable notes of the whole track one event at a time."""
+        self._chords = None
         bpm = None
-        ticksPerBeat = 480
-        tickThreshold = 161
+        ticksPerBeat = self.ticksPerBeat
+        tickThreshold = self.tickThreshold
         prevNotes = []
         currentNotes = []
         currentTicks = 0.0
         prevTicks = 0.0
-        epsilon = 1e-3
+        epsilon = self.chordEpsilon
 
         def beatsToTicks(time):
             return (time * bpm * ticksPerBeat) / 60000.0
 
-        if not self.allEvents:
+        allEvents = self.getAllEvents()
+        if not allEvents:
             return
 
-        for time, event in self.allEvents + [self.allEvents[-1]]:
+        for time, event in allEvents + [allEvents[-1]]:
             if isinstance(event, Tempo):
                 bpm = event.bpm
             elif isinstance(event, Note):
@@ -469,6 +753,407 @@ class Track:
                 currentNotes = [event]
                 currentTicks = ticks
 
+    def updateNear(self, time):
+        """
+        Reclassify tappable notes after a note was added or removed.
+
+        Only the chord at C{time} and its neighbouring chords can change, so
+        just the events from two chords before to two chords after it are
+        visited.
+
+        @param time:  Start time of the added or removed note
+        """
+        self._build()
+        self._chords = None
+        allEvents = self.allEvents
+        times = self.times
+        isNote = self.flags & EVENT_NOTE
+        n = len(allEvents)
+        i = int(numpy.searchsorted(times, time, "left"))
+
+        # Back up over two distinct chord times before the edit...
+        lo, seen = i, []
+        while lo > 0:
+            if isNote[lo - 1] and times[lo - 1] not in seen:
+                if len(seen) == 2:
+                    break
+                seen.append(times[lo - 1])
+            lo -= 1
+
+        # ...and forward over the chord at the edit plus two after it
+        hi, seen = i, []
+        while hi < n:
+            if isNote[hi] and times[hi] > time and times[hi] not in seen:
+                if len(seen) == 2:
+                    break
+                seen.append(times[hi])
+            hi += 1
+
+        tempos = numpy.flatnonzero(self.flags[:lo] & EVENT_TEMPO)
+        bpm = allEvents[tempos[-1]][1].bpm if len(tempos) else None
+        notesBefore = bool(numpy.any(isNote[:lo]))
+        notesAfter = bool(numpy.any(isNote[hi:]))
+
+        # Group the window into chords: [ticks, notes, bpm when reached]
+        chords = []
+        currentTicks = 0.0
+        for t, event in allEvents[lo:hi]:
+            if isinstance(event, Tempo):
+                bpm = event.bpm
+            elif isinstance(event, Note):
+                ticks = (t * bpm * self.ticksPerBeat) / 60000.0
+                if chords and ticks < currentTicks + self.chordEpsilon:
+                    chords[-1][1].append(event)
+                    continue
+                if not chords and not notesBefore and ticks < self.chordEpsilon:
+                    # The very first chord of the track starts at zero ticks
+                    ticks = 0.0
+                chords.append([ticks, [event], bpm])
+                currentTicks = ticks
+
+        # The outermost chords of the window only serve as context, unless
+        # they really are the first or last chord of the track.
+        for c, (ticks, notes, _bpm) in enumerate(chords):
+            if (c == 0 and notesBefore) or (c == len(chords) - 1 and notesAfter):
+                continue
+
+            tappable = False
+            if 0 < c < len(chords) - 1 and len(chords[c - 1][1]) == 1:
+                prevTicks, (prev,), _ = chords[c - 1]
+                nextBpm = chords[c + 1][2]
+                prevEndTicks = (
+                    prevTicks + (prev.length * nextBpm * self.ticksPerBeat) / 60000.0
+                )
+                if ticks - prevEndTicks <= self.tickThreshold:
+                    tappable = all(note.number != prev.number for note in notes)
+            for note in notes:
+                note.tappable = tappable
+
+
+class ChordTable:
+    """
+    Precomputed chords of a track.
+
+    Notes starting within C{Track.chordEpsilon} of the first note of a chord
+    are grouped together. Every chord has a start time, a fret bitmask, the
+    length of its shortest note and whether all of its notes are tappable or
+    any of them is special. The notes themselves are kept in time order with
+    C{noteStarts} pointing at the first note of each chord, so time window
+    queries are binary searches instead of filtering event lists.
+    """
+
+    def __init__(self, track):
+        indices = numpy.flatnonzero(track.flags & EVENT_NOTE)
+        allEvents = track.allEvents
+        self.notes = [allEvents[i] for i in indices]
+        self.noteTimes = track.times[indices]
+        self.noteNumbers = track.numbers[indices]
+
+        starts = []
+        chordTime = None
+        for i, time in enumerate(self.noteTimes.tolist()):
+            if chordTime is None or time - chordTime >= track.chordEpsilon:
+                starts.append(i)
+                chordTime = time
+        self.noteStarts = numpy.array(starts, numpy.intp)
+        self.noteEnds = numpy.append(self.noteStarts[1:], len(self.notes))
+
+        self.times = self.noteTimes[self.noteStarts]
+        if starts:
+            bits = numpy.left_shift(1, self.noteNumbers.astype(numpy.int64))
+            self.masks = numpy.bitwise_or.reduceat(bits, self.noteStarts).astype(
+                numpy.uint8
+            )
+            self.lengths = numpy.minimum.reduceat(
+                track.lengths[indices], self.noteStarts
+            )
+            tappable = numpy.fromiter(
+                (event.tappable for time, event in self.notes), bool, len(self.notes)
+            )
+            special = numpy.fromiter(
+                (event.special for time, event in self.notes), bool, len(self.notes)
+            )
+            self.tappable = numpy.logical_and.reduceat(tappable, self.noteStarts)
+            self.special = numpy.logical_or.reduceat(special, self.noteStarts)
+        else:
+            self.masks = numpy.zeros(0, numpy.uint8)
+            self.lengths = numpy.zeros(0, numpy.float64)
+            self.tappable = numpy.zeros(0, bool)
+            self.special = numpy.zeros(0, bool)
+
+    def __len__(self):
+        return len(self.times)
+
+    def getNotes(self, chord):
+        """@return: (time, Note) tuples of the given chord"""
+        return self.notes[self.noteStarts[chord] : self.noteEnds[chord]]
+
+    def getNoteRange(self, startTime, endTime):
+        """
+        @return: (lo, hi) slice of C{notes} starting in [startTime, endTime]
+        """
+        lo = int(numpy.searchsorted(self.noteTimes, startTime, "left"))
+        hi = int(numpy.searchsorted(self.noteTimes, endTime, "right"))
+        return lo, hi
+
+    def getChordRange(self, startTime, endTime):
+        """
+        @return: (lo, hi) slice of the chords starting in [startTime, endTime]
+        """
+        lo = int(numpy.searchsorted(self.times, startTime, "left"))
+        hi = int(numpy.searchsorted(self.times, endTime, "right"))
+        return lo, hi
+
+    def getNextChord(self, time):
+        """@return: Index of the first chord starting after C{time}, or None"""
+        i = int(numpy.searchsorted(self.times, time, "right"))
+        return i if i < len(self.times) else None
+
+    def getNearestChord(self, time):
+        """@return: Index of the chord starting closest to C{time}, or None"""
+        if not len(self.times):
+            return None
+        i = int(numpy.searchsorted(self.times, time, "left"))
+        if i == len(self.times) or (
+            i > 0 and time - self.times[i - 1] <= self.times[i] - time
+        ):
+            return i - 1
+        return i
+
+    def getNotesPerSecond(self, binLength=1000.0):
+        """
+        Note density histogram of the track.
+
+        @param binLength:  Histogram bin length in milliseconds
+        @return:           Array with the notes per second of each bin, starting
+                           from time zero
+        """
+        times = self.noteTimes[self.noteTimes >= 0]
+        counts = numpy.bincount((times // binLength).astype(numpy.intp))
+        return counts * (1000.0 / binLength)
+
+
+class NoteCursor:
+    """
+    Play cursor over the notes of a track.
+
+    Song position only moves forward during play, so instead of searching
+    the whole track on every query the cursor keeps the slice of each named
+    note window and the events of the visible window from the previous
+    query and moves them over the notes entering or leaving. Jumps further
+    than C{maxSteps} notes and backward moves of the visible window fall
+    back to a binary search. Call L{reset} after seeking or restarting.
+    """
+
+    maxSteps = 16
+
+    def __init__(self, track):
+        self.track = track
+        self.chords = None
+        self.ends = None
+        self.reset()
+
+    def reset(self):
+        """Forget the windows; the next queries start with a binary search."""
+        self.windows = {}
+        self.visible = None
+
+    def _seek(self, i, time, right):
+        # First note index at or after (or after, if right) the given time
+        times = self.noteTimes
+        n = len(times)
+        for step in range(self.maxSteps):
+            if i < n and (times[i] <= time if right else times[i] < time):
+                i += 1
+            elif i > 0 and (times[i - 1] > time if right else times[i - 1] >= time):
+                i -= 1
+            else:
+                return i
+        return (bisect.bisect_right if right else bisect.bisect_left)(times, time)
+
+    def getNoteRange(self, window, startTime, endTime):
+        """
+        Same as L{ChordTable.getNoteRange}, moved from the last query of the
+        same window.
+
+        @param window:  Window name, e.g. C{"required"}
+        @return:        (chords, lo, hi) with (lo, hi) the slice of
+                        C{chords.notes} starting in [startTime, endTime]
+        """
+        chords = self.track.getChordTable()
+        if chords is not self.chords:
+            self.chords = chords
+            self.noteTimes = chords.noteTimes.tolist()
+            self.windows = {}
+
+        lo, hi = self.windows.get(window, (0, 0))
+        lo = self._seek(lo, startTime, False)
+        hi = self._seek(max(lo, hi), endTime, True)
+        self.windows[window] = (lo, hi)
+        return chords, lo, hi
+
+    def getEventRange(self, startTime, endTime):
+        """
+        Same as L{Track.getEventRange}, updated from the last query.
+
+        @return:  Index array into the sorted event columns
+        """
+        track = self.track
+        track._build()
+        if track.ends is not self.ends:
+            self.ends = track.ends
+            self.visible = None
+
+        if (
+            self.visible is None
+            or startTime < self.visibleStart
+            or endTime < self.visibleEnd
+        ):
+            self.visible = track.getEventRange(startTime, endTime).tolist()
+            self.next = int(numpy.searchsorted(track.times, endTime, "left"))
+            self.minEnd = min(
+                (self.ends[i] for i in self.visible), default=float("inf")
+            )
+        else:
+            if self.minEnd < startTime:
+                ends = self.ends
+                self.visible = [i for i in self.visible if ends[i] >= startTime]
+                self.minEnd = min(
+                    (ends[i] for i in self.visible), default=float("inf")
+                )
+
+            times, ends = track.times, self.ends
+            n = len(times)
+            while self.next < n and times[self.next] < endTime:
+                end = ends[self.next]
+                if end >= startTime:
+                    self.visible.append(self.next)
+                    self.minEnd = min(self.minEnd, end)
+                self.next += 1
+
+        self.visibleStart = startTime
+        self.visibleEnd = endTime
+        return numpy.array(self.visible, numpy.intp)
+
+
+class TempoMap:
+    """
+    Piecewise constant tempo map.
+
+    Tempo markers are kept sorted by their MIDI tick together with the
+    cumulative millisecond time of each marker, so that converting between
+    ticks and milliseconds is a binary search instead of a walk over every
+    preceding tempo change. The part before the first marker is played at
+    the tempo of the first marker.
+    """
+
+    def __init__(self, ticksPerBeat=480):
+        self.ticksPerBeat = ticksPerBeat
+        self.ticks = []
+        self.bpms = []
+        self.times = []
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def setTicksPerBeat(self, ticksPerBeat):
+        self.ticksPerBeat = ticksPerBeat
+        self._accumulate(0)
+
+    def addTempo(self, tick, bpm):
+        """
+        Add a tempo marker.
+
+        Markers are usually added in tick order, in which case this only
+        computes the time of the new marker.
+
+        @param tick:  Marker position in MIDI ticks
+        @param bpm:   Tempo in beats per minute from this marker onwards
+        """
+        i = bisect.bisect_right(self.ticks, tick)
+        self.ticks.insert(i, tick)
+        self.bpms.insert(i, bpm)
+        self.times.insert(i, 0.0)
+        self._accumulate(i)
+
+    def _ticksToMs(self, ticks, bpm):
+        return (60000.0 * ticks) / (bpm * self.ticksPerBeat)
+
+    def _accumulate(self, start):
+        for i in range(start, len(self.ticks)):
+            if i == 0:
+                self.times[i] = self._ticksToMs(self.ticks[i] - 0.0, self.bpms[i])
+            else:
+                self.times[i] = self.times[i - 1] + self._ticksToMs(
+                    self.ticks[i] - self.ticks[i - 1], self.bpms[i - 1]
+                )
+
+    def ticksToTime(self, tick):
+        """
+        Convert a MIDI tick position to milliseconds.
+
+        @return: Time in milliseconds, or 0.0 if the map has no tempo
+        """
+        if not self.ticks:
+            return 0.0
+        i = bisect.bisect_right(self.ticks, tick) - 1
+        if i < 0:
+            return self._ticksToMs(tick - 0.0, self.bpms[0])
+        return self.times[i] + self._ticksToMs(tick - self.ticks[i], self.bpms[i])
+
+    def ticksToTimes(self, ticks):
+        """
+        Convert an array of MIDI tick positions to milliseconds.
+
+        @return: NumPy array of times, same as calling L{ticksToTime} on each
+        """
+        ticks = numpy.asarray(ticks)
+        if not self.ticks:
+            return numpy.zeros(len(ticks))
+        markers = numpy.asarray(self.ticks)
+        i = numpy.searchsorted(markers, ticks, side="right") - 1
+        j = numpy.maximum(i, 0)
+        base = numpy.where(i < 0, 0.0, numpy.asarray(self.times)[j])
+        origin = numpy.where(i < 0, 0, markers[j])
+        bpms = numpy.asarray(self.bpms)[j]
+        return base + (60000.0 * (ticks - origin)) / (bpms * self.ticksPerBeat)
+
+    def timeToTicks(self, time):
+        """
+        Convert a time in milliseconds to a (fractional) MIDI tick position.
+
+        @return: Position in ticks, or 0.0 if the map has no tempo
+        """
+        if not self.ticks:
+            return 0.0
+        i = bisect.bisect_right(self.times, time) - 1
+        if i < 0:
+            return self.bpms[0] * self.ticksPerBeat * time / 60000.0
+        return (
+            self.ticks[i]
+            + self.bpms[i] * self.ticksPerBeat * (time - self.times[i]) / 60000.0
+        )
+
+    def getBpm(self, time):
+        """
+        @return: Tempo in effect at the given time in milliseconds, or None
+        """
+        if not self.bpms:
+            return None
+        return self.bpms[max(0, bisect.bisect_right(self.times, time) - 1)]
+
+    def getChanges(self, startTime, endTime):
+        """
+        @return: (time, bpm) pairs of the markers in [startTime, endTime)
+        """
+        lo = bisect.bisect_left(self.times, startTime)
+        hi = bisect.bisect_left(self.times, endTime)
+        return list(zip(self.times[lo:hi], self.bpms[lo:hi]))
+
+    def getMarkers(self):
+        """@return: (tick, bpm) pairs of all markers in tick order"""
+        return list(zip(self.ticks, self.bpms))
+
 
 class Song(object):
     def __init__(
@@ -490,14 +1175,62 @@ class Song(object):
         self.noteFileName = noteFileName
         self.bpm = None
         self.period = 0
+        self.tempoMap = TempoMap()
 
-        # load the tracks
-        if songTrackName:
-            self.music = Audio.Music(songTrackName)
-
+        # load the tracks, mixing them into one stream when the output allows it
+        self.mixer = None
         self.guitarTrack = None
         self.rhythmTrack = None
 
+        trackNames = [
+            ("song", songTrackName),
+            ("guitar", guitarTrackName),
+            ("rhythm", rhythmTrackName),
+        ]
+        if any([name for stem, name in trackNames]) and Audio.StemMixer.isSupported():
+            stems = {}
+            for stem, name in trackNames:
+                if not name:
+                    continue
+                try:
+                    stems[stem] = Audio.openPcmStream(name)
+                except Exception as e:
+                    Log.warn("Unable to load %s track: %s" % (stem, e))
+            self.mixer = Audio.StemMixer(self.engine.audio.getChannel(1), stems)
+        else:
+            self._loadTracks(songTrackName, guitarTrackName, rhythmTrackName)
+
+        # load the notes, preferring the precompiled chart next to the MIDI file
+        chartCache = None
+        cached = False
+        if noteFileName:
+            chartCache = ChartCache(self, chartCacheFileName(noteFileName))
+            cached = chartCache.read()
+            if not cached:
+                if midi is None:
+                    raise RuntimeError("midi module missing; cannot load notes.mid")
+                MidiReader(self).read(noteFileName)
+
+        # load the script
+        if scriptFileName and os.path.isfile(scriptFileName):
+            with open(
+                scriptFileName, "r", encoding=Config.encoding, errors="ignore"
+            ) as sf:
+                scriptReader = ScriptReader(self, sf)
+                scriptReader.read()
+
+        # update all note tracks; cached charts have them resolved already
+        if not cached:
+            for track in self.tracks:
+                track.update()
+            if chartCache:
+                chartCache.write()
+
+    def _loadTracks(self, songTrackName, guitarTrackName, rhythmTrackName):
+        # separate streams for audio outputs the stem mixer cannot feed
+        if songTrackName:
+            self.music = Audio.Music(songTrackName)
+
         try:
             if guitarTrackName:
                 self.guitarTrack = Audio.StreamingSound(
@@ -514,25 +1247,6 @@ class Song(object):
         except Exception as e:
             Log.warn("Unable to load rhythm track: %s" % e)
 
-        # load the notes
-        if noteFileName:
-            if midi is None:
-                raise RuntimeError("midi module missing; cannot load notes.mid")
-            midiIn = midi.MidiInFile(MidiReader(self), noteFileName)
-            midiIn.read()
-
-        # load the script
-        if scriptFileName and os.path.isfile(scriptFileName):
-            with open(
-                scriptFileName, "r", encoding=Config.encoding, errors="ignore"
-            ) as sf:
-                scriptReader = ScriptReader(self, sf)
-                scriptReader.read()
-
-        # update all note tracks
-        for track in self.tracks:
-            track.update()
-
     def getHash(self):
         h = hashlib.sha1()
         with open(self.noteFileName, "rb") as f:
@@ -559,6 +1273,10 @@ class Song(object):
 
     def play(self, start=0.0):
         self.start = start
+        if self.mixer:
+            self.mixer.play(start)
+            self._playing = True
+            return
         self.music.play(0, start / 1000.0)
         if self.guitarTrack:
             assert start == 0.0
@@ -569,14 +1287,28 @@ class Song(object):
         self._playing = True
 
     def pause(self):
-        self.music.pause()
+        if self.mixer:
+            self.mixer.pause()
+        else:
+            self.music.pause()
         self.engine.audio.pause()
 
     def unpause(self):
-        self.music.unpause()
+        if self.mixer:
+            self.mixer.unpause()
+        else:
+            self.music.unpause()
         self.engine.audio.unpause()
 
     def setGuitarVolume(self, volume):
+        if self.mixer:
+            if not self.mixer.hasStem("rhythm"):
+                volume = max(0.1, volume)
+            if self.mixer.hasStem("guitar"):
+                self.mixer.setGain("guitar", volume)
+            else:
+                self.mixer.setGain("song", volume)
+            return
         if not self.rhythmTrack:
             volume = max(0.1, volume)
         if self.guitarTrack:
@@ -585,18 +1317,26 @@ class Song(object):
             self.music.setVolume(volume)
 
     def setRhythmVolume(self, volume):
-        if self.rhythmTrack:
+        if self.mixer:
+            self.mixer.setGain("rhythm", volume)
+        elif self.rhythmTrack:
             self.rhythmTrack.setVolume(volume)
 
     def setBackgroundVolume(self, volume):
-        self.music.setVolume(volume)
+        if self.mixer:
+            self.mixer.setGain("song", volume)
+        else:
+            self.music.setVolume(volume)
 
     def stop(self):
         for track in self.tracks:
             track.reset()
 
-        self.music.stop()
-        self.music.rewind()
+        if self.mixer:
+            self.mixer.stop()
+        else:
+            self.music.stop()
+            self.music.rewind()
         if self.guitarTrack:
             self.guitarTrack.stop()
         if self.rhythmTrack:
@@ -607,7 +1347,10 @@ class Song(object):
         for track in self.tracks:
             track.reset()
 
-        self.music.fadeout(time)
+        if self.mixer:
+            self.mixer.fadeout(time)
+        else:
+            self.music.fadeout(time)
         if self.guitarTrack:
             self.guitarTrack.fadeout(time)
         if self.rhythmTrack:
@@ -615,6 +1358,9 @@ class Song(object):
         self._playing = False
 
     def getPosition(self):
+        if self.mixer and self._playing:
+            # the mixer clock already counts from the start position
+            return self.mixer.getPosition()
         if not self._playing:
             pos = 0.0
         else:
@@ -624,6 +1370,8 @@ class Song(object):
         return pos + self.start
 
     def isPlaying(self):
+        if self.mixer:
+            return self._playing and self.mixer.isPlaying()
         return self._playing and self.music.isPlaying()
 
     def getBeat(self):
@@ -669,17 +1417,29 @@ class MidiWriter:
         self.song = song
         self.out = out
         self.ticksPerBeat = 480
+        self.tempoMap = self.getTempoMap()
+        self.ticksPerBeat = self.tempoMap.ticksPerBeat
+
+    def getTempoMap(self):
+        # Charts with a single tempo follow song.bpm, which the editor may
+        # have changed since the chart was loaded
+        if len(self.song.tempoMap) > 1:
+            return self.song.tempoMap
+        tempoMap = TempoMap(self.ticksPerBeat)
+        tempoMap.addTempo(0, self.song.bpm if self.song.bpm else 122.0)
+        return tempoMap
 
     def midiTime(self, time):
-        return int(self.song.bpm * self.ticksPerBeat * time / 60000.0)
+        return int(self.tempoMap.timeToTicks(time))
 
     def write(self):
         self.out.header(division=self.ticksPerBeat)
         self.out.start_of_track()
         self.out.update_time(0)
 
-        bpm = self.song.bpm if self.song.bpm else 122.0
-        self.out.tempo(int(60.0 * 10.0**6 / bpm))
+        for tick, bpm in self.tempoMap.getMarkers():
+            self.out.update_time(tick, relative=0)
+            self.out.tempo(int(60.0 * 10.0**6 / bpm))
 
         # Collect all events
         events = [
@@ -721,12 +1481,174 @@ class MidiWriter:
         self.out.write()
 
 
+def chartCacheFileName(noteFileName):
+    return os.path.join(os.path.dirname(noteFileName), "notes.fofc")
+
+
+class ChartCache:
+    """
+    Precompiled note chart stored next to notes.mid.
+
+    The cache holds the tempo map and the resolved per-difficulty notes,
+    tempo events and tappable flags as packed records, keyed by the SHA-1 of the MIDI file so
+    that it is rebuilt whenever the chart is edited.
+    """
+
+    magic = b"FOFC"
+    version = 2
+    header = struct.Struct("<4sI20sdI")
+    tempoHeader = struct.Struct("<II")
+    marker = numpy.dtype([("tick", "<i8"), ("bpm", "<f8")])
+    record = numpy.dtype(
+        [
+            ("time", "<f8"),
+            ("length", "<f8"),
+            ("value", "<f8"),
+            ("number", "i1"),
+            ("flags", "u1"),
+        ]
+    )
+
+    def __init__(self, song, fileName):
+        self.song = song
+        self.fileName = fileName
+
+    def read(self):
+        """
+        Load the cached chart into the song tracks.
+
+        @return: True if the cache was valid and loaded, False otherwise
+        """
+        if not os.path.isfile(self.fileName):
+            return False
+
+        tracks = self.song.tracks
+        try:
+            with open(self.fileName, "rb") as f:
+                header = f.read(
+                    self.header.size + 4 * len(tracks) + self.tempoHeader.size
+                )
+                magic, version, digest, bpm, trackCount = self.header.unpack_from(
+                    header
+                )
+                if magic != self.magic or version != self.version:
+                    return False
+                if trackCount != len(tracks):
+                    return False
+                if digest != binascii.unhexlify(self.song.getHash()):
+                    return False
+                counts = struct.unpack_from(
+                    "<%dI" % trackCount, header, self.header.size
+                )
+                ticksPerBeat, markerCount = self.tempoHeader.unpack_from(
+                    header, self.header.size + 4 * trackCount
+                )
+                markers = numpy.frombuffer(
+                    f.read(markerCount * self.marker.itemsize), self.marker
+                )
+                offset = f.tell()
+            records = numpy.memmap(
+                self.fileName,
+                dtype=self.record,
+                mode="r",
+                offset=offset,
+                shape=(sum(counts),),
+            )
+        except Exception as e:
+            Log.warn("Unable to read chart cache %s: %s" % (self.fileName, e))
+            return False
+
+        if bpm == bpm:  # NaN marks a chart without tempo
+            self.song.setBpm(bpm)
+        tempoMap = self.song.tempoMap
+        tempoMap.setTicksPerBeat(ticksPerBeat)
+        for tick, markerBpm in zip(markers["tick"].tolist(), markers["bpm"].tolist()):
+            tempoMap.addTempo(tick, markerBpm)
+
+        start = 0
+        for track, count in zip(tracks, counts):
+            rows = records[start : start + count]
+            start += count
+            times = rows["time"].tolist()
+            flags = rows["flags"].tolist()
+            allEvents = []
+            for time, length, value, number, flag in zip(
+                times,
+                rows["length"].tolist(),
+                rows["value"].tolist(),
+                rows["number"].tolist(),
+                flags,
+            ):
+                if flag & EVENT_NOTE:
+                    event = Note(
+                        number,
+                        length,
+                        special=bool(flag & EVENT_SPECIAL),
+                        tappable=bool(flag & EVENT_TAPPABLE),
+                    )
+                else:
+                    event = Tempo(value)
+                allEvents.append((time, event))
+            track.loadColumns(
+                allEvents,
+                times,
+                rows["length"],
+                rows["number"],
+                numpy.asarray(flags, numpy.uint8) & ~numpy.uint8(EVENT_TAPPABLE),
+            )
+        del records
+        return True
+
+    def write(self):
+        """Write the notes and tempo events of the song tracks to the cache."""
+        chunks = []
+        for track in self.song.tracks:
+            events = [
+                (time, event)
+                for time, event in track.getAllEvents()
+                if isinstance(event, (Note, Tempo))
+            ]
+            rows = numpy.zeros(len(events), self.record)
+            for i, (time, event) in enumerate(events):
+                flags = eventFlags(event)
+                if isinstance(event, Note):
+                    rows[i] = (time, event.length, 0.0, event.number, flags)
+                    if event.tappable:
+                        rows[i]["flags"] |= EVENT_TAPPABLE
+                else:
+                    rows[i] = (time, event.length, event.bpm, -1, flags)
+            chunks.append(rows)
+
+        bpm = self.song.bpm if self.song.bpm else float("nan")
+        try:
+            with open(self.fileName + ".tmp", "wb") as f:
+                f.write(
+                    self.header.pack(
+                        self.magic,
+                        self.version,
+                        binascii.unhexlify(self.song.getHash()),
+                        bpm,
+                        len(chunks),
+                    )
+                )
+                f.write(struct.pack("<%dI" % len(chunks), *[len(c) for c in chunks]))
+                tempoMap = self.song.tempoMap
+                f.write(self.tempoHeader.pack(tempoMap.ticksPerBeat, len(tempoMap)))
+                f.write(numpy.array(tempoMap.getMarkers(), self.marker).tobytes())
+                for rows in chunks:
+                    f.write(rows.tobytes())
+            shutil.move(self.fileName + ".tmp", self.fileName)
+        except Exception as e:
+            Log.warn("Unable to write chart cache %s: %s" % (self.fileName, e))
+
+
 class ScriptReader:
     def __init__(self, song, scriptFile):
         self.song = song
         self.file = scriptFile
 
     def read(self):
+        events = []
         for line in self.file:
             if line.startswith("#"):
                 continue
@@ -741,8 +1663,10 @@ class ScriptReader:
             else:
                 continue
 
-            for track in self.song.tracks:
-                track.addEvent(time, event)
+            events.append((time, event))
+
+        for track in self.song.tracks:
+            track.addEvents(events)
 
 
 class MidiReader(midi.MidiOutStream if midi else object):
@@ -753,7 +1677,7 @@ class MidiReader(midi.MidiOutStream if midi else object):
         self.heldNotes = {}
         self.velocity = {}
         self.ticksPerBeat = 480
-        self.tempoMarkers = []
+        self.tempoMap = song.tempoMap
 
     def addEvent(self, track, event, time=None):
         if time is None:
@@ -765,70 +1689,108 @@ class MidiReader(midi.MidiOutStream if midi else object):
         elif track < len(self.song.tracks):
             self.song.tracks[track].addEvent(time, event)
 
-    def abs_time(self):
-        def ticksToBeats(ticks, bpm):
-            return (60000.0 * ticks) / (bpm * self.ticksPerBeat)
+    def read(self, fileName):
+        """
+        Load the notes and tempo changes of a MIDI file into the song.
 
-        if self.song.bpm and midi:
-            currentTime = midi.MidiOutStream.abs_time(self)
+        The file is scanned directly with L{midi.read_events}; files the
+        scanner does not understand go through the MidiInFile callbacks.
+        """
+        try:
+            smf = midi.read_events(fileName, note_tracks=2)
+        except midi.SmfError as e:
+            Log.debug("Reading %s through MidiInFile: %s" % (fileName, e))
+            midi.MidiInFile(self, fileName).read()
+            return
 
-            scaledTime = 0.0
-            tempoMarkerTime = 0.0
-            currentBpm = self.song.bpm
-            for time, bpm in self.tempoMarkers:
-                if time > currentTime:
-                    break
-                scaledTime += ticksToBeats(time - tempoMarkerTime, currentBpm)
-                tempoMarkerTime, currentBpm = time, bpm
-            return scaledTime + ticksToBeats(currentTime - tempoMarkerTime, currentBpm)
+        events = smf.events
+        isTempo = events["type"] == midi.TEMPO
+        if events["track"][isTempo].any():
+            # Tempo changes outside the tempo track only affect the tracks
+            # that follow them, so keep the callback semantics
+            midi.replay_events(smf, self)
+            return
+
+        self.header(smf.format, smf.nTracks, smf.division)
+        tempos = events[isTempo]
+        for tick, value in zip(tempos["tick"].tolist(), tempos["tempo"].tolist()):
+            self.tempoMap.addTempo(tick, 60.0 * 10.0**6 / value)
+
+        # Events before the first tempo change have no tempo to go by
+        times = self.tempoMap.ticksToTimes(events["tick"])
+        firstTempo = numpy.argmax(isTempo) if len(tempos) else len(events)
+        times[:firstTempo] = 0.0
+
+        for (track, tick, kind, channel, note, velocity, value), time in zip(
+            events.tolist(), times.tolist()
+        ):
+            if kind == midi.TEMPO:
+                bpm = 60.0 * 10.0**6 / value
+                if not self.song.bpm:
+                    self.song.setBpm(bpm)
+                self.addEvent(None, Tempo(bpm), time=time)
+            elif kind == midi.NOTE_ON:
+                self.noteOn(track, channel, note, velocity, time)
+            else:
+                self.noteOff(track, channel, note, time)
+
+    def abs_time(self):
+        if self.song.bpm and midi:
+            return self.tempoMap.ticksToTime(midi.MidiOutStream.abs_time(self))
         return 0.0
 
     def header(self, format, nTracks, division):
         self.ticksPerBeat = division
+        self.tempoMap.setTicksPerBeat(division)
 
     def tempo(self, value):
         bpm = 60.0 * 10.0**6 / value
         if midi:
-            self.tempoMarkers.append((midi.MidiOutStream.abs_time(self), bpm))
+            self.tempoMap.addTempo(midi.MidiOutStream.abs_time(self), bpm)
         if not self.song.bpm:
             self.song.setBpm(bpm)
         self.addEvent(None, Tempo(bpm))
 
+    def noteOn(self, track, channel, note, velocity, time):
+        self.velocity[note] = velocity
+        self.heldNotes[(track, channel, note)] = time
+
+    def noteOff(self, track, channel, note, time):
+        try:
+            startTime = self.heldNotes.pop((track, channel, note))
+        except KeyError:
+            Log.warn(
+                "MIDI note 0x%x on channel %d ending at %d was never started."
+                % (note, channel, time)
+            )
+            return
+        if note in noteMap:
+            difficulty, number = noteMap[note]
+            self.addEvent(
+                difficulty,
+                Note(
+                    number,
+                    time - startTime,
+                    special=(self.velocity.get(note) == 127),
+                ),
+                time=startTime,
+            )
+
     def note_on(self, channel, note, velocity):
         if not midi:
             return
         if self.get_current_track() > 1:
             return
-        self.velocity[note] = velocity
-        self.heldNotes[(self.get_current_track(), channel, note)] = self.abs_time()
+        self.noteOn(
+            self.get_current_track(), channel, note, velocity, self.abs_time()
+        )
 
     def note_off(self, channel, note, velocity):
         if not midi:
             return
         if self.get_current_track() > 1:
             return
-        try:
-            startTime = self.heldNotes[(self.get_current_track(), channel, note)]
-            endTime = self.abs_time()
-            del self.heldNotes[(self.get_current_track(), channel, note)]
-            if note in noteMap:
-                track, number = noteMap[note]
-                self.addEvent(
-                    track,
-                    Note(
-                        number,
-                        endTime - startTime,
-                        special=(self.velocity.get(note) == 127),
-                    ),
-                    time=startTime,
-                )
-            else:
-                pass
-        except KeyError:
-            Log.warn(
-                "MIDI note 0x%x on channel %d ending at %d was never started."
-                % (note, channel, self.abs_time())
-            )
+        self.noteOff(self.get_current_track(), channel, note, self.abs_time())
 
 
 class MidiInfoReader(midi.MidiOutStream if midi else object):
@@ -840,6 +1802,29 @@ class MidiInfoReader(midi.MidiOutStream if midi else object):
             midi.MidiOutStream.__init__(self)
         self.difficulties = []
 
+    def read(self, fileName):
+        """
+        Collect the difficulties present in a MIDI file.
+
+        The file is scanned lazily, so reading stops as soon as every
+        difficulty has been seen.
+        """
+        events = midi.iter_events(fileName)
+        try:
+            next(events)
+            for track, tick, kind, channel, note, velocity, value in events:
+                if kind == midi.NOTE_ON:
+                    self.note_on(channel, note, velocity)
+        except MidiInfoReader.Done:
+            pass
+        except midi.SmfError:
+            try:
+                midi.MidiInFile(self, fileName).read()
+            except MidiInfoReader.Done:
+                pass
+        finally:
+            events.close()
+
     def note_on(self, channel, note, velocity):
         try:
             track, _number = noteMap[note]
@@ -947,6 +1932,211 @@ def createSong(
     return song
 
 
+class SongIndex(object):
+    """
+    Persistent song metadata index.
+
+    Keeps the listing of song directories and the cheap song.ini fields and
+    difficulties of every song in an sqlite database in the writable resource
+    path. Directory listings are reused while the directory mtime stays the
+    same and no subdirectory gained, lost or changed its song.ini, and a
+    song is only parsed again when its directory, song.ini or notes.mid
+    changes, so browsing a large library needs no full rescan.
+
+    If the database cannot be used, the index reads everything from disk.
+    """
+
+    version = 2
+
+    def __init__(self, fileName=None):
+        self.fileName = fileName or os.path.join(
+            Resource.getWritableResourcePath(), "songindex.db"
+        )
+        try:
+            self.db = sqlite3.connect(self.fileName)
+            self._createTables()
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def _createTables(self):
+        (version,) = self.db.execute("PRAGMA user_version").fetchone()
+        if version != self.version:
+            self.db.execute("DROP TABLE IF EXISTS dirs")
+            self.db.execute("DROP TABLE IF EXISTS songs")
+            self.db.execute("PRAGMA user_version = %d" % self.version)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS dirs "
+            "(path TEXT PRIMARY KEY, mtime INTEGER, songStamps TEXT, entries TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS songs "
+            "(path TEXT PRIMARY KEY, stamp TEXT, fields TEXT, difficulties TEXT)"
+        )
+        self.db.commit()
+
+    def _disable(self, error):
+        Log.warn("Song index %s not available: %s" % (self.fileName, error))
+        self.db = None
+
+    def _query(self, sql, args):
+        if self.db is None:
+            return None
+        try:
+            return self.db.execute(sql, args).fetchone()
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def _store(self, sql, args):
+        if self.db is None:
+            return
+        try:
+            self.db.execute(sql, args)
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    @staticmethod
+    def _getMtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def getSongStamp(infoFileName):
+        """
+        @param infoFileName:  Path to song.ini
+        @return:              Modification times of the song directory, its
+                              song.ini and its notes.mid, or None if the
+                              song.ini is gone
+        """
+        path = os.path.dirname(infoFileName)
+        stamp = [
+            SongIndex._getMtime(path),
+            SongIndex._getMtime(infoFileName),
+            SongIndex._getMtime(os.path.join(path, "notes.mid")),
+        ]
+        if None in stamp[:2]:
+            return None
+        return stamp
+
+    def getDirectory(self, path):
+        """
+        List a directory containing songs or libraries.
+
+        @param path:  Directory path
+        @return:      Dictionary with the subdirectory names under "dirs", the
+                      names of those containing a song.ini under "songs" and
+                      whether a library.ini is present under "library"
+        """
+        # Adding or removing a song.ini does not touch the mtime of this
+        # directory, so the song.ini of every subdirectory is checked as well
+        mtime = os.stat(path).st_mtime_ns
+        row = self._query(
+            "SELECT mtime, songStamps, entries FROM dirs WHERE path = ?",
+            (os.path.abspath(path),),
+        )
+        if row and row[0] == mtime:
+            songStamps = json.loads(row[1])
+            if all(
+                self._getMtime(os.path.join(path, name, "song.ini")) == stamp
+                for name, stamp in songStamps.items()
+            ):
+                return json.loads(row[2])
+
+        entries = {"dirs": [], "songs": [], "library": False}
+        songStamps = {}
+        for name in os.listdir(path):
+            if name == "library.ini":
+                entries["library"] = True
+            if not os.path.isdir(os.path.join(path, name)):
+                continue
+            entries["dirs"].append(name)
+            songStamps[name] = self._getMtime(os.path.join(path, name, "song.ini"))
+            if songStamps[name] is not None:
+                entries["songs"].append(name)
+
+        self._store(
+            "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+            (os.path.abspath(path), mtime, json.dumps(songStamps), json.dumps(entries)),
+        )
+        return entries
+
+    def getCachedSongInfo(self, infoFileName):
+        """
+        Get the info of a song from the index.
+
+        @param infoFileName:  Path to song.ini
+        @return:              L{SongInfo} instance, or None if the song is not
+                              indexed or has changed since
+        """
+        stamp = self.getSongStamp(infoFileName)
+        if stamp is None:
+            return None
+
+        row = self._query(
+            "SELECT stamp, fields, difficulties FROM songs WHERE path = ?",
+            (os.path.abspath(infoFileName),),
+        )
+        if row and json.loads(row[0]) == stamp:
+            return SongInfo(
+                infoFileName,
+                fields=json.loads(row[1]),
+                songDifficulties=[difficulties[d] for d in json.loads(row[2])],
+            )
+
+    @staticmethod
+    def readSongInfo(infoFileName):
+        """
+        Parse the info and detect the difficulties of a song. Safe to call
+        from any thread.
+
+        @param infoFileName:  Path to song.ini
+        @return:              (L{SongInfo}, stamp from L{getSongStamp})
+        """
+        stamp = SongIndex.getSongStamp(infoFileName)
+        info = SongInfo(infoFileName)
+        info.getDifficulties()
+        return info, stamp
+
+    def storeSongInfo(self, info, stamp):
+        """Store a song read with L{readSongInfo} in the index."""
+        if stamp is None:
+            return
+        fields = {attr: info.getField(attr) for attr in SongInfo.indexedFields}
+        self._store(
+            "INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?)",
+            (
+                os.path.abspath(info.fileName),
+                json.dumps(stamp),
+                json.dumps(fields),
+                json.dumps([d.id for d in info.difficulties]),
+            ),
+        )
+
+    def getSongInfo(self, infoFileName):
+        """
+        Get the info of a song, parsing song.ini only if it has changed.
+
+        @param infoFileName:  Path to song.ini
+        @return:              L{SongInfo} instance
+        """
+        info = self.getCachedSongInfo(infoFileName)
+        if info is None:
+            info, stamp = self.readSongInfo(infoFileName)
+            self.storeSongInfo(info, stamp)
+        return info
+
+    def close(self):
+        if self.db is None:
+            return
+        try:
+            self.db.commit()
+            self.db.close()
+        except sqlite3.Error as e:
+            Log.warn("Unable to update song index %s: %s" % (self.fileName, e))
+        self.db = None
+
+
 def getDefaultLibrary(engine):
     return LibraryInfo(
         DEFAULT_LIBRARY, engine.resource.fileName(DEFAULT_LIBRARY, "library.ini")
@@ -961,56 +2151,117 @@ def getAvailableLibraries(engine, library=DEFAULT_LIBRARY):
     libraries = []
     libraryRoots = []
 
-    for songRoot in songRoots:
-        if not os.path.isdir(songRoot):
-            continue
-        for libraryRoot in os.listdir(songRoot):
-            libraryRoot = os.path.join(songRoot, libraryRoot)
-            if not os.path.isdir(libraryRoot):
+    index = SongIndex()
+    try:
+        for songRoot in songRoots:
+            if not os.path.isdir(songRoot):
                 continue
-            for name in os.listdir(libraryRoot):
-                if (
-                    os.path.isfile(os.path.join(libraryRoot, name, "song.ini"))
-                    or name == "library.ini"
-                ):
-                    if libraryRoot not in libraryRoots:
-                        libName = library + os.path.join(
-                            libraryRoot.replace(songRoot, "")
-                        )
-                        libraries.append(
-                            LibraryInfo(
-                                libName, os.path.join(libraryRoot, "library.ini")
-                            )
+            for libraryRoot in index.getDirectory(songRoot)["dirs"]:
+                libraryRoot = os.path.join(songRoot, libraryRoot)
+                entries = index.getDirectory(libraryRoot)
+                if not entries["songs"] and not entries["library"]:
+                    continue
+                if libraryRoot not in libraryRoots:
+                    libName = library + os.path.join(libraryRoot.replace(songRoot, ""))
+                    songCount = len(
+                        [name for name in entries["songs"] if not name.startswith(".")]
+                    )
+                    libraries.append(
+                        LibraryInfo(
+                            libName, os.path.join(libraryRoot, "library.ini"), songCount
                         )
-                        libraryRoots.append(libraryRoot)
-                        break
+                    )
+                    libraryRoots.append(libraryRoot)
+    finally:
+        index.close()
 
     libraries.sort(key=lambda a: a.name)
     return libraries
 
 
 def getAvailableSongs(engine, library=DEFAULT_LIBRARY, includeTutorials=False):
+    return scanLibrary(engine, library, workers=1, includeTutorials=includeTutorials)
+
+
+def scanLibrary(
+    engine,
+    library=DEFAULT_LIBRARY,
+    workers=4,
+    callback=None,
+    includeTutorials=False,
+    batchSize=32,
+):
+    """
+    Find the songs of a library.
+
+    Songs that are up to date in the L{SongIndex} are reported right away.
+    The rest have their song.ini parsed and their difficulties detected by a
+    pool of worker threads, and are reported in batches as they complete.
+
+    @param engine:            Game engine
+    @param library:           Library name
+    @param workers:           Number of worker threads
+    @param callback:          Function called from the scanning thread with each
+                              list of newly found L{SongInfo} instances
+    @param includeTutorials:  Whether to include tutorial songs
+    @param batchSize:         Maximum number of parsed songs per callback
+    @return:                  List of all found songs sorted by name
+    """
     songRoots = [
         engine.resource.fileName(library),
         engine.resource.fileName(library, writable=True),
     ]
     names = []
-    for songRoot in songRoots:
-        if not os.path.isdir(songRoot):
-            continue
-        for name in os.listdir(songRoot):
-            if not os.path.isfile(
-                os.path.join(songRoot, name, "song.ini")
-            ) or name.startswith("."):
+    songs = []
+
+    def report(batch):
+        if not includeTutorials:
+            batch = [song for song in batch if not song.tutorial]
+        songs.extend(batch)
+        if callback and batch:
+            callback(batch)
+
+    index = SongIndex()
+    try:
+        for songRoot in songRoots:
+            if not os.path.isdir(songRoot):
                 continue
-            if name not in names:
-                names.append(name)
+            for name in index.getDirectory(songRoot)["songs"]:
+                if name.startswith("."):
+                    continue
+                if name not in names:
+                    names.append(name)
+
+        cached = []
+        pending = []
+        for name in names:
+            infoFileName = engine.resource.fileName(
+                library, name, "song.ini", writable=True
+            )
+            info = index.getCachedSongInfo(infoFileName)
+            if info:
+                cached.append(info)
+            else:
+                pending.append(infoFileName)
+        report(cached)
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                futures = [
+                    pool.submit(SongIndex.readSongInfo, infoFileName)
+                    for infoFileName in pending
+                ]
+                batch = []
+                for future in as_completed(futures):
+                    info, stamp = future.result()
+                    index.storeSongInfo(info, stamp)
+                    batch.append(info)
+                    if len(batch) >= batchSize:
+                        report(batch)
+                        batch = []
+                report(batch)
+    finally:
+        index.close()
 
-    songs = [
-        SongInfo(engine.resource.fileName(library, name, "song.ini", writable=True))
-        for name in names
-    ]
-    if not includeTutorials:
-        songs = [song for song in songs if not song.tutorial]
     songs.sort(key=lambda s: s.name)
     return songs
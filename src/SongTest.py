@@ -21,10 +21,12 @@
 #####################################################################
 
 import unittest, pygame
-import shutil, os, sys
+import shutil, os, sys, tempfile, struct
 
 from GameEngine import GameEngine
-from Song import Song, Note
+from Resource import Resource
+from Song import Song, SongInfo, SongIndex, scanLibrary, getAvailableSongs, Note, NoteCursor, Tempo, Track, TempoMap, MidiInfoReader, chartCacheFileName, difficulties
+import midi
 
 class SongTest(unittest.TestCase):
   def testLoading(self):
@@ -69,7 +71,7 @@ class SongTest(unittest.TestCase):
         t2, n2 = event[1]
         
         if "-v" in sys.argv:
-          print "%8d. %.3f + %.3f\t%2d\t     %.3f + %.3f\t%2d" % (i, t1, n1.length, n1.number, t2, n2.length, n2.number)
+          print("%8d. %.3f + %.3f\t%2d\t     %.3f + %.3f\t%2d" % (i, t1, n1.length, n1.number, t2, n2.length, n2.number))
         
         # Allow 2ms of rounding error
         assert abs(t1 - t2) < 2
@@ -80,6 +82,493 @@ class SongTest(unittest.TestCase):
       pygame.mixer.music.load(e.resource.fileName("songs", "defy", "guitar.ogg"))
       shutil.rmtree(tmp)
     
-  
+  def testChartCache(self):
+    tmp = tempfile.mkdtemp()
+    try:
+      for f in ["song.ini", "notes.mid"]:
+        shutil.copy(os.path.join("..", "data", "songs", "defy", f), tmp)
+      infoFile  = os.path.join(tmp, "song.ini")
+      noteFile  = os.path.join(tmp, "notes.mid")
+      cacheFile = chartCacheFileName(noteFile)
+
+      def events(song):
+        return [[(time, e.number, e.length, e.special, e.tappable) for time, e in track.getAllEvents() if isinstance(e, Note)]
+                for track in song.tracks]
+
+      song1 = Song(None, infoFile, None, None, None, noteFile)
+      assert os.path.isfile(cacheFile)
+      song2 = Song(None, infoFile, None, None, None, noteFile)
+      assert song1.bpm == song2.bpm
+      assert song1.tempoMap.getMarkers() == song2.tempoMap.getMarkers()
+      assert events(song1) == events(song2)
+
+      # Editing the chart invalidates the cache
+      track = song2.tracks[0]
+      time, note = [(time, e) for time, e in track.getAllEvents() if isinstance(e, Note)][0]
+      track.removeEvent(time, note)
+      song2.save()
+      song3 = Song(None, infoFile, None, None, None, noteFile)
+      assert len(events(song3)[0]) == len(events(song1)[0]) - 1
+      assert events(Song(None, infoFile, None, None, None, noteFile)) == events(song3)
+    finally:
+      shutil.rmtree(tmp)
+
+class TrackTest(unittest.TestCase):
+  def testRangeQueries(self):
+    t = Track()
+    tempo = Tempo(120)
+    short = Note(0, 10)
+    hold  = Note(1, 20000)
+    late  = Note(2, 10)
+    t.addEvent(0, tempo)
+    t.addEvent(1000, late)
+    t.addEvent(100, hold)
+    t.addEvent(50, short)
+
+    assert [e for time, e in t.getAllEvents()] == [tempo, short, hold, late]
+    assert t.getEvents(0, 40) == [(0, tempo)]
+    assert t.getEvents(15000, 15100) == [(100, hold)]
+    assert t.getEvents(900, 1100) == [(100, hold), (1000, late)]
+    # Reversed ranges are accepted like before
+    assert t.getEvents(1100, 900) == t.getEvents(900, 1100)
+
+  def testEditing(self):
+    t = Track()
+    notes = [Note(i % 5, 100) for i in range(10)]
+    for i, note in enumerate(notes):
+      t.addEvent(i * 200, note)
+    t.getAllEvents()
+
+    extra = Note(3, 5000)
+    t.addEvent(450, extra)
+    assert (450, extra) in t.getEvents(3000, 3100)
+
+    t.removeEvent(450, extra)
+    t.removeEvent(200, notes[1])
+    assert (450, extra) not in t.getAllEvents()
+    assert [e for time, e in t.getEvents(0, 500)] == [notes[0], notes[2]]
+    assert len(t.times) == len(t.getAllEvents()) == 9
+
+  def testSustainedNotes(self):
+    t = Track()
+    holds = [Note(0, 20000), Note(1, 3000), Note(2, 60000)]
+    t.addEvent(0, holds[0])
+    t.addEvent(1000, holds[1])
+    t.addEvent(5000, holds[2])
+    for i in range(100):
+      t.addEvent(i * 100 + 50, Note(3, 20))
+    t.getAllEvents()
+
+    assert len(t.holds) == 3
+    assert len(t.times) == 103
+
+    def overlapping(start, end):
+      return set(id(e) for time, e in t.getEvents(start, end) if e.length > t.holdLength)
+
+    assert overlapping(3500, 3510) == set([id(holds[0]), id(holds[1])])
+    assert overlapping(4100, 4110) == set([id(holds[0])])
+    assert overlapping(30000, 30010) == set([id(holds[2])])
+    assert overlapping(70000, 70010) == set()
+
+  def _tappableState(self, track):
+    return [(time, e.number, e.tappable) for time, e in track.getAllEvents() if isinstance(e, Note)]
+
+  def _bundledSongs(self):
+    for name in ["defy", "bangbang", "twibmpg", "tutorial"]:
+      path = os.path.join("..", "data", "songs", name)
+      yield Song(None, os.path.join(path, "song.ini"), None, None, None, os.path.join(path, "notes.mid"))
+
+  def testVectorizedTappable(self):
+    for song in self._bundledSongs():
+      for track in song.tracks:
+        track.updateReference()
+        reference = self._tappableState(track)
+        track.update()
+        assert self._tappableState(track) == reference
+
+    # Tempo changes switch the tick scale in the middle of the track
+    t = Track()
+    t.addEvent(0, Tempo(120))
+    for i in range(40):
+      if i % 10 == 5:
+        t.addEvent(i * 150, Tempo(90 + i * 3))
+      t.addEvent(i * 150, Note(i % 3, 50))
+      if i % 7 == 0:
+        t.addEvent(i * 150, Note(4, 50))
+    t.updateReference()
+    reference = self._tappableState(t)
+    t.update()
+    assert self._tappableState(t) == reference
+
+  def testIncrementalTappable(self):
+    song = next(self._bundledSongs())
+    track = song.tracks[0]
+    notes = [(time, e) for time, e in track.getAllEvents() if isinstance(e, Note)]
+
+    for i in range(0, len(notes), 25):
+      time, note = notes[i]
+      track.removeEvent(time, note)
+      track.updateNear(time)
+      state = self._tappableState(track)
+      track.updateReference()
+      assert state == self._tappableState(track)
+
+      time += 120
+      track.addEvent(time, Note((note.number + 1) % 5, 30))
+      track.updateNear(time)
+      state = self._tappableState(track)
+      track.updateReference()
+      assert state == self._tappableState(track)
+
+  def testChordTable(self):
+    import random
+    rng = random.Random(7)
+    for song in self._bundledSongs():
+      track = song.tracks[0]
+      chords = track.getChordTable()
+      assert track.getChordTable() is chords
+      notes = [(time, e) for time, e in track.getAllEvents() if isinstance(e, Note)]
+      assert chords.notes == notes
+      for time, note in notes:
+        note.played = rng.random() < 0.3
+
+      for chord in range(len(chords)):
+        chordNotes = chords.getNotes(chord)
+        assert chords.times[chord] == chordNotes[0][0]
+        assert chords.masks[chord] == sum(set(1 << n.number for t, n in chordNotes))
+        assert chords.lengths[chord] == min(n.length for t, n in chordNotes)
+        assert chords.tappable[chord] == all(n.tappable for t, n in chordNotes)
+        assert chords.special[chord] == any(n.special for t, n in chordNotes)
+
+      for pos in [rng.uniform(-500, notes[-1][0] + 500) for i in range(300)] + [t for t, n in notes[:50]]:
+        # Required notes the way Guitar used to filter them
+        required = [(t, e) for t, e in track.getEvents(pos - 80, pos + 80) if isinstance(e, Note) and not e.played]
+        required = [(t, e) for t, e in required if pos - 80 <= t <= pos + 80]
+        if required:
+          first = min(t for t, e in required)
+          required = [(t, e) for t, e in required if t - first < 1e-3]
+
+        lo, hi = chords.getNoteRange(pos - 80, pos + 80)
+        found = [(t, e) for t, e in chords.notes[lo:hi] if not e.played]
+        if found:
+          found = [(t, e) for t, e in found if t - found[0][0] < 1e-3]
+        assert found == required
+
+        following = [t for t in chords.times if t > pos]
+        chord = chords.getNextChord(pos)
+        assert (chords.times[chord] if chord is not None else None) == (following[0] if following else None)
+        nearest = chords.getNearestChord(pos)
+        assert abs(chords.times[nearest] - pos) == min(abs(chords.times - pos))
+
+      nps = chords.getNotesPerSecond()
+      assert nps.sum() == len(notes)
+      assert nps[int(notes[0][0] // 1000)] > 0
+
+      # Edits invalidate the table
+      track.removeEvent(*notes[0])
+      assert track.getChordTable() is not chords
+      assert len(track.getChordTable().notes) == len(notes) - 1
+
+  def testNoteCursor(self):
+    import random
+    rng = random.Random(11)
+    for song in self._bundledSongs():
+      track = song.tracks[0]
+      chords = track.getChordTable()
+      cursor = NoteCursor(track)
+      end = chords.noteTimes[-1] + 1000
+
+      # Playing forward in uneven steps, with occasional small steps back
+      # like the ones key events stamped in the past make
+      pos = -2000.0
+      while pos < end:
+        pos += rng.uniform(0, 40) if rng.random() < 0.9 else rng.uniform(-30, 2000)
+        assert cursor.getNoteRange("required", pos - 80, pos + 80) == (chords,) + chords.getNoteRange(pos - 80, pos + 80)
+        assert cursor.getNoteRange("missed", pos - 160, pos - 80) == (chords,) + chords.getNoteRange(pos - 160, pos - 80)
+        start = pos - 500
+        assert list(cursor.getEventRange(start, pos + 2500)) == list(track.getEventRange(start, pos + 2500))
+
+      # Seeking back
+      cursor.reset()
+      for pos in [rng.uniform(-500, end) for i in range(50)]:
+        assert cursor.getNoteRange("required", pos - 80, pos + 80) == (chords,) + chords.getNoteRange(pos - 80, pos + 80)
+        assert list(cursor.getEventRange(pos - 500, pos + 2500)) == list(track.getEventRange(pos - 500, pos + 2500))
+
+      # Edits are picked up
+      time, note = chords.notes[0]
+      track.removeEvent(time, note)
+      assert cursor.getNoteRange("required", time - 80, time + 80) == (track.getChordTable(),) + track.getChordTable().getNoteRange(time - 80, time + 80)
+      assert list(cursor.getEventRange(time - 500, time + 2500)) == list(track.getEventRange(time - 500, time + 2500))
+
+class TempoMapTest(unittest.TestCase):
+  def _linearTime(self, markers, ticksPerBeat, tick):
+    # The original walk over every preceding tempo marker
+    def ticksToBeats(ticks, bpm):
+      return (60000.0 * ticks) / (bpm * ticksPerBeat)
+    scaledTime = 0.0
+    markerTime, currentBpm = 0.0, markers[0][1]
+    for time, bpm in markers:
+      if time > tick:
+        break
+      scaledTime += ticksToBeats(time - markerTime, currentBpm)
+      markerTime, currentBpm = time, bpm
+    return scaledTime + ticksToBeats(tick - markerTime, currentBpm)
+
+  def testConversions(self):
+    import random
+    rng = random.Random(5)
+    tempoMap = TempoMap(96)
+    assert tempoMap.ticksToTime(100) == 0.0
+    assert tempoMap.getBpm(0.0) is None
+
+    markers = []
+    tick = rng.randint(0, 200)
+    for i in range(200):
+      markers.append((tick, rng.uniform(60.0, 240.0)))
+      tick += rng.randint(1, 400)
+    for tick, bpm in markers:
+      tempoMap.addTempo(tick, bpm)
+
+    for tick in [0, 1, markers[0][0], markers[-1][0]] + [rng.randint(0, tick + 1000) for i in range(500)]:
+      time = tempoMap.ticksToTime(tick)
+      assert time == self._linearTime(markers, 96, tick)
+      assert abs(tempoMap.timeToTicks(time) - tick) < 1e-6
+
+    for i, (tick, bpm) in enumerate(markers):
+      time = tempoMap.ticksToTime(tick)
+      assert tempoMap.getBpm(time) == bpm
+      assert tempoMap.getChanges(time, time + 1e-6) == [(time, bpm)]
+
+    # Out of order markers are sorted into place
+    shuffled = TempoMap(96)
+    for tick, bpm in reversed(markers):
+      shuffled.addTempo(tick, bpm)
+    assert shuffled.getMarkers() == markers
+    assert shuffled.times == tempoMap.times
+
+  def testSaveTempoChanges(self):
+    tmp = tempfile.mkdtemp()
+    try:
+      shutil.copy(os.path.join("..", "data", "songs", "defy", "song.ini"), tmp)
+      infoFile  = os.path.join(tmp, "song.ini")
+      noteFile  = os.path.join(tmp, "notes.mid")
+
+      song = Song(None, infoFile, None, None, None, None)
+      song.noteFileName = noteFile
+      song.setBpm(120.0)
+      for tick, bpm in [(0, 120.0), (1920, 96.0), (3840, 150.0)]:
+        song.tempoMap.addTempo(tick, bpm)
+      for tick in range(0, 7680, 240):
+        song.tracks[0].addEvent(song.tempoMap.ticksToTime(tick), Note(tick // 240 % 5, 100))
+      song.save()
+
+      loaded = Song(None, infoFile, None, None, None, noteFile)
+      assert loaded.tempoMap.getMarkers() == song.tempoMap.getMarkers()
+      times = [time for time, e in loaded.tracks[0].getAllEvents() if isinstance(e, Note)]
+      expected = [time for time, e in song.tracks[0].getAllEvents()]
+      assert len(times) == len(expected)
+      for a, b in zip(times, expected):
+        assert abs(a - b) < 1e-6
+    finally:
+      shutil.rmtree(tmp)
+
+class MidiReaderTest(unittest.TestCase):
+  class Recorder(midi.MidiOutStream):
+    def __init__(self):
+      midi.MidiOutStream.__init__(self)
+      self.log = []
+
+    def tempo(self, value):
+      self.log.append((self.get_current_track(), self.abs_time(), "tempo", value))
+
+    def note_on(self, channel, note, velocity):
+      self.log.append((self.get_current_track(), self.abs_time(), "on", channel, note, velocity))
+
+    def note_off(self, channel, note, velocity):
+      self.log.append((self.get_current_track(), self.abs_time(), "off", channel, note, velocity))
+
+  def _callbacks(self, fileName, raw = True):
+    recorder = self.Recorder()
+    midiIn = midi.MidiInFile(recorder, fileName)
+    if raw:
+      midiIn.read()
+    else:
+      midiIn._read_mido()
+    return recorder.log
+
+  def testRunningStatus(self):
+    track = bytes([
+      0x00, 0xff, 0x51, 0x03, 0x07, 0xa1, 0x20,       # tempo 500000
+      0x00, 0xf0, 0x03, 0x43, 0x12, 0xf7,             # sysex
+      0x00, 0x90, 0x60, 0x64,                         # note on
+      0x10, 0x61, 0x7f,                               # running status
+      0x81, 0x00, 0x60, 0x00,                         # note on, velocity 0
+      0x00, 0xc0, 0x05,                               # program change
+      0x20, 0x80, 0x61, 0x40,                         # note off
+      0x00, 0xff, 0x2f, 0x00,
+    ])
+    tmp = tempfile.mkdtemp()
+    try:
+      fileName = os.path.join(tmp, "notes.mid")
+      with open(fileName, "wb") as f:
+        f.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, 480))
+        f.write(b"MTrk" + struct.pack(">I", len(track)) + track)
+
+      log = self._callbacks(fileName)
+      assert log == self._callbacks(fileName, raw = False)
+      assert log == [
+        (0, 0, "tempo", 500000),
+        (0, 0, "on", 0, 0x60, 0x64),
+        (0, 16, "on", 0, 0x61, 0x7f),
+        (0, 144, "off", 0, 0x60, 0),
+        (0, 176, "off", 0, 0x61, 0x40),
+      ]
+
+      # Truncated tracks are rejected by the scanner
+      with open(fileName, "wb") as f:
+        f.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, 480))
+        f.write(b"MTrk" + struct.pack(">I", len(track)) + track[:-6])
+      self.assertRaises(midi.SmfError, midi.read_events, fileName)
+    finally:
+      shutil.rmtree(tmp)
+
+  def testBundledSongs(self):
+    for name in ["defy", "bangbang", "twibmpg", "tutorial"]:
+      fileName = os.path.join("..", "data", "songs", name, "notes.mid")
+      assert self._callbacks(fileName) == self._callbacks(fileName, raw = False)
+
+      info = MidiInfoReader()
+      info.read(fileName)
+      reference = MidiInfoReader()
+      try:
+        midi.MidiInFile(reference, fileName)._read_mido()
+      except MidiInfoReader.Done:
+        pass
+      assert info.difficulties == reference.difficulties
+
+class SongInfoTest(unittest.TestCase):
+  def testLazyHighscores(self):
+    tmp = tempfile.mkdtemp()
+    try:
+      infoFile = os.path.join(tmp, "song.ini")
+      shutil.copy(os.path.join("..", "data", "songs", "defy", "song.ini"), infoFile)
+
+      info = SongInfo(infoFile)
+      assert info.name == "Defy The Machine"
+      assert info._highScores is None and info._difficulties is None
+
+      difficulty = info.difficulties[0]
+      assert info.addHighscore(difficulty, 1000, 3, "Player") == 0
+      assert info.getHighscores(difficulty) == [(1000, 3, "Player")]
+
+      info.name = "Renamed"
+      info.save()
+      assert info._highScores is None and info._difficulties is None
+      assert SongInfo(infoFile).name == "Renamed"
+    finally:
+      shutil.rmtree(tmp)
+
+class SongIndexTest(unittest.TestCase):
+  def testIndex(self):
+    tmp = tempfile.mkdtemp()
+    try:
+      songRoot = os.path.join(tmp, "songs")
+      for name in ["defy", "tutorial"]:
+        shutil.copytree(os.path.join("..", "data", "songs", name), os.path.join(songRoot, name))
+      os.mkdir(os.path.join(songRoot, "empty"))
+      indexFile = os.path.join(tmp, "songindex.db")
+
+      def infos():
+        index = SongIndex(indexFile)
+        try:
+          entries = index.getDirectory(songRoot)
+          return entries, [index.getSongInfo(os.path.join(songRoot, name, "song.ini")) for name in sorted(entries["songs"])]
+        finally:
+          index.close()
+
+      entries, songs = infos()
+      assert sorted(entries["dirs"]) == ["defy", "empty", "tutorial"]
+      assert sorted(entries["songs"]) == ["defy", "tutorial"]
+      assert not entries["library"]
+
+      # The second scan is served from the index without parsing song.ini
+      entries2, songs2 = infos()
+      assert entries2 == entries
+      for song, cached in zip(songs, songs2):
+        assert cached._info is None
+        assert (cached.name, cached.artist, cached.delay, cached.tutorial, cached.cassetteColor) == \
+               (song.name, song.artist, song.delay, song.tutorial, song.cassetteColor)
+        assert [d.id for d in cached.difficulties] == [d.id for d in song.difficulties]
+        assert cached.getHighscores(cached.difficulties[0]) == song.getHighscores(song.difficulties[0])
+
+      # Changing song.ini or adding a song refreshes the index
+      song = songs2[0]
+      song.name = "Renamed"
+      song.save()
+      st = os.stat(song.fileName)
+      os.utime(song.fileName, ns = (st.st_atime_ns, st.st_mtime_ns + 10**9))
+      shutil.copytree(os.path.join("..", "data", "songs", "bangbang"), os.path.join(songRoot, "bangbang"))
+      st = os.stat(songRoot)
+      os.utime(songRoot, ns = (st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+      entries3, songs3 = infos()
+      assert sorted(entries3["songs"]) == ["bangbang", "defy", "tutorial"]
+      assert songs3[1].name == "Renamed"
+    finally:
+      shutil.rmtree(tmp)
+
+  def testStaleEntries(self):
+    tmp = tempfile.mkdtemp()
+    try:
+      songRoot = os.path.join(tmp, "songs")
+      shutil.copytree(os.path.join("..", "data", "songs", "defy"), os.path.join(songRoot, "defy"))
+      os.mkdir(os.path.join(songRoot, "pending"))
+      indexFile = os.path.join(tmp, "songindex.db")
+      infoFile = os.path.join(songRoot, "defy", "song.ini")
+
+      index = SongIndex(indexFile)
+      try:
+        assert index.getDirectory(songRoot)["songs"] == ["defy"]
+        assert [d.id for d in index.getSongInfo(infoFile).difficulties] == [2, 1, 0]
+
+        # Neither of these touches the mtime of the song root or of song.ini
+        rootStat = os.stat(songRoot)
+        shutil.copy(infoFile, os.path.join(songRoot, "pending", "song.ini"))
+        os.utime(songRoot, ns = (rootStat.st_atime_ns, rootStat.st_mtime_ns))
+        with open(os.path.join(songRoot, "defy", "notes.mid"), "r+b") as f:
+          f.write(b"garbage")
+
+        assert sorted(index.getDirectory(songRoot)["songs"]) == ["defy", "pending"]
+        assert len(index.getSongInfo(infoFile).difficulties) == len(difficulties)
+      finally:
+        index.close()
+    finally:
+      shutil.rmtree(tmp)
+
+  def testScanLibrary(self):
+    class Engine:
+      pass
+
+    tmp = tempfile.mkdtemp()
+    try:
+      for name in ["defy", "bangbang", "twibmpg", "tutorial"]:
+        shutil.copytree(os.path.join("..", "data", "songs", name), os.path.join(tmp, "songs", name))
+      engine = Engine()
+      engine.resource = Resource(tmp)
+
+      batches = []
+      songs = scanLibrary(engine, workers = 3, callback = batches.append, batchSize = 1)
+      assert [s.songName for s in songs] == [s.songName for s in getAvailableSongs(engine)]
+      assert sorted(s.songName for s in songs) == ["bangbang", "defy", "twibmpg"]
+      assert sorted(s.songName for batch in batches for s in batch) == sorted(s.songName for s in songs)
+
+      # Everything is indexed now and reported at once
+      batches = []
+      songs2 = scanLibrary(engine, workers = 3, callback = batches.append)
+      assert len(batches) == 1 and all(song._info is None for song in batches[0])
+      assert [s.name for s in songs2] == [s.name for s in songs]
+    finally:
+      shutil.rmtree(tmp)
+
 if __name__ == "__main__":
   unittest.main()
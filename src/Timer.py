@@ -34,6 +34,8 @@ class Timer(object):
     self.fpsEstimateStartTick  = self.ticks
     self.fpsEstimateStartFrame = self.frame
     self.highPriority          = False
+    self.idleCallback          = None
+    self.frameCallback         = None
 
   def getTime(self):
     return int(pygame.time.get_ticks() * self.tickrate)
@@ -46,9 +48,15 @@ class Timer(object):
       diff = ticks - self.ticks
       if diff >= self.timestep:
         break
+      if self.idleCallback:
+        self.idleCallback()
       if not self.highPriority:
         pygame.time.wait(0)
 
+    # Let the owner act on what came in while waiting before the frame runs
+    if self.frameCallback:
+      self.frameCallback()
+
     self.ticks = ticks
     self.frame += 1
 
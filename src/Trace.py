@@ -0,0 +1,246 @@
+#####################################################################
+# -*- coding: iso-8859-1 -*-                                        #
+#                                                                   #
+# Frets on Fire                                                     #
+# Copyright (C) 2006 Sami Kystil                                  #
+#                                                                   #
+# This program is free software; you can redistribute it and/or     #
+# modify it under the terms of the GNU General Public License       #
+# as published by the Free Software Foundation; either version 2    #
+# of the License, or (at your option) any later version.            #
+#                                                                   #
+# This program is distributed in the hope that it will be useful,   #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of    #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the     #
+# GNU General Public License for more details.                      #
+#                                                                   #
+# You should have received a copy of the GNU General Public License #
+# along with this program; if not, write to the Free Software       #
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,        #
+# MA  02110-1301, USA.                                              #
+#####################################################################
+
+"""
+Structured tracing.
+
+Trace points write fixed-size records into a preallocated ring and return;
+formatting and writing them out happens later, either on demand with
+L{flush} or from a background thread. Call sites check L{enabled} before
+gathering their arguments, so a disabled trace point costs a single global
+lookup::
+
+  if Trace.enabled:
+      Trace.trace(Trace.MISS, pos, ...)
+"""
+
+import threading
+import time
+
+import numpy
+
+import Log
+
+# Record kinds
+KEY = 1
+MISS = 2
+PICK = 3
+
+NAN = float("nan")
+
+record = numpy.dtype(
+    [
+        ("kind", "u1"),
+        ("time", "<f8"),
+        ("pos", "<f8"),
+        ("values", "<f8", (2,)),
+        ("args", "<i4", (4,)),
+    ]
+)
+
+enabled = False
+tracer = None
+
+
+def _frets(mask):
+    return [n for n in range(5) if mask & (1 << n)]
+
+
+def formatRecord(r):
+    """
+    Format a trace record as a line of text.
+
+    @param r:  Record of the L{record} type
+    """
+    kind = int(r["kind"])
+    t, pos = float(r["time"]), float(r["pos"])
+    v0, v1 = [float(v) for v in r["values"]]
+    a0, a1, a2, a3 = [int(a) for a in r["args"]]
+    if kind == KEY:
+        return "%10.3f KEY  key=%d %s mods=0x%x ticks=%d" % (
+            t,
+            a0,
+            "down" if a1 else "up",
+            a2,
+            v0,
+        )
+    elif kind == MISS:
+        return (
+            "%10.3f MISS pos=%.3f req=%s req_t=%.3f held=%s controls=0x%x "
+            "nearest=%s nearest_t=%.3f"
+        ) % (t, pos, _frets(a0), v0, _frets(a1), a2, _frets(a3), v1)
+    elif kind == PICK:
+        return ("%10.3f PICK pos=%.3f req=%s req_t=%.3f held=%s %s streak=%d") % (
+            t,
+            pos,
+            _frets(a0),
+            v0,
+            _frets(a1),
+            "hit" if a2 else "miss",
+            a3,
+        )
+    return "%10.3f %d pos=%.3f values=%s args=%s" % (
+        t,
+        kind,
+        pos,
+        [v0, v1],
+        [a0, a1, a2, a3],
+    )
+
+
+class Tracer(object):
+    """
+    Ring of trace records.
+
+    The game thread is the only writer. Flushing keeps its own read position
+    in the total count of records written, so the writer never waits on it;
+    records overwritten before they were flushed are counted in C{dropped}.
+    """
+
+    def __init__(self, fileName=None, size=4096):
+        """
+        @param fileName:  File the records are flushed to, or None for the log
+        @param size:      Number of records kept
+        """
+        self.fileName = fileName
+        self.size = size
+        self.records = numpy.zeros(size, record)
+        self.count = 0
+        self.position = 0
+        self.dropped = 0
+        self.file = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopEvent = threading.Event()
+
+    def trace(self, kind, pos=NAN, v0=NAN, v1=NAN, a0=0, a1=0, a2=0, a3=0):
+        """
+        Add a record.
+
+        @param kind:    Record kind, e.g. L{MISS}
+        @param pos:     Song position in milliseconds
+        @param v0, v1:  Floating point values; meaning depends on the kind
+        @param a0, a1, a2, a3:  Integer values; meaning depends on the kind
+        """
+        self.records[self.count % self.size] = (
+            kind,
+            time.perf_counter() * 1000.0,
+            pos,
+            (v0, v1),
+            (a0, a1, a2, a3),
+        )
+        self.count += 1
+
+    def read(self, position):
+        """
+        Fetch the records added after the given position.
+
+        @param position:  Reader position from a previous call, or 0
+        @return:          (record array, new position)
+        """
+        count = self.count
+        position = max(position, count - self.size)
+        indices = numpy.arange(position, count) % self.size
+        return self.records[indices], count
+
+    def flush(self):
+        """Write out the records added since the last flush."""
+        with self.lock:
+            position = self.position
+            records, self.position = self.read(position)
+            self.dropped += max(0, self.position - len(records) - position)
+            if not len(records):
+                return
+
+            lines = [formatRecord(r) for r in records]
+            if not self.fileName:
+                for line in lines:
+                    Log.debug("[TRACE] " + line)
+                return
+            if self.file is None:
+                self.file = open(self.fileName, "w", encoding="utf-8")
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+
+    def start(self, interval=1.0):
+        """Flush periodically from a background thread."""
+        if self.thread:
+            return
+        self.stopEvent.clear()
+        self.thread = threading.Thread(
+            target=self._run, args=(interval,), name="Trace", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        """Stop the background thread and flush what is left."""
+        if self.thread:
+            self.stopEvent.set()
+            self.thread.join()
+            self.thread = None
+        self.flush()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def _run(self, interval):
+        while not self.stopEvent.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                Log.warn("Unable to flush trace: %s" % e)
+
+
+def enable(fileName=None, interval=1.0, size=4096):
+    """
+    Start tracing.
+
+    @param fileName:  File the records are written to, or None for the log
+    @param interval:  Seconds between background flushes, or None to only
+                      flush on demand
+    @param size:      Number of records kept between flushes
+    """
+    global enabled, tracer
+    if tracer is None:
+        tracer = Tracer(fileName, size)
+    if interval:
+        tracer.start(interval)
+    enabled = True
+
+
+def disable():
+    """Stop tracing and flush the remaining records."""
+    global enabled
+    enabled = False
+    if tracer:
+        tracer.stop()
+
+
+def trace(kind, pos=NAN, v0=NAN, v1=NAN, a0=0, a1=0, a2=0, a3=0):
+    """Add a record to the trace; see L{Tracer.trace}."""
+    tracer.trace(kind, pos, v0, v1, a0, a1, a2, a3)
+
+
+def flush():
+    """Write out the pending records."""
+    if tracer:
+        tracer.flush()
@@ -0,0 +1,100 @@
+#####################################################################
+# -*- coding: iso-8859-1 -*-                                        #
+#                                                                   #
+# Frets on Fire                                                     #
+# Copyright (C) 2006 Sami Kystil                                  #
+#                                                                   #
+# This program is free software; you can redistribute it and/or     #
+# modify it under the terms of the GNU General Public License       #
+# as published by the Free Software Foundation; either version 2    #
+# of the License, or (at your option) any later version.            #
+#                                                                   #
+# This program is distributed in the hope that it will be useful,   #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of    #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the     #
+# GNU General Public License for more details.                      #
+#                                                                   #
+# You should have received a copy of the GNU General Public License #
+# along with this program; if not, write to the Free Software       #
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,        #
+# MA  02110-1301, USA.                                              #
+#####################################################################
+
+import unittest
+import os
+import tempfile
+
+import Player
+import Trace
+from Simulator import Simulator, loadChart
+
+class TraceTest(unittest.TestCase):
+  def tearDown(self):
+    Trace.disable()
+    Trace.tracer = None
+
+  def testRing(self):
+    tracer = Trace.Tracer(size = 4)
+    records, position = tracer.read(0)
+    assert len(records) == 0 and position == 0
+
+    for i in range(3):
+      tracer.trace(Trace.MISS, 100.0 + i, a0 = i)
+    records, position = tracer.read(0)
+    assert list(records["pos"]) == [100.0, 101.0, 102.0]
+    assert list(records["args"][:, 0]) == [0, 1, 2]
+
+    # A reader that falls behind loses the oldest records
+    for i in range(3, 8):
+      tracer.trace(Trace.PICK, 100.0 + i, a2 = 1)
+    records, position = tracer.read(position)
+    assert list(records["pos"]) == [104.0, 105.0, 106.0, 107.0]
+    assert len(tracer.read(position)[0]) == 0
+
+  def testFlush(self):
+    fileName = os.path.join(tempfile.mkdtemp(), "trace.log")
+    tracer = Trace.Tracer(fileName, size = 4)
+    tracer.trace(Trace.KEY, v0 = 1234, a0 = 13, a1 = 1)
+    tracer.trace(Trace.MISS, 500.0, 510.0, 510.0, 0b101, 0b1, 0x40, 0b101)
+    tracer.flush()
+    for i in range(6):
+      tracer.trace(Trace.PICK, 600.0 + i, 600.0, 600.0, 1, 1, 1, i)
+    tracer.stop()
+
+    with open(fileName) as f:
+      lines = f.read().splitlines()
+    assert len(lines) == 6
+    assert "KEY  key=13 down" in lines[0]
+    assert "MISS pos=500.000 req=[0, 2]" in lines[1] and "held=[0]" in lines[1]
+    assert all("PICK" in line and "hit" in line for line in lines[2:])
+    assert tracer.dropped == 2
+
+  def testGameplay(self):
+    song = loadChart(os.path.join("..", "data", "songs", "tutorial"))
+    chords = song.track.getChordTable()
+    simulator = Simulator(song)
+
+    # Disabled trace points leave nothing behind
+    simulator.run([])
+    assert Trace.tracer is None
+
+    # Strum the first chords with the wrong fret
+    Trace.enable(interval = None)
+    times = [float(t) for t in chords.times[:4]]
+    events = []
+    for time in times:
+      events += [(time - 20, Player.KEY5, True), (time, Player.ACTION1, True),
+                 (time + 10, Player.ACTION1, False), (time + 15, Player.KEY5, False)]
+    result = simulator.run(events)
+
+    records = Trace.tracer.read(0)[0]
+    kinds = list(records["kind"])
+    assert kinds.count(Trace.PICK) == len(times)
+    assert result.misses == result.notes
+    assert kinds.count(Trace.MISS) == len(chords.times)
+    picks = records[records["kind"] == Trace.PICK]
+    assert list(picks["pos"]) == times
+    assert not picks["args"][:, 2].any()
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,149 @@
+#####################################################################
+# -*- coding: iso-8859-1 -*-                                        #
+#                                                                   #
+# Frets on Fire                                                     #
+# Copyright (C) 2006 Sami Kyostila                                  #
+#                                                                   #
+# This program is free software; you can redistribute it and/or     #
+# modify it under the terms of the GNU General Public License       #
+# as published by the Free Software Foundation; either version 2    #
+# of the License, or (at your option) any later version.            #
+#                                                                   #
+# This program is distributed in the hope that it will be useful,   #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of    #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the     #
+# GNU General Public License for more details.                      #
+#                                                                   #
+# You should have received a copy of the GNU General Public License #
+# along with this program; if not, write to the Free Software       #
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,        #
+# MA  02110-1301, USA.                                              #
+#####################################################################
+
+from OpenGL.GL import *
+from OpenGL.arrays import vbo
+import numpy
+
+import Log
+
+# Set once vertex buffer objects have failed; everything then stays in
+# client memory
+vboFailed = False
+
+
+class VertexBuffer:
+    """
+    Static vertex arrays kept in vertex buffer objects.
+
+    Holds vertex positions and optional texture coordinates and colors.
+    The arrays are uploaded on the first L{bind} after they are set; if the
+    driver has no vertex buffer objects they are drawn from client memory
+    instead.
+    """
+
+    def __init__(self, vertices, texcoords=None, colors=None):
+        self.arrays = {}
+        self.buffers = {}
+        self.setArrays(vertices, texcoords, colors)
+
+    def setArrays(self, vertices, texcoords=None, colors=None):
+        """
+        Replace the vertex data.
+
+        @param vertices:   (n, 3) vertex positions
+        @param texcoords:  (n, 2) texture coordinates or None
+        @param colors:     (n, 4) vertex colors or None
+        """
+        arrays = {
+            GL_VERTEX_ARRAY: vertices,
+            GL_TEXTURE_COORD_ARRAY: texcoords,
+            GL_COLOR_ARRAY: colors,
+        }
+        self.arrays = dict(
+            (kind, numpy.ascontiguousarray(array, numpy.float32))
+            for kind, array in arrays.items()
+            if array is not None
+        )
+        self.count = len(self.arrays[GL_VERTEX_ARRAY])
+
+        for kind in list(self.buffers):
+            if kind in self.arrays:
+                self.buffers[kind].set_array(self.arrays[kind])
+            else:
+                self.buffers.pop(kind).delete()
+
+    def setColors(self, colors):
+        """
+        Update the vertex colors in place.
+
+        Unlike L{setArrays} this keeps the vertex buffer object and only
+        copies the new colors into it on the next L{bind}.
+
+        @param colors:     (n, 4) vertex colors for the existing vertices
+        """
+        array = self.arrays[GL_COLOR_ARRAY]
+        array[:] = colors
+        buffer = self.buffers.get(GL_COLOR_ARRAY)
+        if buffer is not None:
+            buffer[:] = array
+
+    def _createBuffers(self):
+        global vboFailed
+        if vboFailed:
+            return
+        try:
+            for kind, array in self.arrays.items():
+                if kind not in self.buffers:
+                    self.buffers[kind] = vbo.VBO(array, usage="GL_STATIC_DRAW")
+                    self.buffers[kind].bind()
+                    self.buffers[kind].unbind()
+        except Exception as e:
+            Log.warn("Vertex buffer objects not available: %s" % e)
+            vboFailed = True
+            self.buffers = {}
+
+    def bind(self):
+        """Enable and point the client arrays to this buffer."""
+        self._createBuffers()
+
+        for kind, array in self.arrays.items():
+            glEnableClientState(kind)
+            buffer = self.buffers.get(kind)
+            if buffer is not None:
+                buffer.bind()
+                data = buffer
+            else:
+                data = array
+
+            if kind == GL_VERTEX_ARRAY:
+                glVertexPointer(3, GL_FLOAT, 0, data)
+            elif kind == GL_TEXTURE_COORD_ARRAY:
+                glTexCoordPointer(2, GL_FLOAT, 0, data)
+            elif kind == GL_COLOR_ARRAY:
+                glColorPointer(4, GL_FLOAT, 0, data)
+
+            if buffer is not None:
+                buffer.unbind()
+
+    def unbind(self):
+        for kind in self.arrays:
+            glDisableClientState(kind)
+
+    def draw(self, mode, first=0, count=None):
+        """
+        Draw vertices from the bound buffer.
+
+        @param mode:   Primitive type, e.g. C{GL_QUADS}
+        @param first:  First vertex to draw
+        @param count:  Number of vertices to draw, by default up to the end
+        """
+        if count is None:
+            count = self.count - first
+        if count > 0:
+            glDrawArrays(mode, first, count)
+
+    def render(self, mode):
+        """Bind, draw all vertices and unbind."""
+        self.bind()
+        self.draw(mode)
+        self.unbind()
@@ -8,6 +8,8 @@ Objetivo: manter a API mínima usada por Song.py:
   - MidiOutFile(fileobj) com header/start_of_track/update_time/tempo/note_on/note_off/end_of_track/eof/write
 
 Implementação: usa 'mido' para ler/escrever arquivos .mid de forma robusta.
+A leitura passa primeiro pelo leitor direto de bytes em midi.smf (bem mais rápido);
+o mido continua como fallback de leitura e é usado na escrita.
 Isso preserva a funcionalidade real do jogo (notes.mid e editor), sem depender do pacote legado quebrado.
 """
 
@@ -18,6 +20,18 @@ from typing import BinaryIO, List
 
 import mido
 
+from .smf import (
+    EVENT_DTYPE,
+    NOTE_OFF,
+    NOTE_ON,
+    TEMPO,
+    SmfError,
+    SmfEvents,
+    iter_events,
+    read_events,
+    replay_events,
+)
+
 
 class MidiOutStream:
     """
@@ -74,6 +88,15 @@ class MidiInFile:
         self.filename = filename
 
     def read(self):
+        # Leitor direto dos bytes; mido fica como fallback para arquivos que ele não entende
+        try:
+            smf = read_events(self.filename)
+        except SmfError:
+            self._read_mido()
+        else:
+            replay_events(smf, self.out_stream)
+
+    def _read_mido(self):
         mf = mido.MidiFile(self.filename)
 
         # Header global
@@ -0,0 +1,210 @@
+# src/midi/smf.py
+"""
+Leitor direto de Standard MIDI Files (SMF).
+
+Percorre os bytes crus de cada chunk MTrk (memoryview, varlen, running status)
+e emite apenas os eventos que o jogo usa (tempo e note on/off), sem criar um
+objeto mido por mensagem. Os chunks são lidos um a um, então quem consome
+iter_events() pode parar cedo sem ler o arquivo inteiro.
+
+O caminho por callbacks (MidiInFile + MidiOutStream) continua existindo; ver
+replay_events() e o fallback para mido em MidiInFile.read().
+"""
+
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+import numpy
+
+# Tipos de evento emitidos
+TEMPO = 0
+NOTE_ON = 1
+NOTE_OFF = 2
+
+EVENT_DTYPE = numpy.dtype(
+    [
+        ("track", "<u2"),
+        ("tick", "<i8"),
+        ("type", "u1"),
+        ("channel", "u1"),
+        ("note", "u1"),
+        ("velocity", "u1"),
+        ("tempo", "<u4"),  # microssegundos por batida (só TEMPO)
+    ]
+)
+
+# Quantidade de bytes de dados por status de canal (0x80..0xE0)
+_DATA_BYTES = {0x8: 2, 0x9: 2, 0xA: 2, 0xB: 2, 0xC: 1, 0xD: 1, 0xE: 2}
+
+
+class SmfError(Exception):
+    """Arquivo MIDI malformado ou não suportado pelo leitor direto."""
+
+
+@dataclass
+class SmfEvents:
+    format: int
+    nTracks: int
+    division: int
+    events: numpy.ndarray  # EVENT_DTYPE, na ordem do arquivo
+
+
+Event = Tuple[int, int, int, int, int, int, int]
+
+
+def _read_header(f: BinaryIO) -> Tuple[int, int, int]:
+    chunk = f.read(8)
+    if len(chunk) < 8 or chunk[:4] != b"MThd":
+        raise SmfError("not a standard MIDI file")
+    (length,) = struct.unpack(">I", chunk[4:])
+    data = f.read(length)
+    if length < 6 or len(data) < 6:
+        raise SmfError("truncated MThd chunk")
+    format, nTracks, division = struct.unpack(">HHH", data[:6])
+    if division & 0x8000:
+        raise SmfError("SMPTE time division is not supported")
+    return format, nTracks, division
+
+
+def _scan_track(
+    data: memoryview, track: int, notes: bool
+) -> Iterator[Event]:
+    end = len(data)
+    pos = 0
+    tick = 0
+    status = 0
+
+    try:
+        while pos < end:
+            # delta time (varlen)
+            b = data[pos]
+            pos += 1
+            delta = b & 0x7F
+            while b & 0x80:
+                b = data[pos]
+                pos += 1
+                delta = (delta << 7) | (b & 0x7F)
+            tick += delta
+
+            b = data[pos]
+            if b == 0xFF:
+                # meta evento: tipo, tamanho (varlen), dados
+                kind = data[pos + 1]
+                pos += 2
+                b = data[pos]
+                pos += 1
+                length = b & 0x7F
+                while b & 0x80:
+                    b = data[pos]
+                    pos += 1
+                    length = (length << 7) | (b & 0x7F)
+                if kind == 0x51 and length == 3:
+                    value = (data[pos] << 16) | (data[pos + 1] << 8) | data[pos + 2]
+                    yield (track, tick, TEMPO, 0, 0, 0, value)
+                elif kind == 0x2F:
+                    return
+                pos += length
+                continue
+
+            if b == 0xF0 or b == 0xF7:
+                # sysex: tamanho (varlen) e dados
+                pos += 1
+                b = data[pos]
+                pos += 1
+                length = b & 0x7F
+                while b & 0x80:
+                    b = data[pos]
+                    pos += 1
+                    length = (length << 7) | (b & 0x7F)
+                pos += length
+                continue
+
+            if b & 0x80:
+                status = b
+                pos += 1
+            elif not status:
+                raise SmfError("data byte without running status in track %d" % track)
+
+            high = status >> 4
+            if high == 0xF:
+                raise SmfError("unexpected status 0x%02x in track %d" % (status, track))
+            if notes and (high == 0x9 or high == 0x8):
+                note = data[pos]
+                velocity = data[pos + 1]
+                if high == 0x9 and velocity:
+                    yield (track, tick, NOTE_ON, status & 0xF, note, velocity, 0)
+                else:
+                    # note_on com vel=0 equivale a note_off
+                    yield (track, tick, NOTE_OFF, status & 0xF, note, velocity, 0)
+            pos += _DATA_BYTES[high]
+    except IndexError:
+        raise SmfError("truncated event in track %d" % track)
+
+
+def iter_events(
+    filename: str, note_tracks: Optional[int] = None
+) -> Iterator[Event]:
+    """
+    Gera (track, tick, type, channel, note, velocity, tempo) na ordem do arquivo.
+
+    note_tracks limita os eventos de nota às primeiras N tracks; os eventos de
+    tempo são emitidos de todas. O primeiro item gerado é o cabeçalho
+    (format, nTracks, division).
+    """
+    with open(filename, "rb") as f:
+        header = _read_header(f)
+        yield header
+
+        track = 0
+        while track < header[1]:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                break
+            (length,) = struct.unpack(">I", chunk[4:])
+            if chunk[:4] != b"MTrk":
+                # chunks desconhecidos devem ser ignorados
+                f.seek(length, 1)
+                continue
+            data = f.read(length)
+            if len(data) < length:
+                raise SmfError("truncated MTrk chunk")
+            notes = note_tracks is None or track < note_tracks
+            yield from _scan_track(memoryview(data), track, notes)
+            track += 1
+
+
+def read_events(filename: str, note_tracks: Optional[int] = None) -> SmfEvents:
+    """Lê os eventos de tempo e nota de um arquivo MIDI para um array NumPy."""
+    events = iter_events(filename, note_tracks)
+    format, nTracks, division = next(events)
+    return SmfEvents(
+        format, nTracks, division, numpy.array(list(events), dtype=EVENT_DTYPE)
+    )
+
+
+def replay_events(smf: SmfEvents, out_stream) -> None:
+    """Entrega os eventos lidos aos callbacks de um MidiOutStream."""
+    out_stream.header(format=smf.format, nTracks=smf.nTracks, division=smf.division)
+
+    events = smf.events
+    bounds = numpy.flatnonzero(numpy.diff(events["track"])) + 1
+    for rows in numpy.split(events, bounds) if len(events) else []:
+        out_stream._current_track = int(rows["track"][0])
+        out_stream.start_of_track()
+        last = 0
+        for track, tick, kind, channel, note, velocity, tempo in rows.tolist():
+            if tick != last:
+                out_stream.update_time(tick - last)
+                last = tick
+            if kind == TEMPO:
+                out_stream.tempo(tempo)
+            elif kind == NOTE_ON:
+                out_stream.note_on(channel, note, velocity)
+            else:
+                out_stream.note_off(channel, note, velocity)
+        out_stream.end_of_track()
+
+    out_stream.eof()